@@ -0,0 +1,170 @@
+"""
+Count the TLS handshakes a threaded workload costs with different transport settings.
+
+A local HTTPS server (self-signed certificate from the ``openssl`` command line
+tool, HTTP/1.1 and, when the ``h2`` package is there, HTTP/2) counts the
+connections it accepts while ``--threads`` threads share one
+:class:`PersistentSession` and fetch ``--requests`` URLs each, with:
+
+- requests' defaults (10 connections kept per host),
+- ``pool_maxsize`` raised to the number of threads,
+- ``http2=True`` (needs ``httpx[http2]``).
+
+Run with ``python benchmarks/connection_pool.py``. The session's cache and
+cookie files go to a temporary directory.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+BODY = b"x" * 2048
+
+
+class _HTTP1Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+
+def _serve_http2(sock: ssl.SSLSocket) -> None:
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+    conn.initiate_connection()
+    sock.sendall(conn.data_to_send())
+    while data := sock.recv(65536):
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                conn.send_headers(event.stream_id, [(":status", "200"), ("content-type", "text/plain"), ("content-length", str(len(BODY)))])
+                conn.send_data(event.stream_id, BODY, end_stream=True)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                return
+        sock.sendall(conn.data_to_send())
+
+
+class CountingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, context: ssl.SSLContext) -> None:
+        self.context = context
+        self.handshakes = 0
+        self._lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), self._Handler)
+
+    class _Handler(socketserver.BaseRequestHandler):
+        server: CountingServer
+
+        def handle(self) -> None:
+            try:
+                sock = self.server.context.wrap_socket(self.request, server_side=True)
+            except (ssl.SSLError, OSError):
+                return
+            with self.server._lock:
+                self.server.handshakes += 1
+            try:
+                if sock.selected_alpn_protocol() == "h2":
+                    _serve_http2(sock)
+                else:
+                    _HTTP1Handler(sock, self.client_address, self.server)
+            except (ssl.SSLError, OSError):
+                pass
+
+
+def _certificate(directory: Path) -> tuple[Path, Path]:
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+            "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1", "-keyout", str(key), "-out", str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )  # fmt: skip
+    return cert, key
+
+
+def _run(name: str, server: CountingServer, cert: Path, threads: int, requests_per_thread: int, **session_kwargs: object) -> dict:
+    from anti_cf import DO_NOT_CACHE, PersistentSession
+
+    session = PersistentSession(cache_policies={"127.0.0.1": DO_NOT_CACHE}, **session_kwargs)
+    url = f"https://127.0.0.1:{server.server_address[1]}/"
+
+    def work(worker: int) -> None:
+        for i in range(requests_per_thread):
+            # Passed along with every request: a session-wide ``verify`` loses to REQUESTS_CA_BUNDLE.
+            session.request("GET", f"{url}{worker}/{i}", verify=str(cert)).raise_for_status()
+
+    server.handshakes = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(work, range(threads)))
+    elapsed = time.perf_counter() - start
+    session.close()
+    return {"name": name, "requests": threads * requests_per_thread, "handshakes": server.handshakes, "seconds": round(elapsed, 3)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=50, help="requests per thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before anti_cf is imported: its cache directory lives under the home directory.
+        os.environ["HOME"] = tmp
+        cert, key = _certificate(Path(tmp))
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+        context.set_alpn_protocols(["h2", "http/1.1"])
+
+        server = CountingServer(context)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        scenarios: list[tuple[str, dict]] = [
+            ("default pool (10 per host)", {}),
+            (f"pool_maxsize={args.threads}", {"pool_maxsize": args.threads}),
+        ]
+        try:
+            import h2  # noqa: F401
+            import httpx  # noqa: F401
+        except ImportError:
+            print("httpx[http2] isn't installed; skipping the HTTP/2 run", file=sys.stderr)
+        else:
+            scenarios.append(("http2", {"http2": True}))
+
+        results = [_run(name, server, cert, args.threads, args.requests, **kwargs) for name, kwargs in scenarios]
+        server.shutdown()
+
+    width = max(len(r["name"]) for r in results)
+    print(f"{'scenario':<{width}}  {'requests':>8}  {'handshakes':>10}  {'seconds':>8}")
+    for r in results:
+        print(f"{r['name']:<{width}}  {r['requests']:>8}  {r['handshakes']:>10}  {r['seconds']:>8}")
+
+
+if __name__ == "__main__":
+    socket.setdefaulttimeout(30)
+    main()
@@ -0,0 +1,206 @@
+"""
+Local stand-ins for a Cloudflare-fronted site and for FlareSolverr, so benchmarks never touch the internet.
+
+:class:`FakeCloudflareOrigin` challenges every request that doesn't carry a
+valid ``cf_clearance`` cookie, and :class:`FakeFlareSolverr` "solves" those
+challenges by having the origin issue a clearance, after a configurable delay.
+"""
+
+from __future__ import annotations
+
+import json
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Self
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+_CHALLENGE_PAGE = b"""<!DOCTYPE html><html lang="en-US"><head><title>Just a moment...</title>
+<script>window._cf_chl_opt={cvId: '3', cType: 'managed'};</script></head>
+<body><div id="challenge-body-text">Checking if the site connection is secure</div>
+<script src="/cdn-cgi/challenge-platform/h/g/orchestrate/chl_page/v1"></script></body></html>"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes: with Nagle's algorithm, the
+    # body would wait for the client's delayed ACK, some 40ms per response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *_args: object) -> None:
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler: type[BaseHTTPRequestHandler]) -> None:
+        super().__init__(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class FakeCloudflareOrigin:
+    """
+    A site behind Cloudflare's managed challenge.
+
+    Requests without a valid ``cf_clearance`` get Cloudflare's challenge page:
+    a 403 with ``cf-mitigated: challenge``. A clearance is good for
+    ``clearance_ttl`` seconds, and only along with the User-Agent it was
+    issued to, as with the real thing. Pages are ``body_size`` bytes and take
+    ``latency`` seconds to come.
+    """
+
+    def __init__(self, *, clearance_ttl: float = 1800.0, latency: float = 0.0, body_size: int = 16_384) -> None:
+        self.clearance_ttl = clearance_ttl
+        self.latency = latency
+        self.body = (b"<html><body>" + b"x" * body_size + b"</body></html>")[:body_size]
+        self.pages = 0
+        self.challenges = 0
+        # Token -> (User-Agent, expiry as Unix time).
+        self._clearances: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._server = _Server(self._handler())
+
+    @property
+    def url(self) -> str:
+        return self._server.url
+
+    def issue_clearance(self, user_agent: str) -> tuple[str, float]:
+        """A fresh ``cf_clearance`` value for ``user_agent``, and when it expires."""
+        token, expires = secrets.token_urlsafe(32), time.time() + self.clearance_ttl
+        with self._lock:
+            self._clearances[token] = (user_agent, expires)
+        return token, expires
+
+    def expire_clearances(self) -> None:
+        """Make every clearance issued so far invalid, as when they all run out at once."""
+        with self._lock:
+            self._clearances.clear()
+
+    def _is_cleared(self, cookie_header: str | None, user_agent: str | None) -> bool:
+        morsel = SimpleCookie(cookie_header or "").get("cf_clearance")
+        if morsel is None:
+            return False
+        with self._lock:
+            clearance = self._clearances.get(morsel.value)
+        return clearance is not None and clearance[0] == user_agent and clearance[1] > time.time()
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        origin = self
+
+        class Handler(_Handler):
+            def do_GET(self) -> None:
+                cleared = origin._is_cleared(self.headers.get("Cookie"), self.headers.get("User-Agent"))
+                with origin._lock:
+                    if cleared:
+                        origin.pages += 1
+                    else:
+                        origin.challenges += 1
+                if not cleared:
+                    self._reply(403, _CHALLENGE_PAGE, {"cf-mitigated": "challenge", "Cache-Control": "private, no-store"})
+                    return
+                if origin.latency:
+                    time.sleep(origin.latency)
+                self._reply(200, origin.body, {})
+
+            def _reply(self, status: int, body: bytes, headers: dict[str, str]) -> None:
+                self.send_response(status)
+                self.send_header("Server", "cloudflare")
+                self.send_header("CF-RAY", f"{secrets.token_hex(8)}-AMS")
+                self.send_header("Content-Type", "text/html; charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def stop(self) -> None:
+        self._server.stop()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_exc: object) -> None:
+        self.stop()
+
+
+class FakeFlareSolverr:
+    """
+    FlareSolverr's API, solving challenges of a :class:`FakeCloudflareOrigin`.
+
+    Every ``request.get`` takes ``solve_delay`` seconds, the time a browser
+    spends on the challenge, and comes back with a clearance the origin
+    issued for :data:`USER_AGENT`. ``solves`` counts them.
+    """
+
+    def __init__(self, origin: FakeCloudflareOrigin, *, solve_delay: float = 1.0) -> None:
+        self.origin = origin
+        self.solve_delay = solve_delay
+        self.solves = 0
+        self._lock = threading.Lock()
+        self._server = _Server(self._handler())
+
+    @property
+    def url(self) -> str:
+        return self._server.url
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        solver = self
+
+        class Handler(_Handler):
+            def _reply(self, payload: dict) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                self._reply({"msg": "FlareSolverr is ready!", "version": "fake", "userAgent": USER_AGENT})
+
+            def do_POST(self) -> None:
+                command = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with solver._lock:
+                    solver.solves += 1
+                time.sleep(solver.solve_delay)
+                token, expires = solver.origin.issue_clearance(USER_AGENT)
+                cookie = {"name": "cf_clearance", "value": token, "domain": "127.0.0.1", "path": "/", "expires": int(expires)}
+                self._reply(
+                    {
+                        "status": "ok",
+                        "message": "Challenge solved!",
+                        "solution": {
+                            "url": command.get("url"),
+                            "status": 200,
+                            "headers": {"content-type": "text/html; charset=UTF-8"},
+                            "response": solver.origin.body.decode(),
+                            "cookies": [cookie],
+                            "userAgent": USER_AGENT,
+                        },
+                    }
+                )
+
+        return Handler
+
+    def stop(self) -> None:
+        self._server.stop()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_exc: object) -> None:
+        self.stop()
@@ -0,0 +1,245 @@
+"""
+Measure PersistentSession's throughput and latency against a fake Cloudflare-fronted site, fully offline.
+
+A local origin challenges requests without a valid ``cf_clearance`` and a
+local FlareSolverr stand-in solves the challenges after ``--solve-delay``
+seconds (see ``fakes.py``). Scenarios, each run with every thread count of
+``--threads``:
+
+- ``origin``: every request goes to the origin (caching off), with a valid clearance.
+- ``cache_hit``: every request is answered from the response cache.
+- ``cookies``: single-threaded origin requests per cookie persistence mode
+  (saved after every request, debounced, SQLite), for the cost of saving.
+- ``solve_amplification``: the clearance expires and every thread hits the
+  site at once; ideally that takes a single solve, whatever the thread count.
+
+Run with ``python benchmarks/suite.py``. Results are printed and stored as JSON
+in ``benchmarks/results/`` (or ``--output``); ``--compare`` an earlier file to
+see what changed. Cache and cookie files go to a temporary directory.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from importlib import metadata
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from fakes import FakeCloudflareOrigin, FakeFlareSolverr
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from anti_cf import PersistentSession
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def _percentiles(latencies: list[float]) -> dict[str, float]:
+    if len(latencies) < 2:
+        latency = latencies[0] if latencies else 0.0
+        return {"p50_ms": round(latency * 1000, 3), "p99_ms": round(latency * 1000, 3)}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"p50_ms": round(cuts[49] * 1000, 3), "p99_ms": round(cuts[98] * 1000, 3)}
+
+
+def _hammer(threads: int, requests_per_thread: int, fetch: Callable[[int, int], None]) -> dict[str, float]:
+    """Run ``fetch(thread, i)`` ``requests_per_thread`` times on each of ``threads`` threads; throughput and latencies."""
+    latencies: list[list[float]] = [[] for _ in range(threads)]
+
+    def work(thread: int) -> None:
+        for i in range(requests_per_thread):
+            start = time.perf_counter()
+            fetch(thread, i)
+            latencies[thread].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(work, range(threads)))
+    elapsed = time.perf_counter() - start
+    flat = [latency for per_thread in latencies for latency in per_thread]
+    return {"requests": len(flat), "rps": round(len(flat) / elapsed, 1), **_percentiles(flat)}
+
+
+def _session(solver: FakeFlareSolverr, threads: int, **kwargs: object) -> PersistentSession:
+    from anti_cf import FlareSolverrPool, PersistentSession
+
+    return PersistentSession(flaresolverr_pool=FlareSolverrPool([solver.url]), pool_maxsize=max(threads, 10), **kwargs)
+
+
+def _get(session: PersistentSession, url: str) -> None:
+    response = session.get(url, try_with_cloudflare=True)
+    if response is None or response.status_code != 200:
+        raise RuntimeError(f"Benchmark request failed [url: {url}] [response: {response}]")
+
+
+def origin_scenario(origin: FakeCloudflareOrigin, solver: FakeFlareSolverr, threads: int, requests_per_thread: int) -> dict:
+    from anti_cf import DO_NOT_CACHE
+
+    session = _session(solver, threads, cache_policies={"127.0.0.1": DO_NOT_CACHE}, cookie_save_interval=5.0)
+    _get(session, origin.url)  # Gets the clearance
+    result = _hammer(threads, requests_per_thread, lambda t, i: _get(session, f"{origin.url}{t}/{i}"))
+    session.close()
+    return result
+
+
+def cache_hit_scenario(origin: FakeCloudflareOrigin, solver: FakeFlareSolverr, threads: int, requests_per_thread: int) -> dict:
+    session = _session(solver, threads, cookie_save_interval=5.0)
+    session.cache.clear()
+    urls = [f"{origin.url}cached/{i}" for i in range(requests_per_thread)]
+    for url in urls:
+        _get(session, url)
+
+    pages_before = origin.pages
+    result = _hammer(threads, requests_per_thread, lambda _t, i: _get(session, urls[i]))
+    result["origin_requests"] = origin.pages - pages_before
+    session.close()
+    if result["origin_requests"]:
+        # Anything that reached the origin wasn't a cache hit, and would be timed as one.
+        raise RuntimeError(f"Cache hit benchmark reached the origin [origin_requests: {result['origin_requests']}]")
+    return result
+
+
+def cookies_scenario(origin: FakeCloudflareOrigin, solver: FakeFlareSolverr, mode: str, requests_per_thread: int) -> dict:
+    from anti_cf import DO_NOT_CACHE
+
+    kwargs = {"every_request": {}, "debounced": {"cookie_save_interval": 5.0}, "sqlite": {"cookie_store": "sqlite"}}[mode]
+    session = _session(solver, 1, cache_policies={"127.0.0.1": DO_NOT_CACHE}, **kwargs)
+    _get(session, origin.url)
+    result = _hammer(1, requests_per_thread, lambda _t, i: _get(session, f"{origin.url}cookies/{i}"))
+    result["cookie_save_ms"] = round(session.stats()["cookie_save_time"]["mean"] * 1000, 3)
+    session.close()
+    return result
+
+
+def solve_amplification_scenario(origin: FakeCloudflareOrigin, solver: FakeFlareSolverr, threads: int) -> dict:
+    from anti_cf import DO_NOT_CACHE
+
+    session = _session(solver, threads, cache_policies={"127.0.0.1": DO_NOT_CACHE}, cookie_save_interval=5.0)
+    _get(session, origin.url)
+    origin.expire_clearances()
+    solves_before = solver.solves
+
+    barrier = threading.Barrier(threads)
+
+    def fetch(thread: int, _i: int) -> None:
+        barrier.wait()
+        _get(session, f"{origin.url}stampede/{thread}")
+
+    result = _hammer(threads, 1, fetch)
+    solves = solver.solves - solves_before
+    session.close()
+    return {**result, "solves": solves, "solves_per_thread": round(solves / threads, 3)}
+
+
+def run(args: argparse.Namespace) -> list[dict]:
+    results: list[dict] = []
+
+    def record(scenario: str, variant: str, threads: int, result: dict) -> None:
+        results.append({"scenario": scenario, "variant": variant, "threads": threads, **result})
+        print(f"  {scenario:<20} {variant:<14} threads={threads:<4} " + " ".join(f"{k}={v}" for k, v in result.items()), file=sys.stderr)
+
+    with (
+        FakeCloudflareOrigin(latency=args.origin_latency, body_size=args.body_size) as origin,
+        FakeFlareSolverr(origin, solve_delay=args.solve_delay) as solver,
+    ):
+        for threads in args.threads:
+            record("origin", "", threads, origin_scenario(origin, solver, threads, args.requests))
+        try:
+            import requests_cache  # noqa: F401
+        except ImportError:
+            print("requests_cache isn't installed; skipping the cache hit runs", file=sys.stderr)
+        else:
+            for threads in args.threads:
+                record("cache_hit", "", threads, cache_hit_scenario(origin, solver, threads, args.requests))
+        for mode in ("every_request", "debounced", "sqlite"):
+            record("cookies", mode, 1, cookies_scenario(origin, solver, mode, args.requests))
+        for threads in args.threads:
+            record("solve_amplification", "", threads, solve_amplification_scenario(origin, solver, threads))
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _version() -> str:
+    try:
+        return metadata.version("anti_cf")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def compare(results: list[dict], baseline: dict) -> None:
+    """Print every metric next to its value in ``baseline`` (an earlier results file), with the change in percent."""
+    previous = {(r["scenario"], r["variant"], r["threads"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline['version']} ({baseline.get('commit') or 'no commit'}, {baseline['timestamp']}):")
+    for r in results:
+        old = previous.get((r["scenario"], r["variant"], r["threads"]))
+        if old is None:
+            continue
+        changes = []
+        for key in ("rps", "p50_ms", "p99_ms", "cookie_save_ms", "solves_per_thread"):
+            if key in r and key in old:
+                delta = f"{(r[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else "n/a"
+                changes.append(f"{key} {old[key]} -> {r[key]} ({delta})")
+        print(f"  {r['scenario']:<20} {r['variant']:<14} threads={r['threads']:<4} " + ", ".join(changes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=lambda s: [int(n) for n in s.split(",")], default=[1, 4, 16], help="comma separated thread counts")
+    parser.add_argument("--requests", type=int, default=200, help="requests per thread")
+    parser.add_argument("--solve-delay", type=float, default=0.5, help="seconds a fake solve takes")
+    parser.add_argument("--origin-latency", type=float, default=0.0, help="seconds the fake origin takes per page")
+    parser.add_argument("--body-size", type=int, default=16_384, help="bytes per page")
+    parser.add_argument("--output", type=Path, help="where to store the results (default: benchmarks/results/)")
+    parser.add_argument("--compare", type=Path, help="an earlier results file to compare with")
+    parser.add_argument("--verbose", action="store_true", help="keep anti_cf's log output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before anti_cf is imported: its cache directory lives under the home directory.
+        os.environ["HOME"] = tmp
+        from logprise import logger
+
+        if not args.verbose:
+            logger.disable("anti_cf")
+        results = run(args)
+
+    timestamp = datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+    report = {
+        "version": _version(),
+        "commit": _git_commit(),
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k in ("threads", "requests", "solve_delay", "origin_latency", "body_size")},
+        "results": results,
+    }
+    output = args.output or RESULTS_DIR / f"{report['version']}-{report['commit'] or 'nocommit'}-{timestamp.replace(':', '')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf8")
+    print(f"Results written to {output}")
+
+    if args.compare is not None:
+        compare(results, json.loads(args.compare.read_text(encoding="utf8")))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,26 @@
-from ._persistent_session import session
+from ._async_session import AsyncPersistentSession
+from ._cache_policy import DO_NOT_CACHE, EXPIRE_IMMEDIATELY, NEVER_EXPIRE, ExpiryPolicy
+from ._flaresolverr import FlareSolverrPool
+from ._http2 import HTTP2Adapter
+from ._identities import IdentityPool
+from ._metrics import Metrics
+from ._persistent_session import PersistentSession, session
+from ._rate_limit import RateLimiter
+from ._timing import Phase, Timings
 
 __all__ = [
+    "DO_NOT_CACHE",
+    "EXPIRE_IMMEDIATELY",
+    "NEVER_EXPIRE",
+    "AsyncPersistentSession",
+    "ExpiryPolicy",
+    "FlareSolverrPool",
+    "HTTP2Adapter",
+    "IdentityPool",
+    "Metrics",
+    "PersistentSession",
+    "Phase",
+    "RateLimiter",
+    "Timings",
     "session",
 ]
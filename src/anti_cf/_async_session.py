@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Self, TypeVar
+from urllib.parse import urlsplit
+
+from logprise import logger
+
+from ._persistent_session import PersistentSession, _SolveDeferred
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from types import TracebackType
+
+    from requests import Response
+    from requests.cookies import RequestsCookieJar
+    from requests.structures import CaseInsensitiveDict
+
+_T = TypeVar("_T")
+
+
+class AsyncPersistentSession:
+    """
+    asyncio front-end for :class:`PersistentSession`.
+
+    All the behaviour (cookie persistence, the User-Agent, the SQLite response
+    cache, the FlareSolverr fallback) lives in the wrapped ``PersistentSession``;
+    this class only moves the blocking calls onto a dedicated thread pool so one
+    event loop can keep ``max_concurrency`` requests in flight.
+
+    Clearance state is shared: every coroutine uses the same cookie jar, and a
+    challenge for a host is solved by one coroutine while the others hitting the
+    same host await it and reuse the resulting ``cf_clearance`` cookie.
+    """
+
+    def __init__(self, session: PersistentSession | None = None, *, max_concurrency: int = 256) -> None:
+        if session is None:
+            # requests keeps 10 pooled connections per host by default; with a few
+            # hundred worker threads the surplus would be opened and thrown away
+            # on every request.
+            session = PersistentSession(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+
+        self.session = session
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="anti_cf")
+        self._solve_locks: dict[str, asyncio.Lock] = {}
+
+    @property
+    def cookies(self) -> RequestsCookieJar:
+        return self.session.cookies
+
+    @property
+    def headers(self) -> CaseInsensitiveDict:
+        return self.session.headers
+
+    async def _run(self, func: Callable[..., _T], *args: object, **kwargs: object) -> _T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def request(self, method: str, url: str | bytes, **kwargs: object) -> Response:
+        return await self._run(self.session.request, method, url, **kwargs)
+
+    async def post(self, url: str | bytes, **kwargs: object) -> Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def get(
+        self,
+        url: str | bytes,
+        *,
+        try_with_cloudflare: bool = False,
+        refetch_after_solve: bool | None = None,
+        **kwargs: object,
+    ) -> Response | None:
+        """
+        Awaitable counterpart of :meth:`PersistentSession.get`.
+
+        The request runs ``PersistentSession.get`` on the thread pool, so stale
+        responses and timings behave as for a blocking ``get``, except for the
+        challenge: that comes back to the event loop, where :meth:`solve_challenge`
+        queues the coroutines hitting the host instead of their worker threads.
+        The request then runs again with the clearance.
+        """
+
+        def defer(_url: str | bytes) -> None:
+            raise _SolveDeferred
+
+        get = functools.partial(self._run, self.session.get, url, try_with_cloudflare=try_with_cloudflare, refetch_after_solve=refetch_after_solve, **kwargs)
+        try:
+            return await get(_solve=defer)
+        except _SolveDeferred:
+            pass
+
+        try:
+            dta = await self.solve_challenge(url)
+        except Exception:
+            logger.error(f"FlareSolverr didn't solve it :( [url: {url}]")
+            raise
+        return await get(_solve=lambda _url: dta)
+
+    async def solve_challenge(self, url: str | bytes) -> dict | None:
+        """
+        Solve the Cloudflare challenge for ``url`` through FlareSolverr.
+
+        Only one solve per host runs at a time. Coroutines that queue up behind it
+        skip their own solve when the clearance cookie changed while they waited,
+        and return ``None`` instead of the FlareSolverr payload. Waiting happens
+        on the event loop, so queued coroutines don't pin worker threads; the
+        solve itself goes through :meth:`PersistentSession._solve_challenge` and
+        therefore also coalesces with other threads and processes.
+        """
+        host = urlsplit(url if isinstance(url, str) else url.decode()).hostname or ""
+        lock = self._solve_locks.setdefault(host, asyncio.Lock())
+
+        clearance_before = self.session._clearance_for(url)
+        async with lock:
+            if self.session._is_new_clearance(url, clearance_before):
+                return None
+
+            return await self._run(self.session._solve_challenge, url)
+
+    async def aclose(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, tb: TracebackType | None) -> None:
+        await self.aclose()
@@ -0,0 +1,492 @@
+from __future__ import annotations
+
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import suppress
+from datetime import timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Final
+
+from logprise import logger
+from requests_cache.backends import BaseCache
+from requests_cache.backends.sqlite import SQLiteCache, SQLiteDict
+from requests_cache.models import CachedResponse
+from requests_cache.serializers import CattrStage, SerializerPipeline, Stage
+from urllib3 import HTTPResponse
+
+from ._timing import phase
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from datetime import datetime
+
+    from requests import Response
+    from requests_cache.backends import StrOrPath
+    from requests_cache.serializers import SerializerType
+
+# Rows deleted per transaction by a purge: big enough to be quick, small enough
+# that concurrent requests never wait long for the write lock.
+PURGE_BATCH_SIZE: Final = 500
+
+# Reads only note the access time in memory; they reach the database in one
+# transaction once this many piled up or this many seconds went by.
+ACCESS_FLUSH_SIZE: Final = 256
+ACCESS_FLUSH_INTERVAL: Final = 60.0
+
+# Once over ``max_bytes``, evict down to this fraction of it, so the next few
+# writes don't each trigger another eviction.
+EVICTION_LOW_WATERMARK: Final = 0.9
+
+# Layout of the responses table's extra columns and indexes, kept in the
+# database's ``user_version``; bump it with every change to ``ResponsesDict.init_db``.
+SCHEMA_VERSION: Final = 1
+
+# Columns ``ResponsesDict`` adds to requests_cache's ``responses`` table.
+_EXTRA_COLUMNS: Final = {"created_at": "INTEGER", "size": "INTEGER", "last_access": "INTEGER", "raw_size": "INTEGER"}
+
+
+# Bodies smaller than this aren't worth a compressor call.
+COMPRESS_MIN_BYTES: Final = 512
+
+# Bodies in these formats are compressed already; squeezing them again only burns CPU.
+_INCOMPRESSIBLE = re.compile(
+    r"(image/(?!svg)|video/|audio/|font/woff|application/(zip|gzip|x-gzip|zstd|x-bzip2|x-xz|x-7z-compressed|x-rar-compressed|pdf|wasm|octet-stream))",
+    re.IGNORECASE,
+)
+
+# Marks an unstructured response whose ``_content`` is compressed, and with what.
+_CODEC_KEY: Final = "_anti_cf_codec"
+
+# Header of a cached response whose body lives in a file rather than in the database.
+BODY_FILE_HEADER: Final = "X-Anti-CF-Body-File"
+
+
+def _zstd_codec() -> tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]] | None:
+    try:
+        from compression import zstd  # Python 3.14+
+
+        return zstd.compress, zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard.compress, zstandard.decompress
+
+
+_CODECS: dict[str, tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {"zlib": (zlib.compress, zlib.decompress)}
+if (_zstd := _zstd_codec()) is not None:
+    _CODECS["zstd"] = _zstd
+WRITE_CODEC: Final = "zstd" if "zstd" in _CODECS else "zlib"
+
+
+def _compressible(headers: dict | None) -> bool:
+    content_type = next((v for k, v in (headers or {}).items() if k.lower() == "content-type"), "")
+    return not _INCOMPRESSIBLE.match(content_type.strip())
+
+
+class CompressingPickleStage:
+    """
+    Pickle stage that compresses response bodies on the way in.
+
+    It sits where requests_cache's pickle serializer has its ``pickle`` stage,
+    after the cattrs stage turned the response into a dict: only the body is
+    compressed (``zstd`` when available, ``zlib`` otherwise), and only when
+    its ``Content-Type`` isn't compressed already. Entries stored without
+    compression, by older versions or because compressing didn't pay off,
+    load unchanged.
+    """
+
+    def __init__(self, codec: str = WRITE_CODEC) -> None:
+        self.codec = codec
+        self._local = threading.local()
+
+    def take_saved(self) -> int:
+        """Bytes compression saved in this thread's latest :meth:`dumps`."""
+        saved, self._local.saved = getattr(self._local, "saved", 0), 0
+        return saved
+
+    def compress(self, value: object) -> object:
+        """Compress the body of an unstructured response, when it's worth it."""
+        self._local.saved = 0
+        if not isinstance(value, dict) or _CODEC_KEY in value:
+            return value
+        content = value.get("_content")
+        if not content or len(content) < COMPRESS_MIN_BYTES or not _compressible(value.get("headers")):
+            return value
+
+        packed = _CODECS[self.codec][0](content)
+        if len(packed) >= len(content):
+            return value
+        self._local.saved = len(content) - len(packed)
+        return {**value, "_content": packed, _CODEC_KEY: self.codec}
+
+    def dumps(self, value: object) -> bytes:
+        return pickle.dumps(self.compress(value))
+
+    def loads(self, data: bytes) -> object:
+        value = pickle.loads(data)
+        if isinstance(value, dict) and (codec := value.pop(_CODEC_KEY, None)) is not None:
+            if codec not in _CODECS:
+                raise ImportError(f"Cached response is {codec}-compressed, which needs the zstandard package")
+            try:
+                value["_content"] = _CODECS[codec][1](value["_content"])
+            except Exception as e:
+                # Reported as a plain cache miss by requests_cache.
+                raise ValueError(f"Corrupt {codec}-compressed response: {e}") from e
+        return value
+
+
+def compressing_serializer() -> SerializerPipeline:
+    """requests_cache's pickle serializer, with :class:`CompressingPickleStage` for its pickle stage."""
+    # The name and number of stages are part of every cache key; keeping them
+    # equal to the plain pickle serializer's keeps existing entries reachable.
+    return SerializerPipeline([CattrStage(), Stage(CompressingPickleStage())], name="pickle", is_binary=True)
+
+
+def _unix(dt: datetime | None) -> int | None:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        # requests_cache stores naive datetimes as UTC.
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+class ResponsesDict(SQLiteDict):
+    """
+    The ``responses`` table, with ``created_at``, ``last_access``, ``size`` and ``raw_size`` columns next to ``expires``.
+
+    requests_cache only keeps ``expires`` outside the pickled response, so any
+    other question about the cache contents (how old, how big, how recently
+    used) would mean unpickling every row. The extra columns are filled on
+    write; rows written before they existed are backfilled once per database
+    (see :data:`SCHEMA_VERSION`), when it's first opened: the sizes with plain
+    SQL, in batches (see :meth:`_backfill_created_at` for the ages). ``raw_size`` is what the row would take without
+    body compression.
+    """
+
+    def __init__(self, db_path: StrOrPath, table_name: str = "responses", **kwargs: object) -> None:
+        # Set before ``super().__init__``, which already opens the database.
+        self._accessed: dict[str, int] = {}
+        self._accessed_flushed_at = time.monotonic()
+        # Reads note access times from any thread; a flush swaps the batch out under it.
+        self._accessed_lock = threading.Lock()
+        self._written = 0
+        super().__init__(db_path, table_name, **kwargs)
+        stage = getattr(self.serializer, "stages", [None])[-1]
+        self._compressor = stage.obj if isinstance(getattr(stage, "obj", None), CompressingPickleStage) else None
+
+    def init_db(self) -> None:
+        # Taken before opening the database changes it, for the backfill.
+        written = [Path(f"{self.db_path}{suffix}") for suffix in ("", "-wal")]
+        last_write = int(max((path.stat().st_mtime for path in written if path.is_file()), default=time.time()))
+        super().init_db()
+        with self.connection(commit=True) as con:
+            # Migrating means scanning the table, so it runs once per database rather than on every
+            # open. The columns are checked too: ``clear()`` drops the table and recreates it bare.
+            columns = {row[1] for row in con.execute(f"PRAGMA table_info({self.table_name})")}
+            if con.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION and columns >= set(_EXTRA_COLUMNS):
+                return
+            for column, kind in _EXTRA_COLUMNS.items():
+                if column not in columns:
+                    con.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {column} {kind}")
+            con.execute(f"CREATE INDEX IF NOT EXISTS created_at_idx ON {self.table_name}(created_at)")
+            # Covers both the LRU order and the sizes, so neither eviction nor the size and
+            # compression totals ever read the table itself.
+            con.execute("DROP INDEX IF EXISTS last_access_idx")
+            con.execute(f"CREATE INDEX IF NOT EXISTS lru_idx ON {self.table_name}(last_access, size, raw_size)")
+            con.execute(f"UPDATE {self.table_name} SET size = length(value) WHERE size IS NULL")
+            con.execute(f"UPDATE {self.table_name} SET raw_size = size WHERE raw_size IS NULL")
+        self._backfill_created_at(last_write)
+        # Only now: an interrupted backfill picks up where it stopped on the next open.
+        with self.connection(commit=True) as con:
+            con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _backfill_created_at(self, last_write: int) -> None:
+        """
+        Fill in ``created_at`` (and ``last_access``) of legacy rows, without reading their responses.
+
+        When a legacy row was created is only known to its pickle, and
+        unpickling a multi-gigabyte cache would take minutes. Its expiry and
+        ``last_write`` (when the database file was last written) are both no earlier than
+        its creation, so the earlier of the two stands in: it errs on the side
+        of keeping the row, but not by years. Rows are updated
+        ``PURGE_BATCH_SIZE`` at a time, one transaction each.
+        """
+        while True:
+            with self._lock, self.connection(commit=True) as con:
+                cur = con.execute(
+                    f"UPDATE {self.table_name} SET created_at = MIN(COALESCE(expires, ?1), ?1), last_access = COALESCE(last_access, MIN(COALESCE(expires, ?1), ?1)) "
+                    f"WHERE rowid IN (SELECT rowid FROM {self.table_name} WHERE created_at IS NULL LIMIT ?2)",
+                    (last_write, PURGE_BATCH_SIZE),
+                )
+            if cur.rowcount < PURGE_BATCH_SIZE:
+                return
+
+    def __getitem__(self, key: str) -> CachedResponse:
+        value = super().__getitem__(key)
+        with self._accessed_lock:
+            self._accessed[key] = int(time.time())
+            due = len(self._accessed) >= ACCESS_FLUSH_SIZE or time.monotonic() - self._accessed_flushed_at >= ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush_access_times()
+        return value
+
+    def _write(self, key: str, value: object) -> None:
+        expires = getattr(value, "expires_unix", None)
+        now = int(time.time())
+        created_at = _unix(getattr(value, "created_at", None)) or now
+        value = self.serialize(value)
+        raw_size = len(value) + (self._compressor.take_saved() if self._compressor is not None else 0)
+        with self.connection(commit=True) as con:
+            con.execute(
+                f"INSERT OR REPLACE INTO {self.table_name} (key,value,expires,created_at,size,last_access,raw_size) VALUES (?,?,?,?,?,?,?)",
+                (key, value, expires, created_at, len(value), now, raw_size),
+            )
+        self._written += len(value)
+
+    def flush_access_times(self) -> None:
+        """Write the access times noted by reads since the last flush."""
+        with self._accessed_lock:
+            accessed, self._accessed = self._accessed, {}
+            self._accessed_flushed_at = time.monotonic()
+        if not accessed:
+            return
+        with self.connection(commit=True) as con:
+            con.executemany(f"UPDATE {self.table_name} SET last_access = ? WHERE key = ?", [(at, key) for key, at in accessed.items()])
+
+    def expires(self, key: str) -> int | None:
+        """When the response under ``key`` expires, as a Unix timestamp, read without unpickling it; ``None`` when it never does or isn't there."""
+        with self.connection() as con:
+            row = con.execute(f"SELECT expires FROM {self.table_name} WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def take_written(self) -> int:
+        """Bytes written since the previous call."""
+        written, self._written = self._written, 0
+        return written
+
+    def total_size(self) -> int:
+        """Bytes used by all stored responses."""
+        with self.connection() as con:
+            return con.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table_name}").fetchone()[0]
+
+    def compression_ratio(self) -> float:
+        """How many times smaller body compression made the stored responses (``1.0``: not at all)."""
+        with self.connection() as con:
+            raw, stored = con.execute(f"SELECT COALESCE(SUM(raw_size), 0), COALESCE(SUM(size), 0) FROM {self.table_name}").fetchone()
+        return raw / stored if stored else 1.0
+
+    def compress_existing(self, *, batch_size: int = 100) -> int:
+        """
+        Compress the bodies of responses stored without compression; returns how many were rewritten.
+
+        Rows are rewritten ``batch_size`` at a time, one transaction each, so
+        the cache stays usable meanwhile and memory use stays flat. Running it
+        again only skips over what's already done.
+        """
+        if self._compressor is None:
+            return 0
+
+        rewritten, last_rowid = 0, 0
+        while True:
+            with self.connection() as con:
+                rowids = [
+                    row[0] for row in con.execute(f"SELECT rowid FROM {self.table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size))
+                ]
+            if not rowids:
+                return rewritten
+            last_rowid = rowids[-1]
+
+            with self._lock, self.connection(commit=True) as con:
+                for rowid in rowids:
+                    row = con.execute(f"SELECT value FROM {self.table_name} WHERE rowid = ?", (rowid,)).fetchone()
+                    if row is None:
+                        continue
+                    try:
+                        value = pickle.loads(row[0])
+                    except Exception:  # Unreadable anyway; left for requests_cache to report
+                        continue
+                    packed = self._compressor.compress(value)
+                    if packed is value:
+                        continue
+                    blob = pickle.dumps(packed)
+                    con.execute(f"UPDATE {self.table_name} SET value = ?, size = ? WHERE rowid = ?", (sqlite3.Binary(blob), len(blob), rowid))
+                    rewritten += 1
+
+    def evict_lru(self, max_bytes: int, target_bytes: int, *, batch_size: int = PURGE_BATCH_SIZE) -> tuple[int, int]:
+        """
+        If the stored responses take more than ``max_bytes``, delete the least recently used ones until they fit in ``target_bytes``.
+
+        Returns the number of responses deleted and the size left.
+        """
+        self.flush_access_times()
+        total = self.total_size()
+        deleted = 0
+        if total <= max_bytes:
+            return deleted, total
+
+        while total > target_bytes:
+            with self._lock, self.connection(commit=True) as con:
+                victims = []
+                for key, size in con.execute(f"SELECT key, size FROM {self.table_name} ORDER BY last_access LIMIT ?", (batch_size,)):
+                    if total <= target_bytes:
+                        break
+                    victims.append(key)
+                    total -= size or 0
+                if not victims:
+                    break
+                con.execute(f"DELETE FROM {self.table_name} WHERE key IN ({','.join('?' * len(victims))})", victims)
+            deleted += len(victims)
+        return deleted, total
+
+    def delete_where(self, condition: str, params: tuple = (), *, batch_size: int = PURGE_BATCH_SIZE) -> int:
+        """
+        Delete the rows matching the SQL ``condition``, ``batch_size`` rows per transaction.
+
+        Only keys are read, so memory use doesn't depend on the size of the
+        cache. Returns the number of rows deleted.
+        """
+        deleted = 0
+        while True:
+            with self._lock, self.connection(commit=True) as con:
+                cur = con.execute(
+                    f"DELETE FROM {self.table_name} WHERE key IN (SELECT key FROM {self.table_name} WHERE {condition} LIMIT ?)",
+                    (*params, batch_size),
+                )
+            deleted += cur.rowcount
+            if cur.rowcount < batch_size:
+                return deleted
+
+
+class BodyFileResponse(CachedResponse):
+    """
+    A cached response whose body stays in its file until it's read.
+
+    ``content`` loads the file the first time it's asked for, while
+    ``iter_content`` streams it, as for a response fetched with
+    ``stream=True``; either way the body is only read once.
+    """
+
+    @property
+    def _content_consumed(self) -> bool:
+        return self._content is not False
+
+    @_content_consumed.setter
+    def _content_consumed(self, value: bool) -> None:
+        pass
+
+
+class ResponseCache(SQLiteCache):
+    """
+    :class:`SQLiteCache` storing its responses in a :class:`ResponsesDict`, so evictions run as indexed SQL.
+
+    With ``max_bytes`` set, every write that takes the cache over budget evicts
+    the least recently used responses right away, instead of letting the file
+    grow until the next purge. Unless given another ``serializer``, response
+    bodies are stored compressed (see :class:`CompressingPickleStage`).
+    """
+
+    responses: ResponsesDict
+
+    def __init__(self, db_path: StrOrPath, serializer: SerializerType | None = None, *, max_bytes: int | None = None, **kwargs: object) -> None:
+        # Same as ``SQLiteCache.__init__``, with the responses table swapped out.
+        BaseCache.__init__(self, cache_name=str(db_path), **kwargs)
+        skwargs = {"serializer": serializer or compressing_serializer(), **kwargs}
+        self.responses = ResponsesDict(db_path, table_name="responses", **skwargs)
+        self.redirects = SQLiteDict(db_path, table_name="redirects", lock=self.responses._lock, serializer=None, **kwargs)
+
+        self.max_bytes = max_bytes
+        # Running estimate of the size on disk: exact after an eviction check,
+        # then grown by what this process writes. Other processes' writes are
+        # noticed at the next check, which always recounts.
+        self._size: int | None = None
+        self._size_lock = threading.Lock()
+
+    def save_response(self, response: Response, cache_key: str | None = None, expires: datetime | None = None) -> None:
+        with phase("cache_write"):
+            super().save_response(response, cache_key, expires)
+            if self.max_bytes is not None:
+                self._enforce_budget(self.max_bytes)
+
+    def _enforce_budget(self, max_bytes: int) -> None:
+        with self._size_lock:
+            written = self.responses.take_written()
+            if self._size is not None:
+                self._size += written
+                if self._size <= max_bytes:
+                    return
+
+            deleted, self._size = self.responses.evict_lru(max_bytes, int(max_bytes * EVICTION_LOW_WATERMARK))
+
+        if deleted:
+            logger.info(f"Evicted {deleted} least recently used responses from the cache [max_bytes: {max_bytes}]")
+            self._prune_redirects()
+
+    def save_body_file(self, response: Response, path: Path, cache_key: str | None = None, expires: datetime | None = None) -> None:
+        """
+        Cache ``response`` with its body kept in the file at ``path`` instead of in the database.
+
+        Only a reference to the file is stored, so a multi-gigabyte download
+        doesn't end up as a blob in SQLite (nor counts against ``max_bytes``).
+        Reading the response back loads the body from the file; once the file
+        is gone, the response is too.
+        """
+        response._content = b""
+        response.headers[BODY_FILE_HEADER] = str(Path(path).resolve())
+        try:
+            self.save_response(response, cache_key, expires)
+        finally:
+            del response.headers[BODY_FILE_HEADER]
+
+    def body_file(self, key: str) -> Path | None:
+        """The file holding the body of the unexpired response under ``key``, if that's where it is."""
+        response = super().get_response(key)
+        if response is None or response.is_expired or (path := response.headers.get(BODY_FILE_HEADER)) is None:
+            return None
+        path = Path(path)
+        return path if path.is_file() else None
+
+    def get_response(self, key: str, default: object = None) -> CachedResponse | None:
+        with phase("cache_lookup"):
+            response = super().get_response(key, default)
+            if response is default or (path := response.headers.pop(BODY_FILE_HEADER, None)) is None:
+                return response
+            try:
+                # Closed once the body has been read, as a streamed response's connection is.
+                body = Path(path).open("rb")  # noqa: SIM115
+            except OSError:
+                logger.warning(f"Cached body file is gone, dropping the response [path: {path}]")
+                self.responses.pop(key, None)
+                return default
+            # The file holds the decoded body, whatever encoding the origin sent it in.
+            headers = {name: value for name, value in response.headers.items() if name.lower() != "content-encoding"}
+            response.__class__ = BodyFileResponse
+            response._content = False
+            response.raw = HTTPResponse(body=body, headers=headers, status=response.status_code, preload_content=False, request_url=response.url)
+            return response
+
+    def close(self) -> None:
+        self.responses.flush_access_times()
+        super().close()
+
+    def _delete_expired(self) -> None:
+        # Used by ``delete(expired=True)``; batched instead of one long DELETE.
+        self.delete_expired()
+
+    def delete_expired(self) -> int:
+        """Delete every expired response; returns how many."""
+        return self.responses.delete_where("expires <= ?", (int(time.time()),))
+
+    def delete_older_than(self, cutoff: datetime) -> int:
+        """Delete every response created before ``cutoff``, whatever its expiry; returns how many."""
+        deleted = self.responses.delete_where("created_at < ?", (_unix(cutoff),))
+        if deleted:
+            self._prune_redirects()
+        return deleted
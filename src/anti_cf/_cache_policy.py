@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import contextlib
+import re
+import threading
+from datetime import timedelta
+from typing import TYPE_CHECKING, TypeAlias
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping
+
+try:
+    from requests_cache import DO_NOT_CACHE, EXPIRE_IMMEDIATELY, NEVER_EXPIRE
+except ImportError:
+    # Same values as requests_cache's; without it nothing is cached anyway.
+    DO_NOT_CACHE = 0x0D0E0200020704
+    EXPIRE_IMMEDIATELY = 0
+    NEVER_EXPIRE = -1
+
+Expiry: TypeAlias = int | float | timedelta
+
+_GLOB_CHARS = re.compile(r"[*?]")
+
+# Matches any URL, as a requests_cache ``urls_expire_after`` pattern.
+_ANY_URL = re.compile("")
+
+
+def _glob_to_regex(glob: str, *, star: str) -> str:
+    parts = []
+    for token in re.split(r"(\*+|\?)", glob):
+        if token.startswith("*"):
+            parts.append(star)
+        elif token == "?":
+            parts.append(".")
+        else:
+            parts.append(re.escape(token))
+    return "".join(parts)
+
+
+def _seconds(expiry: Expiry) -> int:
+    if expiry == DO_NOT_CACHE:
+        return DO_NOT_CACHE
+    if isinstance(expiry, timedelta):
+        expiry = expiry.total_seconds()
+    if expiry < 0:
+        return NEVER_EXPIRE
+    return int(expiry)
+
+
+class ExpiryPolicy:
+    """
+    Cache expiry per host and URL pattern, matched without trying the rules one by one.
+
+    Rules map a pattern to a number of seconds (or a ``timedelta``),
+    ``DO_NOT_CACHE``, ``NEVER_EXPIRE`` or ``EXPIRE_IMMEDIATELY`` (cache, but
+    revalidate on every use), as understood by requests_cache. Patterns look like requests_cache's
+    ``urls_expire_after`` keys: ``host[/path]``, scheme optional, ``*`` and
+    ``?`` as wildcards, and anything after the pattern matching too, so
+    ``example.com/static`` also covers ``example.com/static/app.js?v=3``. A
+    ``*`` in the host stays within the host name (``*.example.com``); in the
+    path it matches across ``/``. When several rules match, the first one wins.
+
+    Rules whose host has no wildcard are indexed by host, with all their paths
+    compiled into one regular expression per host; the remaining rules are
+    compiled into a single regular expression together. A lookup is a dict hit
+    plus at most two regex matches, however many rules there are.
+    """
+
+    def __init__(self, rules: Mapping[str, Expiry]) -> None:
+        self._expiries = [_seconds(expiry) for expiry in rules.values()]
+
+        by_host: dict[str, list[str]] = {}
+        wildcard_hosts: list[str] = []
+        for index, pattern in enumerate(rules):
+            host, _, path = pattern.split("://")[-1].partition("/")
+            host = host.lower()
+            path_regex = f"/{_glob_to_regex(path, star='.*')}" if path else ""
+            # Each alternative is a group named after the rule's position, so the
+            # match tells which rule it was.
+            if _GLOB_CHARS.search(host):
+                # The lookahead keeps ``*.example.com`` from matching ``a.example.community``.
+                wildcard_hosts.append(f"(?P<r{index}>{_glob_to_regex(host, star='[^/]*')}(?=/){path_regex})")
+            else:
+                by_host.setdefault(host, []).append(f"(?P<r{index}>{path_regex})")
+
+        # Alternatives are tried left to right, so the earliest rule that matches is the one reported.
+        self._by_host = {host: re.compile("|".join(paths)) for host, paths in by_host.items()}
+        self._wildcard = re.compile("|".join(wildcard_hosts)) if wildcard_hosts else None
+
+    def __len__(self) -> int:
+        return len(self._expiries)
+
+    def expire_after(self, url: str) -> int | None:
+        """The expiry of the first rule matching ``url`` in seconds, or ``None`` when no rule does."""
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        matched = []
+        if (paths := self._by_host.get(host)) is not None and (m := paths.match(path)):
+            matched.append(int(m.lastgroup[1:]))
+        if self._wildcard is not None and (m := self._wildcard.match(host + path)):
+            matched.append(int(m.lastgroup[1:]))
+        return self._expiries[min(matched)] if matched else None
+
+
+class UrlExpiry(dict):
+    """
+    requests_cache's ``urls_expire_after`` setting, holding just the expiry of the request being sent.
+
+    requests_cache tries its ``urls_expire_after`` patterns one by one on the
+    URL of every request. Instead of handing it all the rules of an
+    :class:`ExpiryPolicy`, the session looks the URL up itself before sending
+    and sets the result for the thread with :meth:`applying`; this mapping
+    then answers with that single rule. Unlike a per-request ``expire_after``,
+    that leaves the request headers alone, and ``DO_NOT_CACHE`` keeps the
+    response out of the cache as well as skipping the lookup.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._local = threading.local()
+
+    def __bool__(self) -> bool:
+        # requests_cache skips an empty ``urls_expire_after``; this one is never empty when it matters.
+        return True
+
+    def items(self) -> list[tuple[re.Pattern, int]]:
+        expiry = getattr(self._local, "expiry", None)
+        return [] if expiry is None else [(_ANY_URL, expiry)]
+
+    @property
+    def pinned(self) -> bool:
+        """Whether an enclosing :meth:`applying` fixed the expiry for every request in it."""
+        return getattr(self._local, "pinned", False)
+
+    @contextlib.contextmanager
+    def applying(self, expiry: int | None, *, pinned: bool = False) -> Iterator[None]:
+        """
+        Apply ``expiry`` (``None``: the session's default) to what this thread sends in the block.
+
+        With ``pinned``, it also applies to the requests nested in the block,
+        instead of each looking up its own URL.
+        """
+        previous = getattr(self._local, "expiry", None), self.pinned
+        self._local.expiry, self._local.pinned = expiry, pinned
+        try:
+            yield
+        finally:
+            self._local.expiry, self._local.pinned = previous
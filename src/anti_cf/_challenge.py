@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Final
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from requests import Response
+
+# Statuses Cloudflare serves its interstitial pages with.
+CHALLENGE_STATUSES: Final = frozenset({403, 429, 503})
+
+# The challenge page announces itself in its <title>, well within the first few kB.
+PREFIX_BYTES: Final = 8192
+_MARKERS: Final = (b"just a moment", b"cf_chl_opt", b"/cdn-cgi/challenge-platform/", b"cf-challenge")
+
+
+class _PrefixedRaw:
+    """A streamed response's ``raw``, with the bytes :func:`body_prefix` already read from it put back in front."""
+
+    def __init__(self, prefix: bytes, raw: object) -> None:
+        self._prefix = prefix
+        self._raw = raw
+
+    def read(self, amt: int | None = None, *_args: object, **_kwargs: object) -> bytes:
+        # The prefix was read decoded, so the rest has to be as well.
+        if not self._prefix:
+            return self._raw.read(amt, decode_content=True)
+        if amt is None:
+            data, self._prefix = self._prefix + self._raw.read(decode_content=True), b""
+            return data
+        data, self._prefix = self._prefix[:amt], self._prefix[amt:]
+        return data
+
+    def stream(self, amt: int = 2**16, *_args: object, **_kwargs: object) -> Iterator[bytes]:
+        # What ``Response.iter_content`` uses when it's there.
+        while self._prefix:
+            yield self.read(amt)
+        yield from self._raw.stream(amt, decode_content=True)
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self._raw, name)
+
+
+def body_prefix(response: Response, size: int = PREFIX_BYTES) -> bytes:
+    """
+    At most the first ``size`` bytes of the body, downloading no more than that.
+
+    For a response requested with ``stream=True`` whose body wasn't read yet,
+    the bytes are read ahead from ``response.raw`` and handed out again when
+    the body is read later, so the response stays intact.
+    """
+    if response._content is not False:  # Already downloaded (or read by someone else)
+        return (response._content or b"")[:size]
+
+    prefix = response.raw.read(size, decode_content=True) or b""
+    response.raw = _PrefixedRaw(prefix, response.raw)
+    return prefix
+
+
+def is_cloudflare_challenge(response: Response) -> bool:
+    """
+    Tell whether ``response`` is a Cloudflare challenge page rather than the origin's own answer.
+
+    The headers decide when they can: ``cf-mitigated: challenge`` is what
+    Cloudflare sends with every challenge, while a status Cloudflare never
+    challenges with, a response that didn't come through Cloudflare, or one
+    that isn't HTML can't be a challenge. Only a Cloudflare HTML error without
+    ``cf-mitigated`` (older challenge pages, or a plain block page) has its
+    body looked at, and then only the first :data:`PREFIX_BYTES`.
+    """
+    headers = response.headers
+    if headers.get("cf-mitigated", "").lower() == "challenge":
+        return True
+    if response.status_code not in CHALLENGE_STATUSES:
+        return False
+    if not headers.get("server", "").lower().startswith("cloudflare") and "cf-ray" not in headers:
+        return False
+    if "html" not in headers.get("content-type", "").lower():
+        return False
+
+    prefix = body_prefix(response).lower()
+    return any(marker in prefix for marker in _MARKERS)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from http.cookiejar import Cookie, CookieJar
+from typing import TYPE_CHECKING, Final
+
+from requests.cookies import RequestsCookieJar
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+
+class TrackedCookieJar(RequestsCookieJar):
+    """
+    ``RequestsCookieJar`` that remembers whether it changed since the last save.
+
+    Every mutation in ``http.cookiejar`` funnels through ``set_cookie`` or
+    ``clear`` (``update``, ``extract_cookies``, ``__delitem__`` and the expiry
+    helpers included), so overriding those two is enough to catch them all.
+    """
+
+    def __init__(self, policy: object = None) -> None:
+        super().__init__(policy)
+        self.dirty = False
+
+    def set_cookie(self, cookie: Cookie, *args: object, **kwargs: object) -> None:
+        super().set_cookie(cookie, *args, **kwargs)
+        self.dirty = True
+
+    def clear(self, domain: str | None = None, path: str | None = None, name: str | None = None) -> None:
+        super().clear(domain, path, name)
+        self.dirty = True
+
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        state.pop("dirty", None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        self.dirty = False
+
+
+# The ``Cookie`` constructor arguments, in order; ``rest`` is stored as ``_rest``.
+_COOKIE_FIELDS: Final = (
+    "version", "name", "value", "port", "port_specified", "domain", "domain_specified", "domain_initial_dot",
+    "path", "path_specified", "secure", "expires", "discard", "comment", "comment_url", "rest", "rfc2109",
+)  # fmt: skip
+
+
+def _cookie_to_json(cookie: Cookie) -> str:
+    return json.dumps({field: getattr(cookie, "_rest" if field == "rest" else field) for field in _COOKIE_FIELDS})
+
+
+def _cookie_from_json(data: str) -> Cookie:
+    return Cookie(**json.loads(data))
+
+
+class SQLiteCookieJar(TrackedCookieJar):
+    """
+    Cookie jar kept in a SQLite database that any number of processes share.
+
+    Every cookie set or cleared is written to the database right away, one row
+    per cookie, rather than the whole jar at once; a process therefore never
+    overwrites cookies it didn't touch with a stale copy. Before the jar is
+    read (requests iterates it to build the ``Cookie`` header), it checks
+    ``PRAGMA data_version``, which only changes when another connection
+    committed, and reloads the rows if so. A ``cf_clearance`` one process
+    obtained is thus sent by every other process with its next request.
+
+    The database runs in WAL mode, so readers never wait for a writer. The
+    connection is guarded by the jar's own lock, which ``http.cookiejar``
+    already holds while it iterates. ``dirty`` always stays ``False``: there's
+    never anything left to save.
+    """
+
+    def __init__(self, path: Path, policy: object = None) -> None:
+        super().__init__(policy)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cookies"
+            " (domain TEXT NOT NULL, path TEXT NOT NULL, name TEXT NOT NULL, cookie TEXT NOT NULL, PRIMARY KEY (domain, path, name))"
+        )
+        self._data_version: int | None = None
+        self.sync()
+
+    def sync(self) -> bool:
+        """Reload the cookies if another connection changed them since the last look; tells whether it did."""
+        with self._cookies_lock:
+            data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return False
+            rows = self._db.execute("SELECT cookie FROM cookies").fetchall()
+            self._data_version = data_version
+            # ``CookieJar``'s own methods: the rows are loaded, not changed.
+            CookieJar.clear(self)
+            for (data,) in rows:
+                CookieJar.set_cookie(self, _cookie_from_json(data))
+            return True
+
+    def set_cookie(self, cookie: Cookie, *args: object, **kwargs: object) -> None:
+        with self._cookies_lock:
+            super().set_cookie(cookie, *args, **kwargs)
+            self._db.execute(
+                "INSERT INTO cookies (domain, path, name, cookie) VALUES (?, ?, ?, ?) ON CONFLICT (domain, path, name) DO UPDATE SET cookie = excluded.cookie",
+                (cookie.domain, cookie.path, cookie.name, _cookie_to_json(cookie)),
+            )
+        self.dirty = False
+
+    def clear(self, domain: str | None = None, path: str | None = None, name: str | None = None) -> None:
+        conditions = {column: value for column, value in (("domain", domain), ("path", path), ("name", name)) if value is not None}
+        where = " AND ".join(f"{column} = ?" for column in conditions) or "1"
+        with self._cookies_lock:
+            super().clear(domain, path, name)
+            self._db.execute(f"DELETE FROM cookies WHERE {where}", tuple(conditions.values()))
+        self.dirty = False
+
+    def __iter__(self) -> Iterator[Cookie]:
+        self.sync()
+        return super().__iter__()
+
+    def close(self) -> None:
+        """Close the database connection; the jar can't be used afterwards."""
+        with self._cookies_lock:
+            self._db.close()
@@ -1,42 +1,149 @@
 from __future__ import annotations
 
+import contextlib
+import json
+import os
 import subprocess
+import threading
 import time
+import uuid
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Final
 
 import requests
 from logprise import logger
 
-from ._constants import FLARESOLVERR_PROXY
+from ._constants import CACHE_PATH, DEFAULT_TIMEOUT, FLARESOLVERR_PROXY
+from ._locking import FileLock, lock_file_name
 
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Iterator
+    from pathlib import Path
 
-def get_flaresolverr_settings() -> dict | None:
-    """Check if FlareSolverr API is reachable."""
+FLARESOLVERR_IMAGE = "ghcr.io/svaningelgem/flaresolverr:latest"
+
+
+# How long a probe answer is trusted. Failures are only remembered briefly, so a
+# FlareSolverr that just came up is noticed quickly.
+SETTINGS_TTL: Final = 60.0
+SETTINGS_FAILURE_TTL: Final = 5.0
+
+_settings_cache: dict[str, tuple[float, dict | None]] = {}
+_settings_lock = threading.Lock()
+
+
+def _settings_file() -> Path:
+    return CACHE_PATH / "flaresolverr.json"
+
+
+def _read_settings_file() -> dict[str, list]:
+    try:
+        entries = json.loads(_settings_file().read_text())
+    except (OSError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+def _write_settings_file(url: str, entry: list | None) -> None:
+    """Store (or, with ``None``, drop) the entry for ``url``."""
+    # Read-modify-write without a lock: a lost update between two processes only
+    # costs one extra probe.
+    entries = _read_settings_file()
+    if entry is None:
+        if entries.pop(url, None) is None:
+            return
+    else:
+        entries[url] = entry
+
+    path = _settings_file()
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(entries))
+        tmp.replace(path)
+    except (OSError, TypeError, ValueError):
+        tmp.unlink(missing_ok=True)
+
+
+def _cached_settings(url: str) -> tuple[float, dict | None] | None:
+    with _settings_lock:
+        cached = _settings_cache.get(url)
+
+    entry = _read_settings_file().get(url)
+    if isinstance(entry, list) and len(entry) == 2 and (cached is None or entry[0] > cached[0]):
+        cached = (entry[0], entry[1])
+        with _settings_lock:
+            _settings_cache[url] = cached
+    return cached
+
+
+def _probe_flaresolverr(url: str) -> dict | None:
     try:
-        resp = requests.get(FLARESOLVERR_PROXY, timeout=0.1)
+        resp = requests.get(url, timeout=0.1)
         resp.raise_for_status()
         return resp.json()
     except:  # noqa: E722
         return None
 
 
-def start_flaresolverr_docker() -> subprocess.Popen | None:
-    """Start the FlareSolverr docker container."""
+def get_flaresolverr_settings(url: str = FLARESOLVERR_PROXY, *, max_age: float | None = None) -> dict | None:
+    """
+    Check if FlareSolverr API is reachable.
+
+    The answer (``None``, or the settings it reports such as its ``userAgent``)
+    is cached per URL, in memory and in ``flaresolverr.json`` under the cache
+    directory so sibling processes reuse it. It is trusted for
+    ``SETTINGS_TTL`` seconds, or ``SETTINGS_FAILURE_TTL`` when FlareSolverr
+    didn't answer, unless ``max_age`` says otherwise; ``max_age=0`` always
+    probes.
+    """
+    cached = _cached_settings(url)
+    if cached is not None:
+        checked_at, settings = cached
+        ttl = max_age if max_age is not None else SETTINGS_TTL if settings is not None else SETTINGS_FAILURE_TTL
+        if time.time() - checked_at < ttl:
+            return settings
+
+    settings = _probe_flaresolverr(url)
+    checked_at = time.time()
+    with _settings_lock:
+        _settings_cache[url] = (checked_at, settings)
+    _write_settings_file(url, [checked_at, settings])
+    return settings
+
+
+def invalidate_flaresolverr_settings(url: str = FLARESOLVERR_PROXY) -> None:
+    """Forget the cached probe answer for ``url``, e.g. after it refused a connection."""
+    with _settings_lock:
+        _settings_cache.pop(url, None)
+    _write_settings_file(url, None)
+
+
+def _wait_until_ready(url: str, timeout: float) -> bool:
+    """Poll ``url`` with a short, doubling back-off until FlareSolverr answers or ``timeout`` seconds of waiting passed."""
+    delay, waited = 0.05, 0.0
+    while get_flaresolverr_settings(url, max_age=0) is None:
+        if waited >= timeout:
+            return False
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 1.0)
+    return True
+
+
+def start_flaresolverr_docker(port: int = 8191) -> subprocess.Popen | None:
+    """Start an anonymous FlareSolverr docker container, tied to this process (see :class:`FlareSolverrContainer` for the shared one)."""
     try:
         logger.info("Starting FlareSolverr docker container...")
         process = subprocess.Popen(
-            ["docker", "run", "--rm", "-p", "8191:8191", "ghcr.io/svaningelgem/flaresolverr:latest"],
+            ["docker", "run", "--rm", "-p", f"{port}:8191", FLARESOLVERR_IMAGE],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
 
-        # Wait for container to be ready
-        for loop in range(10):  # Try for 10 seconds
-            if loop > 0:
-                time.sleep(1)
-
-            if get_flaresolverr_settings() is not None:
-                logger.info("FlareSolverr is ready")
-                return process
+        if _wait_until_ready(f"http://localhost:{port}/", timeout=10):
+            logger.info("FlareSolverr is ready")
+            return process
 
         logger.error("FlareSolverr container started but API not responding")
         return process
@@ -45,10 +152,429 @@ def start_flaresolverr_docker() -> subprocess.Popen | None:
         return None
 
 
-def ensure_flaresolverr_running() -> subprocess.Popen | None:
-    """Ensure FlareSolverr is running, start if needed."""
+class FlareSolverrContainer:
+    """
+    A named FlareSolverr docker container shared by every process on the machine.
+
+    Instead of each process booting its own anonymous container, the first one
+    to need FlareSolverr starts ``name`` (or restarts it, when it exists but is
+    stopped) and everyone else adopts it. A lock file keeps two processes from
+    starting it at the same time.
+
+    Every solve :meth:`touch`-es a heartbeat file next to the lock; processes
+    that adopted the container watch it and stop the container once nobody
+    used it for ``idle_timeout`` seconds (``None`` keeps it running). The next
+    :meth:`ensure_running` starts it again.
+
+    ``docker`` is the docker CLI to invoke; point it at a stand-in script to
+    exercise the lifecycle without docker.
+    """
+
+    def __init__(
+        self,
+        name: str = "anti_cf-flaresolverr",
+        port: int = 8191,
+        *,
+        image: str = FLARESOLVERR_IMAGE,
+        idle_timeout: float | None = 1800.0,
+        start_timeout: float = 60.0,
+        docker: str | None = None,
+        state_dir: Path | None = None,
+    ) -> None:
+        self.name = name
+        self.port = port
+        self.image = image
+        self.idle_timeout = idle_timeout
+        self.start_timeout = start_timeout
+        self.docker = docker or os.environ.get("ANTI_CF_DOCKER", "docker")
+        self._state_dir = state_dir
+        self._watchdog: threading.Thread | None = None
+        self._watchdog_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.port}/"
+
+    @property
+    def state_dir(self) -> Path:
+        # Resolved at access time, like ``PersistentSession._purge_marker``.
+        return self._state_dir if self._state_dir is not None else CACHE_PATH / "locks"
+
+    @property
+    def heartbeat_file(self) -> Path:
+        return self.state_dir / f"{self.name}.heartbeat"
+
+    def _lock(self) -> FileLock:
+        return FileLock(self.state_dir / lock_file_name(self.name))
+
+    def _run_docker(self, *args: str) -> subprocess.CompletedProcess[str]:
+        return subprocess.run([self.docker, *args], capture_output=True, text=True, timeout=120, check=False)
+
+    def state(self) -> str | None:
+        """Docker's status for the container (``"running"``, ``"exited"``, ...), ``None`` when it doesn't exist."""
+        result = self._run_docker("inspect", "--format", "{{.State.Status}}", self.name)
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip() or None
+
+    def ensure_running(self) -> bool:
+        """Make sure the container is up and answering, starting it when needed."""
+        if get_flaresolverr_settings(self.url) is not None:
+            self.adopt()
+            return True
+
+        try:
+            with self._lock():
+                # Someone else may have started it while we waited for the lock.
+                if get_flaresolverr_settings(self.url, max_age=0) is None and not self._start():
+                    return False
+                ready = _wait_until_ready(self.url, self.start_timeout)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.error(f"Failed to start FlareSolverr docker: {e}")
+            return False
+
+        if not ready:
+            logger.error(f"FlareSolverr container {self.name} started but API not responding")
+            return False
+
+        logger.info(f"FlareSolverr container {self.name} is ready")
+        self.adopt()
+        return True
+
+    def _start(self) -> bool:
+        state = self.state()
+        if state == "running":
+            # Still booting; nothing to start.
+            return True
+
+        if state is None:
+            logger.info(f"Starting FlareSolverr docker container {self.name}...")
+            result = self._run_docker("run", "--detach", "--name", self.name, "--publish", f"{self.port}:8191", "--label", "anti_cf.managed=true", self.image)
+        else:
+            logger.info(f"Restarting FlareSolverr docker container {self.name} (was {state})...")
+            result = self._run_docker("start", self.name)
+
+        if result.returncode != 0:
+            logger.error(f"Failed to start FlareSolverr docker: {result.stderr.strip()}")
+            return False
+        return True
+
+    def adopt(self) -> None:
+        """
+        Use the (running) container from this process: record activity and watch for idleness.
+
+        Whatever answers on the port may not be our container (a FlareSolverr
+        started by hand, or another container publishing the port), so the
+        watchdog only starts once docker confirms ``name`` is running.
+        """
+        if self.idle_timeout is None:
+            self.touch()
+            return
+        try:
+            state = self.state()
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.debug(f"Can't inspect FlareSolverr container {self.name}; not watching it [error: {e}]")
+            return
+        if state != "running":
+            logger.debug(f"FlareSolverr on port {self.port} isn't container {self.name}; not watching it [state: {state}]")
+            return
+        self.touch()
+        with self._watchdog_lock:
+            if self._watchdog is None or not self._watchdog.is_alive():
+                self._watchdog = threading.Thread(target=self._watch_idle, name=f"{self.name}-idle-watchdog", daemon=True)
+                self._watchdog.start()
+
+    def touch(self) -> None:
+        """Record that the container was just used."""
+        with contextlib.suppress(OSError):
+            self.heartbeat_file.parent.mkdir(parents=True, exist_ok=True)
+            self.heartbeat_file.touch()
+
+    def idle_for(self) -> float:
+        """Seconds since any process last used the container."""
+        try:
+            return time.time() - self.heartbeat_file.stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def stop_if_idle(self) -> bool:
+        """
+        Stop the container when nobody used it for ``idle_timeout`` seconds; ``True`` when it was stopped.
+
+        Raises :class:`subprocess.CalledProcessError` when ``docker stop`` fails.
+        """
+        if self.idle_timeout is None or self.idle_for() < self.idle_timeout:
+            return False
+
+        with self._lock():
+            if self.idle_for() < self.idle_timeout:
+                return False
+            logger.info(f"Stopping FlareSolverr container {self.name}: idle for {self.idle_for():.0f}s")
+            result = self._run_docker("stop", self.name)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+        return True
+
+    def _watch_idle(self) -> None:
+        interval = min(max(self.idle_timeout / 4, 1.0), 60.0)
+        while True:
+            time.sleep(interval)
+            try:
+                if self.stop_if_idle():
+                    return
+            except (OSError, subprocess.SubprocessError) as e:
+                # Retrying a stop docker refused (or can't run) would only repeat the failure forever.
+                error = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) and e.stderr else e
+                logger.warning(f"Failed to stop FlareSolverr container {self.name}; no longer watching it [error: {error}]")
+                return
+            except Exception as e:
+                logger.warning(f"Idle check for FlareSolverr container {self.name} failed: {e}")
+
+
+_defaults_lock = threading.Lock()
+_default_container: FlareSolverrContainer | None = None
+
+
+def default_container() -> FlareSolverrContainer:
+    """The machine-wide managed container backing :data:`FLARESOLVERR_PROXY`."""
+    global _default_container
+    with _defaults_lock:
+        if _default_container is None:
+            _default_container = FlareSolverrContainer()
+        return _default_container
+
+
+def ensure_flaresolverr_running() -> FlareSolverrContainer | None:
+    """Ensure FlareSolverr is running, starting (or adopting) the managed container if needed."""
+    container = default_container()
     if get_flaresolverr_settings() is not None:
         logger.info("FlareSolverr API is already running")
+        container.adopt()
         return None
 
-    return start_flaresolverr_docker()
+    return container if container.ensure_running() else None
+
+
+@dataclass(eq=False)
+class FlareSolverrBackend:
+    """One FlareSolverr endpoint in a :class:`FlareSolverrPool`."""
+
+    url: str
+    max_concurrent: int = 1
+    in_flight: int = 0
+    failures: int = 0
+    # ``time.monotonic()`` before which the backend is out of rotation.
+    retry_at: float = 0.0
+    container: FlareSolverrContainer | None = None
+
+    def __post_init__(self) -> None:
+        if not self.url.endswith("/"):
+            self.url += "/"
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.retry_at
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.max_concurrent
+
+
+class FlareSolverrPool:
+    """
+    A set of FlareSolverr backends that challenge solves are spread over.
+
+    Every solve goes to the least busy healthy backend, with at most
+    ``max_concurrent_per_backend`` solves per backend at a time; callers beyond
+    that wait for a slot. A backend that fails (connection refused, timeout) is
+    taken out of rotation for ``failure_cooldown`` seconds, doubling on every
+    consecutive failure, and comes back after its first success. When every
+    backend is out of rotation the one due back first is tried anyway, so a
+    pool never refuses to try at all.
+    """
+
+    _MAX_COOLDOWN_SECONDS = 600.0
+
+    def __init__(self, urls: Iterable[str], *, max_concurrent_per_backend: int = 1, failure_cooldown: float = 30.0) -> None:
+        self.backends = [FlareSolverrBackend(url, max_concurrent=max_concurrent_per_backend) for url in urls]
+        if not self.backends:
+            raise ValueError("A FlareSolverr pool needs at least one backend")
+        self.failure_cooldown = failure_cooldown
+        self._condition = threading.Condition()
+
+    @classmethod
+    def start_local(cls, size: int, *, base_port: int = 8191, idle_timeout: float | None = 1800.0, **kwargs: object) -> FlareSolverrPool:
+        """
+        Pool of ``size`` managed local containers on consecutive ports from ``base_port``.
+
+        The containers are named after their port, so other processes asking for
+        the same pool adopt them instead of starting their own.
+        """
+        pool = cls([f"http://localhost:{base_port + i}/" for i in range(size)], **kwargs)
+        for i, backend in enumerate(pool.backends):
+            port = base_port + i
+            backend.container = FlareSolverrContainer(f"anti_cf-flaresolverr-{port}", port, idle_timeout=idle_timeout)
+            if not backend.container.ensure_running():
+                pool.mark_failed(backend)
+        return pool
+
+    def _pick(self) -> FlareSolverrBackend | None:
+        available = [b for b in self.backends if b.in_flight < b.max_concurrent]
+        if not available:
+            return None
+
+        healthy = [b for b in available if b.healthy]
+        if healthy:
+            return min(healthy, key=lambda b: b.load)
+
+        if any(b.healthy for b in self.backends):
+            # Healthy backends exist but are all busy: wait for them rather than
+            # hand the solve to one we know is broken.
+            return None
+        return min(available, key=lambda b: b.retry_at)
+
+    @contextlib.contextmanager
+    def acquire(self, timeout: float | None = DEFAULT_TIMEOUT) -> Iterator[FlareSolverrBackend]:
+        """Reserve a solve slot on the least busy healthy backend."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while (backend := self._pick()) is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No FlareSolverr backend became available in time")
+                # Wake up now and then even without a release: a backend coming
+                # out of its cooldown doesn't notify anyone.
+                self._condition.wait(1.0 if remaining is None else min(remaining, 1.0))
+            backend.in_flight += 1
+
+        try:
+            yield backend
+        finally:
+            with self._condition:
+                backend.in_flight -= 1
+                self._condition.notify_all()
+
+    def mark_failed(self, backend: FlareSolverrBackend) -> None:
+        with self._condition:
+            backend.failures += 1
+            cooldown = min(self.failure_cooldown * 2 ** (backend.failures - 1), self._MAX_COOLDOWN_SECONDS)
+            backend.retry_at = time.monotonic() + cooldown
+            self._condition.notify_all()
+        logger.warning(f"FlareSolverr backend {backend.url} taken out of rotation for {cooldown:.0f}s")
+
+    def mark_ok(self, backend: FlareSolverrBackend) -> None:
+        with self._condition:
+            if backend.failures:
+                logger.info(f"FlareSolverr backend {backend.url} is back in rotation")
+            backend.failures = 0
+            backend.retry_at = 0.0
+            self._condition.notify_all()
+
+    def health_check(self) -> list[FlareSolverrBackend]:
+        """Probe every backend, update its rotation status and return the healthy ones."""
+        for backend in self.backends:
+            if get_flaresolverr_settings(backend.url, max_age=0) is None:
+                if backend.healthy:
+                    self.mark_failed(backend)
+            else:
+                self.mark_ok(backend)
+        return [b for b in self.backends if b.healthy]
+
+    def touch(self, backend: FlareSolverrBackend) -> None:
+        """Record activity on a managed backend, so its container isn't stopped as idle."""
+        if backend.container is not None:
+            backend.container.touch()
+
+
+class FlareSolverrSessions:
+    """
+    Warm FlareSolverr browser sessions, one per backend and key (a host, usually).
+
+    A plain ``request.get`` makes FlareSolverr start and tear down a browser for
+    every solve. Sending it to a session created with ``sessions.create`` keeps
+    that browser (and whatever clearance it collected) alive between solves.
+    Sessions unused for ``idle_timeout`` seconds are destroyed on the next
+    :meth:`session_for` call, and :meth:`close` destroys the rest.
+
+    ``post`` is the callable that talks to FlareSolverr, typically the owning
+    session's ``post``.
+    """
+
+    def __init__(self, post: Callable[..., requests.Response], *, idle_timeout: float = 600.0) -> None:
+        self._post = post
+        self.idle_timeout = idle_timeout
+        # (backend url, key) -> (session id, time.monotonic() of last use)
+        self._sessions: dict[tuple[str, str], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _command(self, backend_url: str, payload: dict, timeout: float = DEFAULT_TIMEOUT) -> dict:
+        response = self._post(backend_url + "v1", headers={"Content-Type": "application/json"}, json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def session_for(self, backend_url: str, key: str) -> str:
+        """Id of the warm session for ``key`` on ``backend_url``, created when there is none yet."""
+        self.expire_idle()
+        with self._lock:
+            existing = self._sessions.get((backend_url, key))
+            if existing is not None:
+                self._sessions[(backend_url, key)] = (existing[0], time.monotonic())
+                return existing[0]
+
+        session_id = f"anti_cf-{uuid.uuid4().hex}"
+        self._command(backend_url, {"cmd": "sessions.create", "session": session_id})
+        logger.info(f"Created FlareSolverr session {session_id} [backend: {backend_url}] [key: {key}]")
+        with self._lock:
+            self._sessions[(backend_url, key)] = (session_id, time.monotonic())
+        return session_id
+
+    def list_sessions(self, backend_url: str) -> list[str]:
+        """Ids of every session that ``backend_url`` currently holds (not only ours)."""
+        return self._command(backend_url, {"cmd": "sessions.list"}).get("sessions", [])
+
+    def discard(self, backend_url: str, key: str | None = None) -> None:
+        """Destroy the session for ``key`` on ``backend_url``, or all of ours there when ``key`` is ``None``."""
+        with self._lock:
+            doomed = [(k, v[0]) for k, v in self._sessions.items() if k[0] == backend_url and (key is None or k[1] == key)]
+            for k, _ in doomed:
+                del self._sessions[k]
+        for (url, _), session_id in doomed:
+            self._destroy(url, session_id)
+
+    def expire_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            doomed = [(k, v[0]) for k, v in self._sessions.items() if v[1] < cutoff]
+            for k, _ in doomed:
+                del self._sessions[k]
+        for (url, _), session_id in doomed:
+            self._destroy(url, session_id)
+
+    def close(self) -> None:
+        with self._lock:
+            doomed = [(k, v[0]) for k, v in self._sessions.items()]
+            self._sessions.clear()
+        for (url, _), session_id in doomed:
+            self._destroy(url, session_id)
+
+    def _destroy(self, backend_url: str, session_id: str) -> None:
+        # Best effort: the backend may well be gone, taking the session with it.
+        try:
+            self._command(backend_url, {"cmd": "sessions.destroy", "session": session_id}, timeout=10)
+            logger.info(f"Destroyed FlareSolverr session {session_id} [backend: {backend_url}]")
+        except Exception as e:
+            logger.warning(f"Failed to destroy FlareSolverr session {session_id} [backend: {backend_url}]: {e}")
+
+
+_default_pool: FlareSolverrPool | None = None
+
+
+def default_pool() -> FlareSolverrPool:
+    """The process-wide single-backend pool for :data:`FLARESOLVERR_PROXY`, backed by :func:`default_container`."""
+    global _default_pool
+    container = default_container()
+    with _defaults_lock:
+        if _default_pool is None:
+            _default_pool = FlareSolverrPool([FLARESOLVERR_PROXY])
+            _default_pool.backends[0].container = container
+        return _default_pool
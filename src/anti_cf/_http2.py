@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import io
+import ssl
+import threading
+from http.client import HTTPMessage
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from requests import ConnectionError as RequestsConnectionError
+from requests import ConnectTimeout, ReadTimeout
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ProxyError, SSLError
+from requests.utils import DEFAULT_CA_BUNDLE_PATH, select_proxy
+from urllib3 import HTTPResponse
+
+# httpx is imported by the methods needing it: importing anti_cf shouldn't pay
+# for it (or for h2) unless the HTTP/2 transport is actually used.
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping
+
+    import httpx
+    from requests import PreparedRequest, Response
+
+
+class _Body(io.RawIOBase):
+    """
+    An httpx response's undecoded body as a file, for a urllib3 ``HTTPResponse`` to read from.
+
+    It also stands in for the ``http.client`` response urllib3 normally wraps:
+    requests pulls the ``Set-Cookie`` headers out of its ``msg``.
+    """
+
+    def __init__(self, response: httpx.Response) -> None:
+        super().__init__()
+        self._response = response
+        self._chunks: Iterator[bytes] = response.iter_raw()
+        self._pending = b""
+        self.msg = HTTPMessage()
+        for name, value in response.headers.multi_items():
+            self.msg[name] = value
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:
+        import httpx
+
+        while not self._pending:
+            # Raised as what requests raises for the same failure reading a body over HTTP/1.1.
+            try:
+                chunk = next(self._chunks, None)
+            except httpx.RemoteProtocolError as e:
+                raise ChunkedEncodingError(e) from e
+            except httpx.TransportError as e:
+                raise RequestsConnectionError(e) from e
+            if chunk is None:
+                return 0
+            self._pending = chunk
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def isclosed(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self._response.close()
+        super().close()
+
+
+def _timeouts(timeout: float | tuple[float | None, float | None] | None) -> dict[str, float | None]:
+    """A requests ``timeout`` as the ``timeout`` extension of an httpx request."""
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return {"connect": connect, "read": read, "write": read, "pool": connect}
+
+
+def _ssl_context(*, verify: bool | str, cert: str | tuple[str, str] | None) -> ssl.SSLContext:
+    """The TLS setup requests' ``verify`` and ``cert`` stand for."""
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        ca = DEFAULT_CA_BUNDLE_PATH if verify is True else verify
+        context = ssl.create_default_context(capath=ca) if Path(ca).is_dir() else ssl.create_default_context(cafile=ca)
+    if cert is not None:
+        context.load_cert_chain(*((cert,) if isinstance(cert, str) else cert))
+    return context
+
+
+class HTTP2Adapter(BaseAdapter):
+    """
+    Transport adapter sending requests over HTTP/2 through httpx.
+
+    Concurrent requests to a host are multiplexed as streams over a single
+    connection rather than each taking a pooled connection of its own, so a
+    few hundred threads hitting one Cloudflare-fronted host need one TLS
+    handshake instead of hundreds. Hosts that don't speak HTTP/2 are talked to
+    over HTTP/1.1 by the same pool. Needs the ``http2`` extra (``httpx[http2]``).
+
+    ``max_connections`` caps the open connections over all hosts (``None``:
+    no cap; requests beyond it wait for one), and ``max_keepalive_connections``
+    how many of them stay open while idle, for at most ``keepalive_expiry``
+    seconds.
+    """
+
+    def __init__(self, *, max_connections: int | None = None, max_keepalive_connections: int | None = 20, keepalive_expiry: float = 5.0) -> None:
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("The HTTP/2 transport needs httpx: pip install 'anti-cf[http2]'") from e
+        super().__init__()
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=keepalive_expiry)
+        # One transport (that is, one connection pool) per TLS and proxy configuration.
+        self._transports: dict[tuple, httpx.HTTPTransport] = {}
+        self._transports_lock = threading.Lock()
+
+    def _transport(self, *, verify: bool | str, cert: str | tuple[str, str] | None, proxy: str | None) -> httpx.HTTPTransport:
+        import httpx
+
+        key = (verify, cert, proxy)
+        with self._transports_lock:
+            transport = self._transports.get(key)
+            if transport is None:
+                transport = self._transports[key] = httpx.HTTPTransport(
+                    verify=_ssl_context(verify=verify, cert=cert), proxy=proxy, http2=True, limits=self._limits
+                )
+            return transport
+
+    def send(
+        self,
+        request: PreparedRequest,
+        *,
+        # The body is always read lazily; requests reads it right away unless ``stream`` was set.
+        stream: bool = False,  # noqa: ARG002
+        timeout: float | tuple[float | None, float | None] | None = None,
+        verify: bool | str = True,
+        cert: str | tuple[str, str] | None = None,
+        proxies: Mapping[str, str] | None = None,
+    ) -> Response:
+        import httpx
+
+        transport = self._transport(verify=verify, cert=cert, proxy=select_proxy(request.url, proxies))
+        outgoing = httpx.Request(
+            request.method, request.url, headers=list(request.headers.items()), content=request.body, extensions={"timeout": _timeouts(timeout)}
+        )
+        try:
+            response = transport.handle_request(outgoing)
+        except httpx.ConnectTimeout as e:
+            raise ConnectTimeout(e, request=request) from e
+        except httpx.TimeoutException as e:
+            raise ReadTimeout(e, request=request) from e
+        except httpx.ProxyError as e:
+            raise ProxyError(e, request=request) from e
+        except httpx.ConnectError as e:
+            error = SSLError if "SSL" in str(e) or "certificate" in str(e) else RequestsConnectionError
+            raise error(e, request=request) from e
+        except httpx.TransportError as e:
+            raise RequestsConnectionError(e, request=request) from e
+
+        body = _Body(response)
+        http_version = response.extensions.get("http_version", b"HTTP/1.1").decode()
+        raw = HTTPResponse(
+            body=body,
+            headers=list(response.headers.multi_items()),
+            status=response.status_code,
+            version=20 if http_version == "HTTP/2" else 11,
+            version_string=http_version,
+            reason=response.extensions.get("reason_phrase", b"").decode() or None,
+            preload_content=False,
+            original_response=body,
+            request_method=request.method,
+            request_url=request.url,
+        )
+        # ``build_response`` only needs the adapter to hang it on the response.
+        return HTTPAdapter.build_response(self, request, raw)
+
+    def close(self) -> None:
+        with self._transports_lock:
+            transports, self._transports = list(self._transports.values()), {}
+        for transport in transports:
+            transport.close()
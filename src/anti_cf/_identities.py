@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Literal, Self
+from urllib.parse import urlsplit
+
+from ._persistent_session import PersistentSession
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from types import TracebackType
+
+    from requests import Response
+
+
+class IdentityPool:
+    """
+    Several :class:`PersistentSession` identities, each request going out through one of them.
+
+    Cloudflare ties a clearance, and the rate limits that come with it, to one
+    cookie jar and User-Agent. An identity is a session with its own of both
+    (see ``PersistentSession(identity=...)``), persisted under
+    ``CACHE_PATH/identities``, so ``n`` identities get ``n`` clearances per
+    host and ``n`` times the request rate. The response cache and the
+    FlareSolverr pool stay shared.
+
+    ``identities`` is the number of identities (named ``"0"``, ``"1"``, ...) or
+    their names. Every request for a host picks an identity by ``strategy``:
+
+    - ``"lru"``: the identity that least recently sent a request to that host.
+    - ``"budget"``: an identity that sent fewer than ``budget`` requests to
+      that host in the last ``budget_window`` seconds, the least used first.
+      When every identity spent its budget the request waits for one to free
+      up. Responses served from the cache don't count.
+
+    Any other keyword argument is passed on to every identity's
+    ``PersistentSession``.
+    """
+
+    def __init__(
+        self,
+        identities: int | Iterable[str] = 4,
+        *,
+        strategy: Literal["lru", "budget"] = "lru",
+        budget: int | None = None,
+        budget_window: float = 60.0,
+        **session_kwargs: object,
+    ) -> None:
+        if strategy not in ("lru", "budget"):
+            raise ValueError(f"Unknown identity selection strategy: {strategy!r}")
+        if strategy == "budget" and (budget is None or budget < 1):
+            raise ValueError("The budget strategy needs a budget of at least one request")
+
+        names = [str(i) for i in range(identities)] if isinstance(identities, int) else list(identities)
+        if not names:
+            raise ValueError("An identity pool needs at least one identity")
+
+        self.strategy = strategy
+        self.budget = budget
+        self.budget_window = budget_window
+        self.sessions = [PersistentSession(identity=name, **session_kwargs) for name in names]
+        # Per (identity index, host): when requests went out, oldest first. The
+        # budget strategy drops what fell out of its window, so at most
+        # ``budget`` are kept. The lru strategy only looks at the last one, and
+        # keeps the one before it for when the last is refunded.
+        self._sent: dict[tuple[int, str], deque[float]] = {}
+        self._sent_maxlen = 2 if strategy == "lru" else None
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def _pick(self, host: str, now: float) -> tuple[int, float]:
+        """Index of the identity to use for ``host``, or ``-1`` and how long to wait for one."""
+        if self.strategy == "lru":
+            index = min(range(len(self.sessions)), key=lambda i: sent[-1] if (sent := self._sent.get((i, host))) else 0.0)
+            return index, 0.0
+
+        best, best_count, free_at = -1, self.budget, float("inf")
+        for i in range(len(self.sessions)):
+            sent = self._sent.get((i, host))
+            if sent is None:
+                return i, 0.0
+            while sent and sent[0] <= now - self.budget_window:
+                sent.popleft()
+            if len(sent) < best_count:
+                best, best_count = i, len(sent)
+            elif sent:
+                free_at = min(free_at, sent[0] + self.budget_window)
+        return best, 0.0 if best >= 0 else free_at - now
+
+    def _acquire(self, host: str) -> tuple[int, float]:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                index, wait = self._pick(host, now)
+                if index >= 0:
+                    self._sent.setdefault((index, host), deque(maxlen=self._sent_maxlen)).append(now)
+                    return index, now
+                self._condition.wait(wait)
+
+    def _refund(self, index: int, host: str, sent_at: float) -> None:
+        with self._condition:
+            sent = self._sent.get((index, host))
+            if sent is not None and sent_at in sent:
+                sent.remove(sent_at)
+                self._condition.notify()
+
+    def session_for(self, url: str | bytes) -> PersistentSession:
+        """
+        The identity to use for a request to ``url``, counted as used for it.
+
+        Meant for flows that have to stay on one identity (a login followed by
+        requests relying on it); plain requests can go through :meth:`get` and
+        :meth:`request`.
+        """
+        host = urlsplit(url if isinstance(url, str) else url.decode()).hostname or ""
+        index, _ = self._acquire(host)
+        return self.sessions[index]
+
+    def _through_identity(self, url: str | bytes, send: str, *args: object, **kwargs: object) -> Response | None:
+        host = urlsplit(url if isinstance(url, str) else url.decode()).hostname or ""
+        index, sent_at = self._acquire(host)
+        response = getattr(self.sessions[index], send)(*args, **kwargs)
+        if getattr(response, "from_cache", False):
+            self._refund(index, host, sent_at)
+        return response
+
+    def request(self, method: str | bytes, url: str | bytes, *args: object, **kwargs: object) -> Response:
+        return self._through_identity(url, "request", method, url, *args, **kwargs)
+
+    def get(self, url: str | bytes, **kwargs: object) -> Response | None:
+        """:meth:`PersistentSession.get` through the identity picked for ``url``."""
+        return self._through_identity(url, "get", url, **kwargs)
+
+    def post(self, url: str | bytes, data: object = None, json: object = None, **kwargs: object) -> Response:
+        return self._through_identity(url, "post", url, data=data, json=json, **kwargs)
+
+    def close(self) -> None:
+        for session in self.sessions:
+            session.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, tb: TracebackType | None) -> None:
+        self.close()
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import TYPE_CHECKING, Self
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from types import TracebackType
+
+try:
+    import fcntl
+
+    def _lock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+except ImportError:  # Windows
+    import msvcrt
+
+    def _lock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            # LK_LOCK gives up (OSError) after ~10 seconds of retrying; a solve
+            # can take far longer than that, so just keep waiting.
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def _unlock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def lock_file_name(key: str) -> str:
+    """Turn an arbitrary key (a host name, usually) into a safe lock file name."""
+    return re.sub(r"[^A-Za-z0-9.-]", "_", key) + ".lock"
+
+
+class FileLock:
+    """
+    Exclusive advisory lock on a file, shared between processes.
+
+    The file also carries a small payload: whoever holds the lock can
+    :meth:`write` a marker, and a waiter that read the marker before blocking
+    can tell from :meth:`read` whether someone did the work in the meantime.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fd: int | None = None
+
+    def read(self) -> bytes:
+        """Current marker, readable without holding the lock."""
+        try:
+            return self.path.read_bytes()
+        except OSError:
+            return b""
+
+    def write(self, marker: bytes) -> None:
+        """Replace the marker; only valid while the lock is held."""
+        if self._fd is None:
+            raise RuntimeError(f"{self.path} is not locked")
+        os.ftruncate(self._fd, 0)
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, marker)
+
+    def __enter__(self) -> Self:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, tb: TracebackType | None) -> None:
+        fd, self._fd = self._fd, None
+        try:
+            _unlock(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import bisect
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Final
+
+if TYPE_CHECKING:
+    from requests import Response
+
+# Upper bounds, in seconds, of the latency histogram buckets: a cache-missing
+# request takes tens of milliseconds to seconds, a FlareSolverr solve seconds
+# to a minute, a cookie save well under a millisecond.
+LATENCY_BUCKETS: Final = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Observations counted into fixed buckets, as Prometheus does; not thread-safe on its own."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # One count per bucket, plus one for what's above the last bound.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile (the maximum when above the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts, strict=False):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self) -> dict[str, float | int]:
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 6),
+        }
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Counters and latency histograms of what a :class:`PersistentSession` spent its time on.
+
+    Recording is a few additions under a lock, cheap enough for every
+    request. Read the numbers with :meth:`stats`, or as Prometheus' text
+    exposition format with :meth:`to_prometheus`. One instance can be shared
+    by several sessions (an :class:`IdentityPool`'s, say) to add them up.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.bytes_received = 0
+        self.origin_latency = Histogram()
+        self.challenges: Counter[str] = Counter()
+        self.solves: Counter[str] = Counter()
+        self.solve_latency = Histogram()
+        self.cookie_save_time = Histogram()
+        self.stale: Counter[str] = Counter()
+
+    def record_response(self, response: Response) -> None:
+        """Count ``response`` as a cache hit, or as a miss that took ``response.elapsed`` and its body from the origin."""
+        if getattr(response, "from_cache", False):
+            with self._lock:
+                self.cache_hits += 1
+            return
+
+        # A streamed body isn't downloaded here just to count it: its announced length stands in.
+        size = len(response._content or b"") if response._content is not False else int(response.headers.get("Content-Length") or 0)
+        with self._lock:
+            self.cache_misses += 1
+            self.bytes_received += size
+            self.origin_latency.observe(response.elapsed.total_seconds())
+
+    def record_challenge(self, host: str) -> None:
+        with self._lock:
+            self.challenges[host] += 1
+
+    def record_solve(self, seconds: float, *, ok: bool) -> None:
+        with self._lock:
+            self.solves["ok" if ok else "error"] += 1
+            self.solve_latency.observe(seconds)
+
+    def record_cookie_save(self, seconds: float) -> None:
+        with self._lock:
+            self.cookie_save_time.observe(seconds)
+
+    def record_stale(self, reason: str) -> None:
+        """Count an expired cached response served ``while_revalidate`` or ``if_error``."""
+        with self._lock:
+            self.stale[reason] += 1
+
+    def stats(self) -> dict[str, object]:
+        """
+        A snapshot of every metric.
+
+        ``cache`` has the ``hits``, ``misses`` and ``hit_ratio``;
+        ``bytes_received`` counts the bodies that came from the origin;
+        ``challenges`` is per host; ``solves`` is by outcome (``ok`` or
+        ``error``); ``stale`` counts the expired responses served while
+        revalidating them and in place of an error. The latencies (``origin_latency``, up to the response
+        headers, ``solve_latency`` and ``cookie_save_time``) are in seconds,
+        with the quantiles rounded up to a histogram bucket bound.
+        """
+        with self._lock:
+            requests = self.cache_hits + self.cache_misses
+            return {
+                "cache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "hit_ratio": round(self.cache_hits / requests, 4) if requests else 0.0,
+                },
+                "bytes_received": self.bytes_received,
+                "origin_latency": self.origin_latency.summary(),
+                "challenges": dict(self.challenges),
+                "solves": {"ok": self.solves["ok"], "error": self.solves["error"]},
+                "solve_latency": self.solve_latency.summary(),
+                "cookie_save_time": self.cookie_save_time.summary(),
+                "stale": {"while_revalidate": self.stale["while_revalidate"], "if_error": self.stale["if_error"]},
+            }
+
+    def to_prometheus(self, prefix: str = "anti_cf") -> str:
+        """Every metric in the Prometheus text exposition format, ready to be served on ``/metrics``."""
+        lines: list[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list[tuple[str, str, float]]) -> None:
+            lines.extend((f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} {kind}"))
+            lines.extend(f"{prefix}_{name}{suffix}{labels} {value}" for suffix, labels, value in samples)
+
+        def histogram(name: str, help_text: str, histogram: Histogram) -> None:
+            samples, cumulative = [], 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts, strict=True):
+                cumulative += count
+                samples.append(("_bucket", f'{{le="{bound}"}}', cumulative))
+            samples += [("_sum", "", histogram.sum), ("_count", "", histogram.count)]
+            metric(name, "histogram", help_text, samples)
+
+        with self._lock:
+            metric(
+                "responses_total",
+                "counter",
+                "Responses by where they came from.",
+                [("", '{source="cache"}', self.cache_hits), ("", '{source="origin"}', self.cache_misses)],
+            )
+            metric("received_bytes_total", "counter", "Body bytes received from origins.", [("", "", self.bytes_received)])
+            histogram("origin_latency_seconds", "Time from sending a request to the origin until its response headers arrived.", self.origin_latency)
+            metric(
+                "challenges_total",
+                "counter",
+                "Cloudflare challenges met, per host.",
+                [("", f'{{host="{_label(host)}"}}', count) for host, count in sorted(self.challenges.items())],
+            )
+            metric("solves_total", "counter", "FlareSolverr solves by outcome.", [("", f'{{result="{r}"}}', self.solves[r]) for r in ("ok", "error")])
+            histogram("solve_duration_seconds", "Time FlareSolverr took to answer a solve.", self.solve_latency)
+            histogram("cookie_save_duration_seconds", "Time spent writing the cookie jar.", self.cookie_save_time)
+            metric(
+                "stale_responses_total",
+                "counter",
+                "Expired cached responses served, by why.",
+                [("", f'{{reason="{r}"}}', self.stale[r]) for r in ("while_revalidate", "if_error")],
+            )
+        return "\n".join(lines) + "\n"
@@ -1,23 +1,49 @@
 from __future__ import annotations
 
+import atexit
 import contextlib
+import functools
+import io
+import os
 import pickle
+import shutil
 import tempfile
+import threading
 import time
+import weakref
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from datetime import datetime, timezone
+from http import HTTPStatus
 from pathlib import Path
-from typing import TYPE_CHECKING, ClassVar
+from typing import TYPE_CHECKING, ClassVar, Literal
+from urllib.parse import urlsplit
 
-import fake_useragent
 from logprise import logger
-from requests import HTTPError
+from requests import ConnectionError as RequestsConnectionError
+from requests import HTTPError, Request, Response, Timeout
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError
+from requests.structures import CaseInsensitiveDict
+from urllib3 import HTTPResponse
 
-from ._constants import CACHE_PATH, DEFAULT_TIMEOUT, FLARESOLVERR_PROXY
-from ._flaresolverr import ensure_flaresolverr_running, get_flaresolverr_settings
+from ._cache_policy import DO_NOT_CACHE, NEVER_EXPIRE, ExpiryPolicy, UrlExpiry
+from ._challenge import is_cloudflare_challenge
+from ._constants import CACHE_PATH, DEFAULT_TIMEOUT
+from ._cookies import SQLiteCookieJar, TrackedCookieJar
+from ._flaresolverr import FlareSolverrSessions, default_pool, ensure_flaresolverr_running, get_flaresolverr_settings, invalidate_flaresolverr_settings
+from ._http2 import HTTP2Adapter
+from ._locking import FileLock, lock_file_name
+from ._metrics import Metrics
+from ._rate_limit import RateLimitedAdapter
+from ._timing import TimedAdapter, phase, traced
 
 try:
     from requests_cache import CachedSession as Session
 
+    from ._cache import ResponseCache
+
     _HAS_CACHE = True
     logger.info("Using CachedSession for persistent session")
 except ImportError:
@@ -26,14 +52,68 @@ except ImportError:
     _HAS_CACHE = False
 
 if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Iterator, Mapping
+    from concurrent.futures import Future
     from datetime import timedelta
+    from http.cookiejar import Cookie
+
+    from requests import PreparedRequest
+    from requests.adapters import BaseAdapter
+
+    from ._cache_policy import Expiry
+    from ._flaresolverr import FlareSolverrPool
+    from ._rate_limit import RateLimiter
+    from ._timing import Phase
+
+
+# How often the clearance refresher looks for work at least, and how long it
+# waits before retrying a refresh that failed.
+_CLEARANCE_CHECK_INTERVAL = 60.0
+_CLEARANCE_RETRY_DELAY = 60.0
+
+
+# First pause before retrying a download that dropped; doubles per attempt, up to the cap.
+_DOWNLOAD_RETRY_DELAY = 1.0
+_DOWNLOAD_MAX_RETRY_DELAY = 30.0
+
+
+# Arguments :meth:`PersistentSession.get` takes on top of requests' own.
+_GET_ONLY_KWARGS = frozenset({"try_with_cloudflare", "refetch_after_solve", "_cloudflare_counter", "_solve"})
+
+# Threads refreshing stale responses in the background, per session.
+_REVALIDATE_WORKERS = 4
+
+
+def _window(policy: ExpiryPolicy | None, url: str) -> int | None:
+    """How many seconds past expiry ``policy`` lets ``url``'s responses be served; ``None`` for not at all."""
+    window = None if policy is None else policy.expire_after(url)
+    return None if window == DO_NOT_CACHE else window
 
-    from requests import Response
+
+def _within(policy: ExpiryPolicy | None, url: str | bytes, stale_for: float) -> bool:
+    window = _window(policy, url if isinstance(url, str) else url.decode())
+    return window is not None and (window == NEVER_EXPIRE or stale_for <= window)
+
+
+class _SolveDeferred(Exception):
+    """Raised by a ``solve`` stand-in to hand the challenge back to its caller (see ``AsyncPersistentSession.get``)."""
+
+
+@dataclass
+class _Clearance:
+    """A host's ``cf_clearance``, as far as the background refresh is concerned."""
+
+    url: str
+    expires: float
+    retry_at: float = 0.0
 
 
 class PersistentSession(Session):
     _COOKIES_FILE: ClassVar[Path] = CACHE_PATH / "cookies.pkl"
+    _COOKIES_DB: ClassVar[Path] = CACHE_PATH / "cookies.sqlite"
     _USER_AGENT_FILE: ClassVar[Path] = CACHE_PATH / "user_agent.txt"
+    _SOLVE_LOCK_DIR: ClassVar[Path] = CACHE_PATH / "locks"
+    _IDENTITIES_DIR: ClassVar[Path] = CACHE_PATH / "identities"
 
     # Default for the auto-purge cadence on session construction. Long enough
     # that startup cost is amortised across many sessions, short enough that
@@ -46,7 +126,132 @@ class PersistentSession(Session):
         # caller redirecting the cache directory mid-run) see the right path.
         return CACHE_PATH / "url_cache.purged"
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        *,
+        cookie_save_interval: float | None = None,
+        cookie_store: Literal["file", "sqlite"] = "file",
+        flaresolverr_pool: FlareSolverrPool | None = None,
+        refetch_after_solve: bool = True,
+        flaresolverr_session_ttl: float | None = None,
+        max_cache_bytes: int | None = None,
+        cache_policies: Mapping[str, Expiry] | None = None,
+        stale_while_revalidate: Mapping[str, Expiry] | None = None,
+        stale_if_error: Mapping[str, Expiry] | None = None,
+        clearance_refresh_margin: float | None = None,
+        clearance_refresh_window: float = 3600.0,
+        identity: str | None = None,
+        rate_limiter: RateLimiter | None = None,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        pool_block: bool = False,
+        http2: bool = False,
+        metrics: Metrics | None = None,
+        timing_hook: Callable[[Phase], None] | None = None,
+    ) -> None:
+        """
+        Create the session.
+
+        ``cookie_save_interval`` picks the cookie persistence mode. ``None``
+        (the default) writes the jar after every request. A number of seconds
+        instead only marks the jar dirty and lets a background thread write it
+        at most once per interval; pending changes are flushed on :meth:`close`
+        and at interpreter exit.
+
+        ``cookie_store="sqlite"`` keeps the cookies in a SQLite database next
+        to the response cache instead: every cookie is written as it changes,
+        and cookies other processes store are picked up before the next
+        request, so a clearance one scraper obtains is shared by all of them
+        at once. ``cookie_save_interval`` has nothing
+        left to do then. An existing cookie file seeds an empty database.
+
+        ``flaresolverr_pool`` spreads challenge solves over several FlareSolverr
+        backends; by default every session shares one pool holding just
+        ``FLARESOLVERR_PROXY``, started through docker on demand.
+
+        ``refetch_after_solve`` is the default for :meth:`get`'s argument of the
+        same name: whether a solved challenge is followed by a second, plain
+        request for the page, or answered straight from FlareSolverr's result.
+
+        ``flaresolverr_session_ttl`` enables warm FlareSolverr browser sessions:
+        solves for a host reuse one browser instead of starting a fresh one each
+        time, and a browser idle for that many seconds is destroyed. The rest go
+        away on :meth:`close`.
+
+        ``max_cache_bytes`` caps the size of the response cache: a write that
+        takes it over budget evicts the least recently used responses. It has
+        no effect without ``requests_cache``.
+
+        ``cache_policies`` overrides the two hour default expiry per host or
+        URL pattern, e.g. ``{"static.example.com": NEVER_EXPIRE,
+        "example.com/listing": timedelta(minutes=5), "*.example.com/api":
+        DO_NOT_CACHE}``; see :class:`ExpiryPolicy` for the pattern syntax. The
+        policies only steer the cache: requests go out with the same headers
+        either way. An ``expire_after`` passed to a request still wins.
+
+        ``stale_while_revalidate`` and ``stale_if_error`` keep expired
+        responses in use for a while, per host or URL pattern as for
+        ``cache_policies``, mapped to how long after expiry (``NEVER_EXPIRE``:
+        no limit). Within its ``stale_while_revalidate`` window, :meth:`get`
+        answers with the expired response right away and refreshes it in the
+        background, challenge solve included, so no caller waits on the origin.
+        Within its ``stale_if_error`` window, the expired response stands in
+        when fetching a fresh one fails: a 5xx from the origin, a connection
+        error or a failed solve. Either way the response returned has
+        ``is_expired`` set. Both need ``requests_cache``.
+
+        ``clearance_refresh_margin`` enables refreshing ``cf_clearance``
+        cookies in the background: that many seconds before a clearance
+        expires, a background thread solves the challenge again, so requests
+        don't stall on FlareSolverr. Only hosts requested in the last
+        ``clearance_refresh_window`` seconds are refreshed; the others are left
+        to lapse.
+
+        ``identity`` names a separate persona: its cookie jar, User-Agent and
+        solve locks live under ``CACHE_PATH/identities/<identity>`` instead of
+        the shared files, so it gets its own ``cf_clearance`` for every host. A
+        new identity starts out with a random User-Agent. See
+        :class:`IdentityPool` for spreading requests over several of them.
+
+        ``rate_limiter`` paces the requests that go out (cache hits don't) per
+        host, backing off when the host pushes back; see :class:`RateLimiter`.
+        One limiter can be shared by several sessions.
+
+        ``pool_connections`` (how many hosts keep a connection pool),
+        ``pool_maxsize`` (connections kept open per host) and ``pool_block``
+        (wait for a free connection instead of opening a throwaway one) size
+        the connection pools, as for requests' ``HTTPAdapter``. Raise
+        ``pool_maxsize`` to the number of threads sharing the session, or
+        connections beyond it get closed after every request and handshaken
+        anew. With ``http2`` (which needs ``httpx[http2]``), HTTPS requests go
+        through :class:`HTTP2Adapter` instead, multiplexing concurrent requests
+        to a host over one connection; there ``pool_connections`` is the number
+        of idle connections kept alive, and ``pool_block`` caps the open ones
+        at ``pool_connections * pool_maxsize``.
+
+        ``metrics`` collects the session's counters and latencies (see
+        :meth:`stats`); pass one :class:`Metrics` to several sessions to add
+        them up. By default every session has its own.
+
+        Every response :meth:`get` and :meth:`request` return carries a
+        ``timings`` attribute, a :class:`Timings` telling where the time went.
+        ``timing_hook`` is called with every :class:`Phase` as it ends, e.g. to
+        forward it as a span to a tracing system.
+        """
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.timing_hook = timing_hook
+        self.rate_limiter = rate_limiter
+        self.identity = identity
+        if identity is not None:
+            directory = self._IDENTITIES_DIR / identity
+            self._COOKIES_FILE = directory / "cookies.pkl"
+            self._COOKIES_DB = directory / "cookies.sqlite"
+            self._USER_AGENT_FILE = directory / "user_agent.txt"
+            self._SOLVE_LOCK_DIR = directory / "locks"
+
+        for directory in {CACHE_PATH, self._COOKIES_FILE.parent, self._USER_AGENT_FILE.parent}:
+            directory.mkdir(parents=True, exist_ok=True)
+
         if _HAS_CACHE:
             # WAL + busy_timeout so concurrent scrapers sharing this cache don't
             # raise sqlite3.OperationalError("database is locked"). Without WAL,
@@ -55,12 +260,9 @@ class PersistentSession(Session):
             # loses. WAL lets readers and one writer proceed in parallel, and
             # 10s gives writers enough headroom for the contended startup.
             super().__init__(
-                CACHE_PATH / "url_cache.sqlite",
-                backend="sqlite",
+                backend=ResponseCache(CACHE_PATH / "url_cache.sqlite", max_bytes=max_cache_bytes, wal=True, busy_timeout=10_000),
                 cache_control=False,
                 expire_after=2 * 3600,
-                wal=True,
-                busy_timeout=10_000,
                 headers={
                     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
                     "Accept-Language": "en-US,en;q=0.5",
@@ -69,9 +271,68 @@ class PersistentSession(Session):
         else:
             super().__init__()
 
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.mount("http://", adapter)
+        if http2:
+            max_connections = pool_connections * pool_maxsize if pool_block else None
+            self.mount("https://", HTTP2Adapter(max_connections=max_connections, max_keepalive_connections=pool_connections))
+        else:
+            self.mount("https://", adapter)
+
+        if cookie_store == "sqlite":
+            self.cookies = SQLiteCookieJar(self._COOKIES_DB)
+        elif cookie_store == "file":
+            self.cookies = TrackedCookieJar()
+        else:
+            raise ValueError(f"Unknown cookie store: {cookie_store!r}")
         self._load_cookies()
         self.set_user_agent()
+        self._flaresolverr_pool = flaresolverr_pool if flaresolverr_pool is not None else default_pool()
         self._flaresolverr_initialized = False
+        self.refetch_after_solve = refetch_after_solve
+        self._expiry_policy = ExpiryPolicy(cache_policies) if _HAS_CACHE and cache_policies else None
+        self._url_expiry = UrlExpiry() if _HAS_CACHE else None
+        if self._url_expiry is not None:
+            self.settings.urls_expire_after = self._url_expiry
+        self._stale_while_revalidate = ExpiryPolicy(stale_while_revalidate) if _HAS_CACHE and stale_while_revalidate else None
+        self._stale_if_error = ExpiryPolicy(stale_if_error) if _HAS_CACHE and stale_if_error else None
+        # Cache keys being refreshed in the background, so a stale page many
+        # callers ask for is fetched once.
+        self._revalidating: set[str] = set()
+        self._revalidating_lock = threading.Lock()
+        self._revalidator: ThreadPoolExecutor | None = None
+        self._browser_sessions = None if flaresolverr_session_ttl is None else FlareSolverrSessions(self.post, idle_timeout=flaresolverr_session_ttl)
+        self._solve_locks: dict[str, threading.Lock] = {}
+        self._solve_locks_guard = threading.Lock()
+
+        self._clearance_refresh_margin = clearance_refresh_margin
+        self._clearance_refresh_window = clearance_refresh_window
+        self._clearances: dict[str, _Clearance] = {}
+        self._last_used: dict[str, float] = {}
+        self._clearance_refresher_stop = threading.Event()
+        if clearance_refresh_margin is not None:
+            threading.Thread(
+                target=_refresh_clearances_periodically,
+                args=(weakref.ref(self), self._clearance_refresher_stop),
+                name="anti_cf-clearance-refresher",
+                daemon=True,
+            ).start()
+
+        self._cookie_save_interval = cookie_save_interval
+        self._cookie_flusher_stop = threading.Event()
+        self._cookie_flush_at_exit = None
+        if cookie_save_interval is not None:
+            # The flusher only holds a weak reference, so an abandoned session
+            # can still be garbage collected; its thread then exits on its own.
+            session_ref = weakref.ref(self)
+            threading.Thread(
+                target=_flush_cookies_periodically,
+                args=(session_ref, self._cookie_flusher_stop, cookie_save_interval),
+                name="anti_cf-cookie-flusher",
+                daemon=True,
+            ).start()
+            self._cookie_flush_at_exit = functools.partial(_flush_cookies_at_exit, session_ref)
+            atexit.register(self._cookie_flush_at_exit)
 
         # One-shot best-effort purge if the cache hasn't been swept in a while.
         # Failures are swallowed — this is housekeeping, not a hard requirement.
@@ -80,14 +341,21 @@ class PersistentSession(Session):
                 self._auto_purge_if_due()
 
     def _get_user_agent(self) -> str:
-        # Try FlareSolverr first, but don't start it if not running
-        flaresolverr_settings = get_flaresolverr_settings()
-        if flaresolverr_settings is not None:
-            return flaresolverr_settings["userAgent"]
+        # An identity keeps its own User-Agent rather than taking FlareSolverr's,
+        # or every identity would look the same.
+        if self.identity is None:
+            # Try FlareSolverr first, but don't start it if not running
+            flaresolverr_settings = get_flaresolverr_settings()
+            if flaresolverr_settings is not None:
+                return flaresolverr_settings["userAgent"]
 
         if self._USER_AGENT_FILE.exists():
             return self._USER_AGENT_FILE.read_text(encoding="utf8").strip()
 
+        # Imported here: loading its browser database is slow, and most sessions
+        # get their User-Agent from FlareSolverr or the file above.
+        import fake_useragent
+
         return fake_useragent.UserAgent(os="windows", platforms="pc", browsers="chrome").random
 
     def set_user_agent(self, user_agent: str | None = None) -> None:
@@ -99,62 +367,713 @@ class PersistentSession(Session):
 
     def _load_cookies(self) -> None:
         """Load cookies from file if it exists."""
-        if self._COOKIES_FILE.exists():
-            try:
-                with self._COOKIES_FILE.open("rb") as fp:
-                    self.cookies.update(pickle.load(fp))
-            except Exception as e:
-                logger.error(f"Failed to load cookies from {self._COOKIES_FILE}: {e}")
-                self._COOKIES_FILE.unlink()
+        if isinstance(self.cookies, SQLiteCookieJar):
+            self.cookies.sync()
+            # The cookie file only seeds a database that's still empty.
+            if len(self.cookies):
+                return
+        # Under the jar's lock, so no change made meanwhile on another thread gets marked as saved.
+        with self.cookies._cookies_lock:
+            # What's on disk is by definition saved already, but changes still waiting for a
+            # debounced save (a merge in the middle of a solve, say) aren't.
+            dirty = getattr(self.cookies, "dirty", False)
+            if self._COOKIES_FILE.exists():
+                try:
+                    with self._COOKIES_FILE.open("rb") as fp:
+                        self.cookies.update(pickle.load(fp))
+                except Exception as e:
+                    logger.error(f"Failed to load cookies from {self._COOKIES_FILE}: {e}")
+                    self._COOKIES_FILE.unlink()
+            self.cookies.dirty = dirty
 
     def save_cookies(self) -> None:
         """Save current cookies to file."""
-        temp_file = Path(tempfile.mktemp(dir=self._COOKIES_FILE.parent))
-        temp_file.write_bytes(pickle.dumps(self.cookies, protocol=4))
-        temp_file.replace(self._COOKIES_FILE)
+        if isinstance(self.cookies, SQLiteCookieJar):
+            # Every change was written to the database as it happened.
+            return
+        # Snapshot under the jar's own lock: a response being processed on
+        # another thread (or the background flusher) mutates the same dicts.
+        start = time.perf_counter()
+        with phase("cookie_save", str(self._COOKIES_FILE)):
+            with self.cookies._cookies_lock:
+                data = pickle.dumps(self.cookies, protocol=4)
+                self.cookies.dirty = False
 
-    def request(self, *args: object, **kwargs: object) -> Response:
+            try:
+                temp_file = Path(tempfile.mktemp(dir=self._COOKIES_FILE.parent))
+                temp_file.write_bytes(data)
+                temp_file.replace(self._COOKIES_FILE)
+            except BaseException:
+                self.cookies.dirty = True
+                raise
+        self.metrics.record_cookie_save(time.perf_counter() - start)
+
+    def flush_cookies(self) -> None:
+        """Save the cookies, but only if they changed since the last save."""
+        if getattr(self.cookies, "dirty", True):
+            self.save_cookies()
+
+    def request(self, method: str | bytes, url: str | bytes, *args: object, **kwargs: object) -> Response:
         """Override request method to save cookies after each request."""
-        response = super().request(*args, **kwargs)
-        self.save_cookies()
+        if self._clearance_refresh_margin is not None:
+            self._last_used[urlsplit(url if isinstance(url, str) else url.decode()).hostname or ""] = time.time()
+        with traced(self.timing_hook) as timings, phase("request", url):
+            response = super().request(method, url, *args, **kwargs)
+            # Neither a cache lookup that came up empty nor a call to FlareSolverr is a fetch from the origin.
+            if not (kwargs.get("only_if_cached") and response.status_code == HTTPStatus.GATEWAY_TIMEOUT) and not self._is_flaresolverr_url(url):
+                self.metrics.record_response(response)
+            if self._cookie_save_interval is None:
+                self.save_cookies()
+        response.timings = timings
         return response
 
+    def send(self, request: PreparedRequest, **kwargs: object) -> Response:
+        """Send ``request`` with the expiry the cache policies set for its URL."""
+        if self._url_expiry is None or self._url_expiry.pinned:
+            return super().send(request, **kwargs)
+        with self._url_expiry.applying(self._policy_expire_after(request.url or "")):
+            return super().send(request, **kwargs)
+
+    def _is_flaresolverr_url(self, url: str | bytes) -> bool:
+        url = url if isinstance(url, str) else url.decode()
+        return any(url.startswith(backend.url) for backend in self._flaresolverr_pool.backends)
+
+    def get_adapter(self, url: str) -> BaseAdapter:
+        adapter = super().get_adapter(url)
+        # FlareSolverr isn't the host being scraped; its pool paces the solves
+        # already, and its calls are timed as solves.
+        if self._is_flaresolverr_url(url):
+            return adapter
+        adapter = TimedAdapter(adapter)
+        if self.rate_limiter is None:
+            return adapter
+        return RateLimitedAdapter(adapter, self.rate_limiter)
+
+    def stats(self) -> dict[str, object]:
+        """
+        What the session spent its time on, for finding out why a job is slow.
+
+        Cache hits and misses, origin latency, bytes received, challenges per
+        host, FlareSolverr solves and their latency, and the time spent saving
+        cookies; see :meth:`Metrics.stats`. For Prometheus, serve
+        ``session.metrics.to_prometheus()`` instead.
+        """
+        return self.metrics.stats()
+
+    def _policy_expire_after(self, url: str | bytes) -> int | None:
+        if self._expiry_policy is None:
+            return None
+        return self._expiry_policy.expire_after(url if isinstance(url, str) else url.decode())
+
+    def close(self) -> None:
+        self._cookie_flusher_stop.set()
+        self._clearance_refresher_stop.set()
+        if self._cookie_flush_at_exit is not None:
+            atexit.unregister(self._cookie_flush_at_exit)
+            self._cookie_flush_at_exit = None
+        try:
+            self.flush_cookies()
+        except Exception as e:
+            logger.error(f"Failed to save cookies to {self._COOKIES_FILE}: {e}")
+        if self._browser_sessions is not None:
+            self._browser_sessions.close()
+        if self._revalidator is not None:
+            # Refreshes already running finish, so they don't write to a closed cache.
+            self._revalidator.shutdown(cancel_futures=True)
+        if isinstance(self.cookies, SQLiteCookieJar):
+            # Last, once nothing else can set a cookie.
+            self.cookies.close()
+        super().close()
+
     def _ensure_flaresolverr_initialized(self) -> None:
         """Ensure FlareSolverr is ready when needed."""
         if not self._flaresolverr_initialized:
-            ensure_flaresolverr_running()
+            if self._flaresolverr_pool is default_pool():
+                ensure_flaresolverr_running()
+            else:
+                self._flaresolverr_pool.health_check()
             self._flaresolverr_initialized = True
 
-    def get(self, url: str | bytes, *, try_with_cloudflare: bool = False, _cloudflare_counter: int = 0, **kwargs: object) -> Response | None:
+    def _clearance_cookie(self, url: str | bytes) -> Cookie | None:
+        """The ``cf_clearance`` cookie that would be sent along to ``url``'s host, if any."""
+        host = urlsplit(url if isinstance(url, str) else url.decode()).hostname or ""
+        for cookie in self.cookies:
+            if cookie.name != "cf_clearance":
+                continue
+            domain = cookie.domain.lstrip(".")
+            if host == domain or host.endswith("." + domain):
+                return cookie
+        return None
+
+    def _clearance_for(self, url: str | bytes) -> str | None:
+        """Value of the ``cf_clearance`` cookie that would be sent along to ``url``'s host, if any."""
+        cookie = self._clearance_cookie(url)
+        return None if cookie is None else cookie.value
+
+    def _track_clearance(self, url: str) -> None:
+        """Note when the clearance for ``url``'s host expires, for the background refresh."""
+        if self._clearance_refresh_margin is None:
+            return
+        host = urlsplit(url).hostname or ""
+        cookie = self._clearance_cookie(url)
+        if cookie is None or not cookie.expires:
+            # A session cookie doesn't expire on its own; nothing to schedule.
+            self._clearances.pop(host, None)
+            return
+        self._clearances[host] = _Clearance(url=url, expires=float(cookie.expires))
+
+    def _refresh_due_clearances(self) -> float:
+        """
+        Solve again the clearances about to expire for hosts still in use.
+
+        Returns how many seconds the next clearance can wait.
+        """
+        now = time.time()
+        next_due = now + _CLEARANCE_CHECK_INTERVAL
+        for host, clearance in list(self._clearances.items()):
+            due = max(clearance.expires - self._clearance_refresh_margin, clearance.retry_at)
+            if due > now:
+                next_due = min(next_due, due)
+                continue
+            if now - self._last_used.get(host, 0.0) > self._clearance_refresh_window:
+                logger.info(f"Letting unused Cloudflare clearance expire [host: {host}]")
+                del self._clearances[host]
+                continue
+
+            logger.info(f"Refreshing Cloudflare clearance before it expires [host: {host}]")
+            try:
+                self._solve_challenge(clearance.url)
+            except Exception as e:
+                logger.warning(f"Refreshing Cloudflare clearance failed: {e} [host: {host}]")
+                clearance.retry_at = time.time() + _CLEARANCE_RETRY_DELAY
+                next_due = min(next_due, clearance.retry_at)
+                continue
+            # Normally done by the solve itself; this covers a clearance another process refreshed.
+            if self._clearances.get(host) is clearance:
+                self._track_clearance(clearance.url)
+            # A clearance that still expires within the margin (Cloudflare handed out the same
+            # expiry, or a shorter lifetime than the margin) would otherwise be re-solved every second.
+            refreshed = self._clearances.get(host)
+            if refreshed is not None and refreshed.expires - self._clearance_refresh_margin <= time.time():
+                logger.warning(f"Refreshed Cloudflare clearance expires within the refresh margin; retrying later [host: {host}]")
+                refreshed.retry_at = time.time() + _CLEARANCE_RETRY_DELAY
+                next_due = min(next_due, refreshed.retry_at)
+        return max(next_due - time.time(), 1.0)
+
+    def _get_without_cloudflare(self, url: str | bytes, **kwargs: object) -> Response:
+        """Plain (cached) GET, bypassing the Cloudflare handling in :meth:`get`."""
+        return super().get(url, **kwargs)
+
+    def _is_cloudflare_challenge(self, error: HTTPError, *, try_with_cloudflare: bool) -> bool:
+        """Decide whether ``error`` is a Cloudflare challenge, logging why when it isn't."""
+        with phase("challenge_detection", error.response.url):
+            challenge = is_cloudflare_challenge(error.response)
+        if not challenge:
+            logger.warning("No cloudflare trigger in response?")
+            if error.response._content is False:
+                # Streamed and not read: don't download it just for the log.
+                logger.warning(f"No cloudflare trigger in response? [exception: {error}]")
+                return False
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                f.write(error.response.content)
+                logger.warning(f"No cloudflare trigger in response? [exception: {error}] [content: {f.name}]")
+            # logger.exception(e)
+            return False
+
+        self.metrics.record_challenge(urlsplit(error.response.url).hostname or "")
+        if try_with_cloudflare:
+            logger.warning("Cloudflare cookie expired")
+        else:
+            logger.warning("Cloudflare detected, but `try_with_cloudflare` wasn't set to True!")
+        return True
+
+    def get(
+        self,
+        url: str | bytes,
+        *,
+        try_with_cloudflare: bool = False,
+        refetch_after_solve: bool | None = None,
+        _cloudflare_counter: int = 0,
+        _solve: Callable[[str | bytes], dict | None] | None = None,
+        **kwargs: object,
+    ) -> Response | None:
+        """
+        GET ``url``, going through FlareSolverr when Cloudflare challenges the request.
+
+        After a solve the page is fetched again with the fresh clearance cookie,
+        unless ``refetch_after_solve`` (default: the session's setting) is
+        ``False``: then the page FlareSolverr rendered is returned, and cached,
+        as the response. That saves a round trip to the origin, but note that
+        FlareSolverr returns the page source as the browser saw it (a JSON body
+        arrives wrapped in HTML, for one).
+
+        An expired response may come back without a request at all, when the
+        session's ``stale_while_revalidate`` or ``stale_if_error`` allow it.
+
+        The response's ``timings`` cover the whole call, solve included.
+        """
+        with traced(self.timing_hook) as timings, phase("get", url):
+            response = self._get(
+                url, try_with_cloudflare=try_with_cloudflare, refetch_after_solve=refetch_after_solve, solve=_solve or self._solve_challenge, **kwargs
+            )
+        if response is not None:
+            response.timings = timings
+        return response
+
+    def _get(
+        self,
+        url: str | bytes,
+        *,
+        try_with_cloudflare: bool,
+        refetch_after_solve: bool | None,
+        solve: Callable[[str | bytes], dict | None],
+        **kwargs: object,
+    ) -> Response | None:
+        stale = self._stale_response(url, **kwargs)
+        if stale is None:
+            return self._fetch(url, try_with_cloudflare=try_with_cloudflare, refetch_after_solve=refetch_after_solve, solve=solve, **kwargs)
+
+        key, response, stale_for = stale
+        if _within(self._stale_while_revalidate, url, stale_for):
+            self._revalidate_in_background(url, key, try_with_cloudflare=try_with_cloudflare, refetch_after_solve=refetch_after_solve, **kwargs)
+            self.metrics.record_stale("while_revalidate")
+            return response
+
+        fallback = response if _within(self._stale_if_error, url, stale_for) else None
+        try:
+            return self._fetch(url, try_with_cloudflare=try_with_cloudflare, refetch_after_solve=refetch_after_solve, solve=solve, fallback=fallback, **kwargs)
+        except _SolveDeferred:
+            raise
+        except Exception as e:
+            if fallback is None:
+                raise
+            logger.warning(f"Fetching failed, serving the stale response: {e} [url: {url}] [stale for: {stale_for:.0f}s]")
+            self.metrics.record_stale("if_error")
+            return fallback
+
+    def _fetch(
+        self,
+        url: str | bytes,
+        *,
+        try_with_cloudflare: bool,
+        refetch_after_solve: bool | None,
+        solve: Callable[[str | bytes], dict | None] | None = None,
+        fallback: Response | None = None,
+        **kwargs: object,
+    ) -> Response | None:
+        """
+        Fetch ``url`` from the origin (or the cache, while fresh), solving the challenge when needed; on a 5xx, ``fallback`` is returned if given.
+
+        ``solve`` stands in for :meth:`_solve_challenge`.
+        """
         if not try_with_cloudflare or "cf_clearance" in self.cookies:
             try:
-                resp = super().get(url, **kwargs)
+                resp = self._get_without_cloudflare(url, **kwargs)
                 resp.raise_for_status()
                 return resp
             except HTTPError as e:
-                if b"just a moment" not in e.response.content.lower():
-                    logger.warning("No cloudflare trigger in response?")
-                    with tempfile.NamedTemporaryFile(delete=False) as f:
-                        f.write(e.response.content)
-                        logger.warning(f"No cloudflare trigger in response? [exception: {e}] [content: {f.name}]")
-                    # logger.exception(e)
+                if not self._is_cloudflare_challenge(e, try_with_cloudflare=try_with_cloudflare):
+                    if fallback is not None and e.response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                        logger.warning(f"Origin failed, serving the stale response [url: {url}] [status: {e.response.status_code}]")
+                        self.metrics.record_stale("if_error")
+                        return fallback
                     return None
 
-                if try_with_cloudflare:
-                    logger.warning("Cloudflare cookie expired")
-                else:
-                    logger.warning("Cloudflare detected, but `try_with_cloudflare` wasn't set to True!")
-
-        self._ensure_flaresolverr_initialized()
-
         try:
-            self._get_url_via_flaresolverr(url)
-            return super().get(url, **kwargs)
+            dta = (solve or self._solve_challenge)(url)
+            return self._response_after_solve(url, dta, refetch_after_solve=refetch_after_solve, **kwargs)
+        except _SolveDeferred:
+            raise
         except Exception:
             logger.error(f"FlareSolverr didn't solve it :( [url: {url}]")
             raise
 
-    def purge_cache(self, *, older_than: timedelta | None = None, vacuum: bool = True) -> dict[str, int]:
+    def _stale_response(self, url: str | bytes, **kwargs: object) -> tuple[str, Response, float] | None:
+        """
+        The expired response the cache holds for a GET of ``url``, if a stale window is set for it.
+
+        Returned with its cache key and how many seconds ago it expired.
+        Requests asking for the cache to be bypassed or to stand alone get
+        none.
+        """
+        if self._stale_while_revalidate is None and self._stale_if_error is None:
+            return None
+        if any(kwargs.get(name) for name in ("only_if_cached", "refresh", "force_refresh", "stream")):
+            return None
+        text_url = url if isinstance(url, str) else url.decode()
+        if _window(self._stale_while_revalidate, text_url) is None and _window(self._stale_if_error, text_url) is None:
+            return None
+
+        key = self.cache.create_key(self.prepare_request(Request("GET", text_url, params=kwargs.get("params"), headers=kwargs.get("headers"))))
+        # Fresh hits are the common case, and the cache lookup that follows loads them anyway:
+        # only the ``expires`` column is read until the response is known to be stale.
+        expires = self.cache.responses.expires(key)
+        if expires is None or expires > time.time():
+            return None
+        response = self.cache.get_response(key)
+        if response is None:
+            return None
+        return key, response, time.time() - expires
+
+    def _revalidate_in_background(self, url: str | bytes, key: str, **kwargs: object) -> None:
+        """Fetch ``url`` anew on a background thread, unless that's underway already."""
+        with self._revalidating_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+            if self._revalidator is None:
+                self._revalidator = ThreadPoolExecutor(max_workers=_REVALIDATE_WORKERS, thread_name_prefix="anti_cf-revalidate")
+            self._revalidator.submit(self._revalidate, url, key, **kwargs)
+
+    def _revalidate(self, url: str | bytes, key: str, **kwargs: object) -> None:
+        try:
+            with traced(self.timing_hook), phase("revalidate", url):
+                self._fetch(url, **kwargs)
+        except Exception as e:
+            logger.warning(f"Refreshing a stale response failed: {e} [url: {url}]")
+        finally:
+            with self._revalidating_lock:
+                self._revalidating.discard(key)
+
+    def get_many(
+        self,
+        urls: Iterable[str],
+        *,
+        max_workers: int = 16,
+        per_host: int | None = None,
+        ordered: bool = False,
+        try_with_cloudflare: bool = True,
+        **kwargs: object,
+    ) -> Iterator[tuple[str, Response | Exception | None]]:
+        """
+        :meth:`get` every URL in ``urls``, ``max_workers`` at a time, yielding ``(url, result)`` pairs.
+
+        The result is what :meth:`get` returned for the URL (``None`` for an
+        error that isn't a challenge) or the exception it raised. Results come
+        as they complete, or in the order of ``urls`` with ``ordered``.
+        ``per_host`` caps the requests in flight to any one host; URLs for a
+        busy host wait their turn without holding up a worker.
+
+        Responses the cache can answer are looked up right away, without taking
+        a worker. ``urls`` is read lazily and no more than ``2 * max_workers``
+        URLs are taken from it ahead of the results consumed, so a generator of
+        millions of URLs is fine. Other keyword arguments go to every
+        :meth:`get`.
+        """
+        window = 2 * max_workers
+        pending = iter(enumerate(urls))
+        exhausted = False
+        in_flight: dict[Future, tuple[int, str, str]] = {}
+        per_host_in_flight: Counter[str] = Counter()
+        # URLs waiting for their host to get below ``per_host``.
+        deferred: dict[str, deque[tuple[int, str]]] = {}
+        deferred_count = 0
+        # Results kept back until the ones before them are in, with ``ordered``.
+        ready: dict[int, tuple[str, Response | Exception | None]] = {}
+        next_index = 0
+
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="anti_cf-get_many")
+
+        def submit(index: int, url: str, host: str) -> None:
+            future = executor.submit(self.get, url, try_with_cloudflare=try_with_cloudflare, **kwargs)
+            in_flight[future] = (index, url, host)
+            per_host_in_flight[host] += 1
+
+        def done(index: int, url: str, result: Response | Exception | None) -> Iterator[tuple[str, Response | Exception | None]]:
+            nonlocal next_index
+            if not ordered:
+                yield url, result
+                return
+            ready[index] = (url, result)
+            while next_index in ready:
+                yield ready.pop(next_index)
+                next_index += 1
+
+        try:
+            while True:
+                while not exhausted and len(in_flight) + deferred_count + len(ready) < window:
+                    try:
+                        index, url = next(pending)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    try:
+                        cached = self._cached_response(url, **kwargs)
+                        host = urlsplit(url).hostname or ""
+                    except Exception as e:
+                        # An invalid URL fails here rather than in a worker; it's still just its own result.
+                        yield from done(index, url, e)
+                        continue
+                    if cached is not None:
+                        yield from done(index, url, cached)
+                        continue
+                    if per_host is not None and per_host_in_flight[host] >= per_host:
+                        deferred.setdefault(host, deque()).append((index, url))
+                        deferred_count += 1
+                    else:
+                        submit(index, url, host)
+
+                # Nothing is deferred without a request for its host in flight.
+                if not in_flight:
+                    return
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, url, host = in_flight.pop(future)
+                    per_host_in_flight[host] -= 1
+                    if queue := deferred.get(host):
+                        submit(*queue.popleft(), host)
+                        deferred_count -= 1
+                        if not queue:
+                            del deferred[host]
+                    yield from done(index, url, future.exception() or future.result())
+        finally:
+            # Also reached when the caller stops iterating early: drop what hasn't started.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cached_response(self, url: str, **kwargs: object) -> Response | None:
+        """The response the cache holds for a GET of ``url``, without going to the network; ``None`` when there's none."""
+        if not _HAS_CACHE:
+            return None
+        kwargs = {name: value for name, value in kwargs.items() if name not in _GET_ONLY_KWARGS}
+        response = self._get_without_cloudflare(url, only_if_cached=True, **kwargs)
+        # A miss comes back as a made-up 504 (only 200s get cached, so it can't be a real one).
+        if response.status_code == HTTPStatus.GATEWAY_TIMEOUT:
+            return None
+        return response
+
+    def download(
+        self,
+        url: str,
+        dest: str | os.PathLike[str],
+        *,
+        chunk_size: int = 1 << 16,
+        try_with_cloudflare: bool = True,
+        max_attempts: int = 5,
+        cache_as_file: bool = False,
+        **kwargs: object,
+    ) -> Path:
+        """
+        Stream ``url`` to the file ``dest`` in ``chunk_size`` pieces, never holding the body in memory.
+
+        The body goes to ``dest`` plus ``.part`` first and is renamed into
+        place once complete. When the connection drops or a Cloudflare
+        challenge interrupts the download (the challenge is solved first, with
+        ``try_with_cloudflare``), it resumes where it stopped with a ``Range``
+        request, up to ``max_attempts`` tries in all (what arrived of the chunk
+        being read when the connection dropped is fetched again); a ``.part``
+        file left by an earlier call is resumed the same way. ``If-Range`` makes sure the
+        pieces belong to the same version of the file: if it changed, the
+        server sends it whole and the download starts over.
+
+        Downloads skip the response cache, unless ``cache_as_file``: then the
+        response is cached with a reference to ``dest`` instead of its body,
+        and as long as that entry is fresh, downloading the URL again copies
+        the file rather than fetching it. Other keyword arguments go to the
+        requests. Returns the path of the downloaded file.
+        """
+        dest = Path(dest)
+        part = dest.with_name(dest.name + ".part")
+        validator_file = dest.with_name(dest.name + ".part.validator")
+
+        cache_key = None
+        if _HAS_CACHE and cache_as_file:
+            cache_key = self.cache.create_key(self.prepare_request(Request("GET", url, params=kwargs.get("params"), headers=kwargs.get("headers"))))
+            if (cached := self.cache.body_file(cache_key)) is not None:
+                if cached != dest.resolve():
+                    shutil.copyfile(cached, dest)
+                return dest
+        validator = validator_file.read_text(encoding="utf8") if validator_file.exists() and part.exists() else None
+        headers = dict(kwargs.pop("headers", None) or {})
+        # The response the body came with, for the cache; none when an earlier call already got all of it.
+        completed = None
+        attempt = 0
+        # Caching would read the whole body into memory, and a range is no
+        # response worth caching anyway.
+        with self._url_expiry.applying(DO_NOT_CACHE, pinned=True) if self._url_expiry is not None else contextlib.nullcontext():
+            while True:
+                attempt += 1
+                offset = part.stat().st_size if part.exists() else 0
+                request_headers = dict(headers)
+                if offset:
+                    request_headers["Range"] = f"bytes={offset}-"
+                    if validator:
+                        request_headers["If-Range"] = validator
+                try:
+                    with self._get_without_cloudflare(url, stream=True, headers=request_headers, **kwargs) as response:
+                        if response.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE and offset:
+                            # Nothing left after ``offset``: the previous attempt got it all, or the file shrank.
+                            if response.headers.get("Content-Range") == f"bytes */{offset}":
+                                break
+                            part.unlink()
+                            continue
+                        try:
+                            response.raise_for_status()
+                        except HTTPError as e:
+                            # Told apart while the body can still be read: older
+                            # challenge pages only give themselves away in it.
+                            if (
+                                not self._is_cloudflare_challenge(e, try_with_cloudflare=try_with_cloudflare)
+                                or not try_with_cloudflare
+                                or attempt >= max_attempts
+                            ):
+                                raise
+                            response.close()
+                            self._solve_challenge(url)
+                            continue
+
+                        resumed = offset and response.status_code == HTTPStatus.PARTIAL_CONTENT
+                        if not resumed and offset:
+                            logger.info(f"Server sent the whole file instead of the rest, starting over [url: {url}]")
+                        etag = response.headers.get("ETag")
+                        # Only a strong validator guarantees byte-identical ranges.
+                        validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+                        if validator:
+                            validator_file.write_text(validator, encoding="utf8")
+
+                        with part.open("ab" if resumed else "wb") as f:
+                            for chunk in response.iter_content(chunk_size):
+                                f.write(chunk)
+                    completed = response
+                    break
+                except (RequestsConnectionError, ChunkedEncodingError, Timeout) as e:
+                    if attempt >= max_attempts:
+                        raise
+                    delay = min(_DOWNLOAD_RETRY_DELAY * 2 ** (attempt - 1), _DOWNLOAD_MAX_RETRY_DELAY)
+                    logger.warning(f"Download interrupted, resuming in {delay:.0f}s: {e} [url: {url}] [bytes: {part.stat().st_size if part.exists() else 0}]")
+                    time.sleep(delay)
+
+        part.replace(dest)
+        validator_file.unlink(missing_ok=True)
+
+        if cache_key is not None and completed is not None:
+            self._cache_download(url, completed, dest, cache_key)
+        return dest
+
+    def _cache_download(self, url: str, response: Response, dest: Path, cache_key: str) -> None:
+        from requests_cache.policy import get_expiration_datetime
+
+        expire_after = self._policy_expire_after(url)
+        if expire_after is None:
+            expire_after = self.settings.expire_after
+        if expire_after == DO_NOT_CACHE:
+            return
+        # Cached as the whole file, whichever piece of it this response carried.
+        response.status_code = HTTPStatus.OK
+        response.headers.pop("Content-Range", None)
+        response.headers["Content-Length"] = str(dest.stat().st_size)
+        self.cache.save_body_file(response, dest, cache_key, get_expiration_datetime(expire_after))
+
+    def _response_after_solve(self, url: str | bytes, dta: dict | None, *, refetch_after_solve: bool | None, **kwargs: object) -> Response:
+        if refetch_after_solve is None:
+            refetch_after_solve = self.refetch_after_solve
+
+        solution = (dta or {}).get("solution", {})
+        # Nothing to answer with when another caller did the solve (``dta`` is
+        # ``None``) or FlareSolverr left the body out.
+        if refetch_after_solve or solution.get("response") is None:
+            with phase("refetch", url):
+                return self._get_without_cloudflare(url, **kwargs)
+        return self._response_from_solution(url if isinstance(url, str) else url.decode(), solution, **kwargs)
+
+    def _response_from_solution(
+        self,
+        url: str,
+        solution: dict,
+        *,
+        params: object = None,
+        headers: object = None,
+        expire_after: object = None,
+        **_kwargs: object,
+    ) -> Response:
+        """Turn a FlareSolverr solution into a ``Response`` and store it in the cache like a regular one."""
+        content = solution["response"].encode("utf-8")
+        # The body is the decoded page source: whatever encoding and length the
+        # origin announced no longer apply.
+        response_headers = {
+            k: v for k, v in (solution.get("headers") or {}).items() if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+        }
+        response_headers["Content-Length"] = str(len(content))
+        status = int(solution.get("status") or 200)
+
+        response = Response()
+        response.status_code = status
+        with contextlib.suppress(ValueError):
+            response.reason = HTTPStatus(status).phrase
+        response.headers = CaseInsensitiveDict(response_headers)
+        response.url = solution.get("url") or url
+        response.encoding = "utf-8"
+        response.request = self.prepare_request(Request("GET", url, params=params, headers=headers))
+        response.raw = HTTPResponse(
+            body=io.BytesIO(content),
+            headers=response_headers,
+            status=status,
+            preload_content=False,
+            decode_content=False,
+            request_url=response.url,
+        )
+        response._content = content
+
+        if _HAS_CACHE:
+            # Mirror ``CachedSession._send_and_cache``, so the solution is stored
+            # (or not) under the same key and with the same expiry a plain fetch
+            # of this URL would get.
+            from requests_cache.models import OriginalResponse
+            from requests_cache.policy import CacheActions
+
+            if expire_after is None:
+                expire_after = self._policy_expire_after(url)
+            with self._url_expiry.applying(expire_after):
+                actions = CacheActions.from_request(self.cache.create_key(response.request), response.request, self.settings)
+            actions.update_from_response(response)
+            if not actions.skip_write:
+                self.cache.save_response(response, actions.cache_key, actions.expires)
+            response = OriginalResponse.wrap_response(response, actions)
+
+        return response
+
+    def _solve_challenge(self, url: str | bytes) -> dict | None:
+        """
+        Solve the Cloudflare challenge for ``url``, at most once at a time per host.
+
+        When a clearance expires every worker hitting that host gets challenged at
+        the same moment. Rather than firing one browser solve each, callers queue
+        on a per-host thread lock and a per-host lock file under ``CACHE_PATH``
+        (shared by every process using that cache). Whoever gets through first
+        solves; the others notice on their way in that the clearance changed while
+        they waited, pick it up (from the cookie file, when another process solved
+        it) and return ``None`` instead of the FlareSolverr payload.
+        """
+        url = url if isinstance(url, str) else url.decode()
+        host = urlsplit(url).hostname or ""
+        with self._solve_locks_guard:
+            thread_lock = self._solve_locks.setdefault(host, threading.Lock())
+        file_lock = FileLock(self._SOLVE_LOCK_DIR / lock_file_name(host))
+
+        clearance_before = self._clearance_for(url)
+        marker_before = file_lock.read()
+        # Waiting for another caller's solve counts as solving.
+        with phase("solve", url), thread_lock, file_lock:
+            if self._is_new_clearance(url, clearance_before):
+                logger.info(f"Reusing Cloudflare clearance solved by another thread [host: {host}]")
+                return None
+
+            if file_lock.read() != marker_before:
+                self._load_cookies()
+                if self._is_new_clearance(url, clearance_before):
+                    logger.info(f"Reusing Cloudflare clearance solved by another process [host: {host}]")
+                    return None
+
+            self._ensure_flaresolverr_initialized()
+            dta = self._get_url_via_flaresolverr(url)
+            file_lock.write(f"{os.getpid()} {time.time()}".encode())
+            return dta
+
+    def _is_new_clearance(self, url: str | bytes, previous: str | None) -> bool:
+        current = self._clearance_for(url)
+        return current is not None and current != previous
+
+    def purge_cache(self, *, older_than: timedelta | None = None, vacuum: bool = True) -> dict[str, int | float]:
         """
         Reclaim disk space from the persistent SQLite cache.
 
@@ -162,17 +1081,27 @@ class PersistentSession(Session):
         ``created_at`` is older than ``older_than`` regardless of its TTL,
         then ``VACUUM``s the file so the freed pages become free disk.
 
-        ``older_than`` is the size-cap lever: long-TTL entries (10-year image
+        Both evictions are plain SQL over indexed columns, deleting in small
+        batches; no response is loaded, so memory use stays flat however big
+        the cache is.
+
+        ``older_than`` is the age-cap lever: long-TTL entries (10-year image
         bodies and the like) never expire on their own, so without an age
         cap they sit forever. Pass ``timedelta(days=N)`` to evict anything
-        older than that.
+        older than that. To bound the size instead, construct the session
+        with ``max_cache_bytes``. Responses cached by versions without the
+        ``created_at`` column count as created when the cache file was last
+        written (or when they expire, if that's earlier), so they may outlive
+        ``older_than`` by that much.
 
         Set ``vacuum=False`` to skip the ``VACUUM`` (it rewrites the whole
         file and can take a while on a multi-gigabyte cache; sometimes you
         just want the rows gone and don't care about the on-disk size yet).
 
         Returns a dict ``{"rows_before", "rows_after", "bytes_before",
-        "bytes_after"}`` so callers can log or assert on the savings.
+        "bytes_after", "compression_ratio"}`` so callers can log or assert on
+        the savings; ``compression_ratio`` is how many times smaller body
+        compression makes the remaining responses.
         Raises if the session was constructed without ``requests_cache``
         installed — there is no cache to purge.
         """
@@ -200,11 +1129,9 @@ class PersistentSession(Session):
         self.cache.delete(expired=True, vacuum=False)
 
         # Step 2: optional age cap — drop anything older than ``older_than`` by created_at.
+        # Runs on the indexed ``created_at`` column, never unpickling a response.
         if older_than is not None:
-            cutoff = datetime.now(timezone.utc) - older_than
-            stale_keys = [key for key, resp in self.cache.responses.items() if getattr(resp, "created_at", None) is not None and resp.created_at < cutoff]
-            if stale_keys:
-                self.cache.delete(*stale_keys, vacuum=False)
+            self.cache.delete_older_than(datetime.now(timezone.utc) - older_than)
 
         # Step 3: reclaim disk space.
         if vacuum:
@@ -213,21 +1140,44 @@ class PersistentSession(Session):
 
         rows_after = _row_count()
         bytes_after = _file_size()
+        compression_ratio = round(self.cache.responses.compression_ratio(), 2)
 
         self._purge_marker.parent.mkdir(parents=True, exist_ok=True)
         self._purge_marker.touch()
 
         logger.info(
             f"Cache purge: rows {rows_before}->{rows_after} (-{rows_before - rows_after}), "
-            f"size {bytes_before}->{bytes_after} bytes (-{bytes_before - bytes_after})"
+            f"size {bytes_before}->{bytes_after} bytes (-{bytes_before - bytes_after}), "
+            f"compression {compression_ratio}x"
         )
         return {
             "rows_before": rows_before,
             "rows_after": rows_after,
             "bytes_before": bytes_before,
             "bytes_after": bytes_after,
+            "compression_ratio": compression_ratio,
         }
 
+    def compress_cache(self, *, vacuum: bool = True) -> int:
+        """
+        Compress the bodies of responses cached before compression was enabled.
+
+        A one-shot migration for existing caches: new responses are compressed
+        as they're stored anyway. It works through the cache in small batches,
+        so it can run while other sessions use it, and an interrupted run just
+        resumes. The freed pages only return to the file system with
+        ``vacuum``. Returns the number of responses rewritten.
+        """
+        if not _HAS_CACHE:
+            raise RuntimeError("compress_cache requires requests_cache to be installed")
+
+        rewritten = self.cache.responses.compress_existing()
+        logger.info(f"Compressed {rewritten} cached responses [ratio: {self.cache.responses.compression_ratio():.2f}x]")
+        if vacuum and rewritten:
+            with self.cache.responses.connection() as con:
+                con.execute("VACUUM")
+        return rewritten
+
     def _auto_purge_if_due(self) -> None:
         """Run :meth:`purge_cache` if the marker file is older than the auto-purge interval."""
         try:
@@ -244,7 +1194,33 @@ class PersistentSession(Session):
             "url": url,
             "maxTimeout": DEFAULT_TIMEOUT * 1_000,
         }
-        response = self.post(FLARESOLVERR_PROXY + "v1", headers=headers, json=data, timeout=DEFAULT_TIMEOUT)
+        host = urlsplit(url).hostname or ""
+        with self._flaresolverr_pool.acquire() as backend:
+            start = time.perf_counter()
+            try:
+                # Creating the browser session is the first call to reach the backend; a dead
+                # one has to be taken out of rotation from here just as well.
+                if self._browser_sessions is not None:
+                    data["session"] = self._browser_sessions.session_for(backend.url, host)
+                with phase("flaresolverr", url):
+                    response = self.post(backend.url + "v1", headers=headers, json=data, timeout=DEFAULT_TIMEOUT)
+            except (RequestsConnectionError, Timeout):
+                self.metrics.record_solve(time.perf_counter() - start, ok=False)
+                self._flaresolverr_pool.mark_failed(backend)
+                # Make the next solve check the backend again; its container may
+                # have been stopped as idle in the meantime.
+                self._flaresolverr_initialized = False
+                invalidate_flaresolverr_settings(backend.url)
+                if self._browser_sessions is not None:
+                    self._browser_sessions.discard(backend.url)
+                raise
+            self.metrics.record_solve(time.perf_counter() - start, ok=response.ok)
+            self._flaresolverr_pool.mark_ok(backend)
+            self._flaresolverr_pool.touch(backend)
+            if not response.ok and self._browser_sessions is not None:
+                # A browser session that produced an error (or that FlareSolverr
+                # lost, e.g. after a restart) isn't worth keeping warm.
+                self._browser_sessions.discard(backend.url, host)
         response.raise_for_status()
 
         dta = response.json()
@@ -265,8 +1241,96 @@ class PersistentSession(Session):
                 rfc2109=cookie.get("rfc2109", False),
             )
         self.save_cookies()
+        # The clearance is only honoured along with the User-Agent of the browser that earned it.
+        user_agent = dta["solution"].get("userAgent")
+        if user_agent and user_agent != self.headers.get("User-Agent"):
+            self.set_user_agent(user_agent)
+        self._track_clearance(url)
 
         return dta
 
 
-session = PersistentSession()
+def _flush_cookies_periodically(session_ref: weakref.ref[PersistentSession], stop: threading.Event, interval: float) -> None:
+    while not stop.wait(interval):
+        session = session_ref()
+        if session is None:
+            return
+        try:
+            session.flush_cookies()
+        except Exception as e:
+            logger.error(f"Failed to save cookies to {session._COOKIES_FILE}: {e}")
+        del session
+
+
+def _refresh_clearances_periodically(session_ref: weakref.ref[PersistentSession], stop: threading.Event) -> None:
+    delay = 1.0
+    while not stop.wait(delay):
+        session = session_ref()
+        if session is None:
+            return
+        try:
+            delay = session._refresh_due_clearances()
+        except Exception as e:
+            logger.error(f"Cloudflare clearance refresh failed: {e}")
+            delay = _CLEARANCE_CHECK_INTERVAL
+        del session
+
+
+def _flush_cookies_at_exit(session_ref: weakref.ref[PersistentSession]) -> None:
+    session = session_ref()
+    if session is not None:
+        session.flush_cookies()
+
+
+class _LazySession:
+    """
+    Stand-in for the module-level :data:`session` that builds it on first use.
+
+    Constructing a :class:`PersistentSession` opens the SQLite cache, probes
+    FlareSolverr, may write files and may even run a cache purge; none of that
+    should happen just because ``anti_cf`` got imported. Attribute access (and
+    ``isinstance``) goes through to the real session, created on demand.
+    """
+
+    __slots__ = ("_instance", "_lock")
+
+    def __init__(self) -> None:
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get_instance(self) -> PersistentSession:
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = PersistentSession()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    @property
+    def __class__(self) -> type:
+        return type(self._get_instance())
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self._get_instance(), name)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        setattr(self._get_instance(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(self._get_instance(), name)
+
+    def __enter__(self) -> PersistentSession:
+        return self._get_instance().__enter__()
+
+    def __exit__(self, *args: object) -> None:
+        self._get_instance().__exit__(*args)
+
+    def __repr__(self) -> str:
+        if self._instance is None:
+            return "<lazy PersistentSession (not created yet)>"
+        return repr(self._instance)
+
+
+session: PersistentSession = _LazySession()  # type: ignore[assignment]
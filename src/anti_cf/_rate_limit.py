@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import contextlib
+import email.utils
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from logprise import logger
+
+from ._challenge import is_cloudflare_challenge
+from ._timing import phase
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from requests import PreparedRequest, Response
+    from requests.adapters import BaseAdapter
+
+
+def retry_after(response: Response) -> float | None:
+    """Seconds the ``Retry-After`` header asks to wait, if it's there and makes sense."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+@dataclass(eq=False)
+class HostLimit:
+    """Pacing state of one host in a :class:`RateLimiter`."""
+
+    rate: float
+    concurrency: float
+    tokens: float
+    refilled_at: float
+    in_flight: int = 0
+    # ``time.monotonic()`` before which nothing is sent, from a ``Retry-After``.
+    blocked_until: float = 0.0
+    requests: int = 0
+    throttled: int = 0
+    waited: float = 0.0
+
+
+class RateLimiter:
+    """
+    Per-host pacing of the requests a session sends, adapting to how the host responds.
+
+    Every host gets a token bucket refilling at ``rate`` requests per second,
+    holding at most ``burst`` tokens, and a cap on the requests in flight to it
+    at once. Both adapt the way TCP congestion control does (AIMD): a 429, a
+    Cloudflare challenge or a ``Retry-After`` multiplies the host's rate and
+    concurrency by ``backoff``, down to ``min_rate`` and one request, and
+    pauses the host for as long as ``Retry-After`` asks (at most
+    ``max_retry_after`` seconds). Every other response adds ``rate_step``
+    to the rate and one request per round trip to the concurrency, up to
+    ``max_rate`` and ``max_concurrency`` (by default the starting values).
+
+    One limiter may be shared by any number of threads and sessions;
+    :meth:`stats` shows where every host stands.
+    """
+
+    def __init__(
+        self,
+        rate: float = 2.0,
+        *,
+        burst: float | None = None,
+        concurrency: int = 4,
+        max_rate: float | None = None,
+        max_concurrency: int | None = None,
+        min_rate: float = 0.05,
+        rate_step: float | None = None,
+        backoff: float = 0.5,
+        max_retry_after: float = 300.0,
+    ) -> None:
+        if rate <= 0 or concurrency < 1:
+            raise ValueError("A rate limiter needs a positive rate and a concurrency of at least one")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1.0)
+        self.concurrency = concurrency
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.max_concurrency = max_concurrency if max_concurrency is not None else concurrency
+        self.min_rate = min_rate
+        self.rate_step = rate_step if rate_step is not None else self.max_rate / 20
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self._hosts: dict[str, HostLimit] = {}
+        self._condition = threading.Condition()
+
+    def _host(self, host: str, now: float) -> HostLimit:
+        limit = self._hosts.get(host)
+        if limit is None:
+            limit = self._hosts[host] = HostLimit(rate=self.rate, concurrency=self.concurrency, tokens=self.burst, refilled_at=now)
+        return limit
+
+    def _wait_time(self, limit: HostLimit, now: float) -> float:
+        """How long until ``limit`` lets a request through; ``0`` when it does now."""
+        limit.tokens = min(limit.tokens + (now - limit.refilled_at) * limit.rate, self.burst)
+        limit.refilled_at = now
+        if now < limit.blocked_until:
+            return limit.blocked_until - now
+        if limit.in_flight >= math.floor(limit.concurrency):
+            # Woken up by a release; the timeout only guards against a lost one.
+            return 1.0
+        if limit.tokens < 1:
+            return (1 - limit.tokens) / limit.rate
+        return 0.0
+
+    @contextlib.contextmanager
+    def acquire(self, host: str) -> Iterator[HostLimit]:
+        """
+        Wait for a token and a free slot for ``host``, and hold the slot while the request runs.
+
+        Pass the response to :meth:`record` before leaving the block.
+        """
+        start = time.monotonic()
+        with self._condition:
+            while (wait := self._wait_time(limit := self._host(host, now := time.monotonic()), now)) > 0:
+                self._condition.wait(wait)
+            limit.tokens -= 1
+            limit.in_flight += 1
+            limit.requests += 1
+            limit.waited += now - start
+
+        try:
+            yield limit
+        finally:
+            with self._condition:
+                limit.in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, host: str, response: Response) -> None:
+        """Adapt ``host``'s rate and concurrency to ``response``."""
+        delay = retry_after(response) if response.status_code in (429, 503) else None
+        throttled = response.status_code == 429 or delay is not None or is_cloudflare_challenge(response)
+        with self._condition:
+            limit = self._host(host, now := time.monotonic())
+            if not throttled:
+                limit.rate = min(limit.rate + self.rate_step, self.max_rate)
+                limit.concurrency = min(limit.concurrency + 1 / limit.concurrency, self.max_concurrency)
+                return
+
+            limit.throttled += 1
+            limit.rate = max(limit.rate * self.backoff, self.min_rate)
+            limit.concurrency = max(limit.concurrency * self.backoff, 1.0)
+            # Don't let a burst saved up before the backoff go out right after it.
+            limit.tokens = min(limit.tokens, 0.0)
+            if delay is not None:
+                limit.blocked_until = max(limit.blocked_until, now + min(delay, self.max_retry_after))
+        logger.warning(
+            f"Backing off from {host} [status: {response.status_code}] [rate: {limit.rate:.2f}/s] [concurrency: {math.floor(limit.concurrency)}]"
+            + (f" [retry after: {delay:.0f}s]" if delay is not None else "")
+        )
+
+    def stats(self) -> dict[str, dict[str, float | int]]:
+        """
+        Where every host stands, for tuning.
+
+        Per host: the current ``rate`` (requests per second) and
+        ``concurrency``, the requests ``in_flight``, how many ``requests`` went
+        out and how many got ``throttled``, the seconds spent waiting for the
+        limiter in total (``waited``), and the seconds left of a
+        ``Retry-After`` pause (``blocked_for``).
+        """
+        now = time.monotonic()
+        with self._condition:
+            return {
+                host: {
+                    "rate": round(limit.rate, 3),
+                    "concurrency": math.floor(limit.concurrency),
+                    "in_flight": limit.in_flight,
+                    "requests": limit.requests,
+                    "throttled": limit.throttled,
+                    "waited": round(limit.waited, 3),
+                    "blocked_for": round(max(limit.blocked_until - now, 0.0), 3),
+                }
+                for host, limit in self._hosts.items()
+            }
+
+
+class RateLimitedAdapter:
+    """
+    Wraps a transport adapter so what it sends goes through a :class:`RateLimiter`.
+
+    Working at the adapter level means only requests that really go out are
+    paced: cache hits never get here, while redirects do.
+    """
+
+    def __init__(self, adapter: BaseAdapter, limiter: RateLimiter) -> None:
+        self.adapter = adapter
+        self.limiter = limiter
+
+    def send(self, request: PreparedRequest, *args: object, **kwargs: object) -> Response:
+        host = urlsplit(request.url).hostname or ""
+        with contextlib.ExitStack() as slot:
+            with phase("rate_limit_wait"):
+                slot.enter_context(self.limiter.acquire(host))
+            response = self.adapter.send(request, *args, **kwargs)
+            self.limiter.record(host, response)
+        return response
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self.adapter, name)
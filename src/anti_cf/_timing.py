@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from logprise import logger
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+    from requests import PreparedRequest, Response
+    from requests.adapters import BaseAdapter
+
+# The timings being collected on this thread, if a traced call is running.
+_local = threading.local()
+
+
+@dataclass(frozen=True)
+class Phase:
+    """One timed step of a request: what it was, for which URL, when it started (Unix time) and how long it took."""
+
+    name: str
+    url: str
+    start: float
+    duration: float
+    # How many phases it's nested in; ``0`` for the outermost ``get`` or ``request``.
+    depth: int
+    # The name of the exception the step raised, if it did.
+    error: str | None = None
+
+
+@dataclass
+class Timings:
+    """
+    Where the time of one ``get`` or ``request`` call went, as the phases it went through.
+
+    Phases are listed in the order they ended, so a phase comes after the ones
+    nested in it. Time not covered by any nested phase is the session's own
+    overhead.
+    """
+
+    phases: list[Phase] = field(default_factory=list)
+    hook: Callable[[Phase], None] | None = field(default=None, repr=False)
+
+    def total(self, name: str) -> float:
+        """Seconds spent in every phase called ``name``."""
+        return sum(phase.duration for phase in self.phases if phase.name == name)
+
+    def as_dict(self) -> dict[str, float]:
+        """Seconds per phase name, phases met more than once added up."""
+        totals: dict[str, float] = {}
+        for phase in self.phases:
+            totals[phase.name] = totals.get(phase.name, 0.0) + phase.duration
+        return totals
+
+
+@contextlib.contextmanager
+def traced(hook: Callable[[Phase], None] | None = None) -> Iterator[Timings]:
+    """Collect the phases run on this thread into one :class:`Timings`, unless an enclosing call already does."""
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        yield timings
+        return
+
+    timings = _local.timings = Timings(hook=hook)
+    _local.depth, _local.url = 0, ""
+    try:
+        yield timings
+    finally:
+        _local.timings = None
+
+
+@contextlib.contextmanager
+def phase(name: str, url: str | bytes | None = None) -> Iterator[None]:
+    """
+    Time the block as phase ``name`` of the traced call running on this thread; outside of one, do nothing.
+
+    Without a ``url``, the phase is about the URL of the phase it's nested in.
+    """
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        yield
+        return
+
+    depth, outer_url = _local.depth, _local.url
+    url = outer_url if url is None else url if isinstance(url, str) else url.decode()
+    _local.depth, _local.url = depth + 1, url
+    wall, start = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _local.depth, _local.url = depth, outer_url
+        record = Phase(name, url, wall, time.perf_counter() - start, depth, error)
+        timings.phases.append(record)
+        if timings.hook is not None:
+            # A broken tracing exporter mustn't break the scraping.
+            try:
+                timings.hook(record)
+            except Exception as e:
+                logger.error(f"Timing hook failed: {e} [phase: {name}]")
+
+
+class TimedAdapter:
+    """Wraps a transport adapter to time what it sends as ``origin`` phases."""
+
+    def __init__(self, adapter: BaseAdapter) -> None:
+        self.adapter = adapter
+
+    def send(self, request: PreparedRequest, *args: object, **kwargs: object) -> Response:
+        with phase("origin", request.url or ""):
+            return self.adapter.send(request, *args, **kwargs)
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self.adapter, name)
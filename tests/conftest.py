@@ -1,9 +1,17 @@
+import json
+import threading
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from unittest.mock import MagicMock
 
 import pytest
 import pytest_mock
 from requests import HTTPError, Response
+from requests.structures import CaseInsensitiveDict
 
 
 @pytest.fixture
@@ -41,6 +49,9 @@ def standard_response() -> MagicMock:
     """Create a standard mock response."""
     resp = MagicMock(spec=Response)
     resp.status_code = 200
+    resp.headers = CaseInsensitiveDict()
+    resp._content = b""
+    resp.elapsed = timedelta(0)
     resp.raise_for_status = MagicMock()
     return resp
 
@@ -49,7 +60,10 @@ def standard_response() -> MagicMock:
 def cloudflare_error() -> HTTPError:
     """Create a cloudflare error response."""
     error_response = MagicMock(spec=Response)
-    error_response.content = b"just a moment"
+    error_response.status_code = 403
+    error_response.url = "https://example.com/"
+    error_response.headers = CaseInsensitiveDict({"Server": "cloudflare", "CF-RAY": "8c1f2e3d4a5b6c7d-AMS", "Content-Type": "text/html; charset=UTF-8"})
+    error_response.content = error_response._content = b"<!DOCTYPE html><html><head><title>Just a moment...</title>"
     error = HTTPError("403 Client Error: Forbidden")
     error.response = error_response
     return error
@@ -58,9 +72,119 @@ def cloudflare_error() -> HTTPError:
 @pytest.fixture(autouse=True)
 def generic_setup(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
     mocker.patch("requests.Session.get")
-    mocker.patch("subprocess.Popen")  # Don't start docker!
+    # Don't start docker! Every docker command fails, as if there was no such container.
+    docker = mocker.patch("subprocess.Popen").return_value.__enter__.return_value
+    docker.communicate.return_value = ("", "")
+    docker.poll.return_value = 1
 
     mocker.patch("anti_cf._persistent_session.PersistentSession._COOKIES_FILE", tmp_path / "anti_cf.cookies")
+    mocker.patch("anti_cf._persistent_session.PersistentSession._COOKIES_DB", tmp_path / "cookies.sqlite")
     mocker.patch("anti_cf._persistent_session.PersistentSession._USER_AGENT_FILE", tmp_path / "UA_AGENT.txt")
+    mocker.patch("anti_cf._persistent_session.PersistentSession._SOLVE_LOCK_DIR", tmp_path / "locks")
+    mocker.patch("anti_cf._persistent_session.PersistentSession._IDENTITIES_DIR", tmp_path / "identities")
 
     mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", return_value={})
+    mocker.patch("anti_cf._flaresolverr.CACHE_PATH", tmp_path)
+    mocker.patch.dict("anti_cf._flaresolverr._settings_cache", clear=True)
+
+
+@dataclass
+class FlareSolverrStub:
+    """A local HTTP server answering like FlareSolverr, for tests that need real sockets."""
+
+    server: ThreadingHTTPServer
+    solve_delay: float = 0.0
+    solves: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    commands: list[dict] = field(default_factory=list)
+    browser_sessions: set[str] = field(default_factory=set)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+
+def _make_flaresolverr_handler(stub_ref: list[FlareSolverrStub]) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_args: object) -> None:
+            pass
+
+        def _reply(self, payload: dict, status: int = 200) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            self._reply({"msg": "FlareSolverr is ready!", "version": "stub", "userAgent": "FlareSolverrStub/1.0"})
+
+        def do_POST(self) -> None:
+            stub = stub_ref[0]
+            command = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with stub.lock:
+                stub.commands.append(command)
+
+            cmd = command.get("cmd")
+            if cmd == "sessions.create":
+                with stub.lock:
+                    stub.browser_sessions.add(command["session"])
+                self._reply({"status": "ok", "message": "Session created successfully.", "session": command["session"]})
+                return
+            if cmd == "sessions.list":
+                self._reply({"status": "ok", "sessions": sorted(stub.browser_sessions)})
+                return
+            if cmd == "sessions.destroy":
+                with stub.lock:
+                    stub.browser_sessions.discard(command["session"])
+                self._reply({"status": "ok", "message": "The session has been removed."})
+                return
+            if "session" in command and command["session"] not in stub.browser_sessions:
+                self._reply({"status": "error", "message": "Error: This session does not exist."}, status=500)
+                return
+
+            with stub.lock:
+                stub.solves += 1
+                stub.in_flight += 1
+                stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+            try:
+                time.sleep(stub.solve_delay)
+            finally:
+                with stub.lock:
+                    stub.in_flight -= 1
+            self._reply(
+                {
+                    "status": "ok",
+                    "solution": {
+                        "url": command.get("url"),
+                        "status": 200,
+                        "cookies": [{"name": "cf_clearance", "value": f"stub-{stub.solves}", "domain": "example.com", "path": "/"}],
+                        "userAgent": "FlareSolverrStub/1.0",
+                    },
+                }
+            )
+
+    return Handler
+
+
+@pytest.fixture
+def flaresolverr_stub() -> Iterator[Callable[..., FlareSolverrStub]]:
+    """Factory for local FlareSolverr stand-ins; every server is shut down after the test."""
+    servers: list[ThreadingHTTPServer] = []
+
+    def factory(*, solve_delay: float = 0.0) -> FlareSolverrStub:
+        stub_ref: list[FlareSolverrStub] = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _make_flaresolverr_handler(stub_ref))
+        stub_ref.append(FlareSolverrStub(server, solve_delay=solve_delay))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return stub_ref[0]
+
+    yield factory
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
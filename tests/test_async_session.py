@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+import pytest_mock
+from requests import HTTPError
+
+from anti_cf import AsyncPersistentSession
+from anti_cf._persistent_session import PersistentSession
+from anti_cf._timing import Timings
+
+
+@pytest.fixture(autouse=True)
+def _dont_check_flaresolverr_settings(mocker: pytest_mock.MockerFixture) -> None:
+    mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+    mocker.patch("anti_cf._persistent_session.ensure_flaresolverr_running")
+
+
+def test_get_runs_requests_concurrently(mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+    """Blocking fetches run on the worker pool, so they overlap instead of queueing."""
+
+    def slow_get(*_args: object, **_kwargs: object) -> MagicMock:
+        time.sleep(0.2)
+        return standard_response
+
+    mocker.patch.object(PersistentSession, "_get_without_cloudflare", side_effect=slow_get)
+
+    async def main() -> list:
+        async with AsyncPersistentSession(max_concurrency=50) as s:
+            return await asyncio.gather(*(s.get(f"https://example.com/{i}") for i in range(50)))
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    elapsed = time.perf_counter() - start
+
+    assert results == [standard_response] * 50
+    assert elapsed < 2
+
+
+def test_get_is_the_blocking_get(mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+    """Async gets take the same path as blocking ones: stale responses are considered and the call is timed."""
+    mocker.patch.object(PersistentSession, "_get_without_cloudflare", return_value=standard_response)
+    stale = mocker.spy(PersistentSession, "_stale_response")
+
+    async def main() -> object:
+        async with AsyncPersistentSession() as s:
+            return await s.get("https://example.com", params={"q": 1})
+
+    response = asyncio.run(main())
+
+    assert response is standard_response
+    assert isinstance(response.timings, Timings)
+    stale.assert_called_once_with(mocker.ANY, "https://example.com", params={"q": 1})
+
+
+def test_non_cloudflare_error_returns_none(mocker: pytest_mock.MockerFixture) -> None:
+    error_response = mocker.MagicMock()
+    error_response.content = b"Access denied"
+    error = HTTPError("403 Client Error")
+    error.response = error_response
+
+    mocker.patch.object(PersistentSession, "_get_without_cloudflare", side_effect=error)
+    mocker.patch("tempfile.NamedTemporaryFile")
+    solver = mocker.patch.object(PersistentSession, "_get_url_via_flaresolverr")
+
+    async def main() -> object:
+        async with AsyncPersistentSession() as s:
+            return await s.get("https://example.com")
+
+    assert asyncio.run(main()) is None
+    solver.assert_not_called()
+
+
+def test_concurrent_challenges_share_one_solve(mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+    """Coroutines challenged on the same host wait for a single solve and reuse its clearance."""
+    ps = PersistentSession()
+    calls: list[str] = []
+    calls_lock = threading.Lock()
+
+    def solve(url: str) -> dict:
+        with calls_lock:
+            calls.append(url)
+        time.sleep(0.1)
+        ps.cookies.set("cf_clearance", f"solved-{len(calls)}", domain="example.com")
+        return {}
+
+    mocker.patch.object(ps, "_get_url_via_flaresolverr", side_effect=solve)
+    mocker.patch.object(ps, "_get_without_cloudflare", return_value=standard_response)
+
+    async def main() -> list:
+        async with AsyncPersistentSession(ps) as s:
+            return await asyncio.gather(*(s.get(f"https://example.com/{i}", try_with_cloudflare=True) for i in range(10)))
+
+    assert asyncio.run(main()) == [standard_response] * 10
+    assert len(calls) == 1
+
+
+def test_waiting_for_a_solve_takes_no_worker_thread(mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+    """Coroutines queued behind a solve wait on the event loop, leaving the pool to other hosts."""
+    ps = PersistentSession()
+    release = threading.Event()
+
+    def solve(_url: str) -> dict:
+        release.wait(5)
+        ps.cookies.set("cf_clearance", "solved", domain="challenged.example.com")
+        return {}
+
+    mocker.patch.object(ps, "_get_url_via_flaresolverr", side_effect=solve)
+    mocker.patch.object(ps, "_get_without_cloudflare", return_value=standard_response)
+
+    async def main() -> list:
+        async with AsyncPersistentSession(ps, max_concurrency=2) as s:
+            challenged = [asyncio.create_task(s.get(f"https://challenged.example.com/{i}", try_with_cloudflare=True)) for i in range(5)]
+            await asyncio.sleep(0.1)
+            other = await asyncio.wait_for(s.get("https://other.example.com/"), timeout=2)
+            release.set()
+            return [other, *await asyncio.gather(*challenged)]
+
+    assert asyncio.run(main()) == [standard_response] * 6
+
+
+def test_solve_failure_is_raised(mocker: pytest_mock.MockerFixture) -> None:
+    mocker.patch.object(PersistentSession, "_get_url_via_flaresolverr", side_effect=RuntimeError("FlareSolverr error"))
+
+    async def main() -> object:
+        async with AsyncPersistentSession() as s:
+            return await s.get("https://example.com", try_with_cloudflare=True)
+
+    with pytest.raises(RuntimeError, match="FlareSolverr error"):
+        asyncio.run(main())
@@ -0,0 +1,279 @@
+import datetime
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+import pytest_mock
+
+pytest.importorskip("requests_cache")
+
+from requests_cache.backends.sqlite import SQLiteCache
+from requests_cache.models import CachedResponse
+from requests_cache.serializers import pickle_serializer
+
+from anti_cf import _cache
+from anti_cf._cache import CompressingPickleStage, ResponseCache, ResponsesDict, compressing_serializer
+
+
+def _response(
+    *,
+    created_at: datetime.datetime,
+    expires: datetime.datetime | None = None,
+    size: int = 100,
+    content: bytes | None = None,
+    content_type: str = "text/html",
+) -> CachedResponse:
+    return CachedResponse(
+        status_code=200,
+        headers={"Content-Type": content_type},
+        content=os.urandom(size) if content is None else content,
+        url="http://example/",
+        created_at=created_at,
+        expires=expires,
+    )
+
+
+def _rows(db: Path) -> dict[str, tuple]:
+    with sqlite3.connect(db) as con:
+        return {key: (created_at, size) for key, created_at, size in con.execute("SELECT key, created_at, size FROM responses")}
+
+
+def test_metadata_is_written_with_the_response(tmp_path: Path) -> None:
+    created = datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+
+    cache.responses["a"] = _response(created_at=created, size=1000)
+
+    created_at, size = _rows(tmp_path / "cache.sqlite")["a"]
+    assert created_at == int(created.timestamp())
+    assert size > 1000
+
+
+def test_legacy_rows_are_backfilled_in_batches(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+    db = tmp_path / "cache.sqlite"
+    legacy = SQLiteCache(db)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for i in range(3):
+        legacy.responses[f"kept_{i}"] = _response(created_at=now - datetime.timedelta(days=400))
+    legacy.responses["expiring"] = _response(created_at=now - datetime.timedelta(days=400), expires=now - datetime.timedelta(days=399))
+    legacy.responses.close()
+    last_write = (now - datetime.timedelta(days=30)).timestamp()
+    for path in tmp_path.glob("cache.sqlite*"):
+        os.utime(path, (last_write, last_write))
+    mocker.patch.object(_cache, "PURGE_BATCH_SIZE", 2)
+    mocker.patch.object(ResponsesDict, "deserialize", side_effect=AssertionError("unpickled a response"))
+
+    ResponseCache(db)
+
+    rows = _rows(db)
+    assert [rows[f"kept_{i}"][0] for i in range(3)] == [int(last_write)] * 3
+    assert all(size > 0 for _, size in rows.values())
+    with sqlite3.connect(db) as con:
+        assert rows["expiring"][0] == con.execute("SELECT expires FROM responses WHERE key = 'expiring'").fetchone()[0]
+        assert con.execute("SELECT COUNT(*) FROM responses WHERE last_access IS NULL").fetchone()[0] == 0
+
+
+def test_migrates_once(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+    db = tmp_path / "cache.sqlite"
+    legacy = SQLiteCache(db)
+    legacy.responses["a"] = _response(created_at=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+    legacy.responses.close()
+    ResponseCache(db).responses.close()
+    statements: list[str] = []
+    connect = sqlite3.connect
+
+    def traced(*args: object, **kwargs: object) -> sqlite3.Connection:
+        con = connect(*args, **kwargs)
+        con.set_trace_callback(statements.append)
+        return con
+
+    mocker.patch("requests_cache.backends.sqlite.sqlite3.connect", side_effect=traced)
+    ResponseCache(db)
+
+    assert statements
+    assert not [s for s in statements if s.startswith("UPDATE") or "created_at" in s or "lru_idx" in s]
+    with sqlite3.connect(db) as con:
+        assert con.execute("PRAGMA user_version").fetchone()[0] == _cache.SCHEMA_VERSION
+
+
+def test_clear_keeps_the_cache_usable(tmp_path: Path) -> None:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    cache.responses["a"] = _response(created_at=now)
+
+    cache.clear()
+    cache.responses["b"] = _response(created_at=now, size=10)
+
+    assert len(cache.responses["b"].content) == 10
+    assert list(cache.responses.keys()) == ["b"]
+    assert _rows(tmp_path / "cache.sqlite")["b"][0] == int(now.timestamp())
+    # Another process opening the database afterwards finds it just as usable.
+    assert ResponseCache(tmp_path / "cache.sqlite").responses["b"].status_code == 200
+
+
+def test_totals_read_only_the_index(tmp_path: Path) -> None:
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    cache.responses["a"] = _response(created_at=datetime.datetime.now(datetime.timezone.utc))
+
+    with cache.responses.connection() as con:
+        for query in ("SELECT SUM(size) FROM responses", "SELECT SUM(raw_size), SUM(size) FROM responses"):
+            plan = " ".join(row[-1] for row in con.execute(f"EXPLAIN QUERY PLAN {query}"))
+            assert "COVERING INDEX" in plan
+
+
+def test_evictions_delete_in_batches_without_unpickling(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    for i in range(5):
+        cache.responses[f"old_{i}"] = _response(created_at=now - datetime.timedelta(days=100))
+    for i in range(3):
+        cache.responses[f"expired_{i}"] = _response(created_at=now, expires=now - datetime.timedelta(minutes=1))
+    cache.responses["fresh"] = _response(created_at=now)
+    mocker.patch.object(ResponsesDict, "deserialize", side_effect=AssertionError("unpickled a response"))
+    statements: list[str] = []
+    with cache.responses.connection() as con:
+        con.set_trace_callback(statements.append)
+
+    assert cache.delete_expired() == 3
+    assert cache.responses.delete_where("created_at < ?", (int(now.timestamp()) - 86400,), batch_size=2) == 5
+
+    assert sorted(cache.responses.keys()) == ["fresh"]
+    # 2 + 2 + 1: each batch is its own transaction.
+    assert sum(s.startswith("DELETE") and "created_at" in s for s in statements) == 3
+
+
+class TestByteBudget:
+    def _fill(self, cache: ResponseCache, *keys: str) -> None:
+        for key in keys:
+            cache.save_response(_response(created_at=datetime.datetime.now(datetime.timezone.utc), size=10_000), key)
+
+    def test_evicts_least_recently_used_when_over_budget(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        now = mocker.patch("anti_cf._cache.time.time", return_value=1_000_000)
+        cache = ResponseCache(tmp_path / "cache.sqlite", max_bytes=35_000)
+        for key in ("a", "b", "c"):
+            self._fill(cache, key)
+            now.return_value += 10
+        assert cache.responses["a"] is not None  # "b" is now the least recently used
+        now.return_value += 10
+
+        self._fill(cache, "d")
+
+        assert sorted(cache.responses.keys()) == ["a", "c", "d"]
+        assert cache.responses.total_size() <= 35_000 * 0.9
+
+    def test_within_budget_keeps_everything(self, tmp_path: Path) -> None:
+        cache = ResponseCache(tmp_path / "cache.sqlite", max_bytes=1_000_000)
+        self._fill(cache, "a", "b", "c")
+
+        assert sorted(cache.responses.keys()) == ["a", "b", "c"]
+
+    def test_reads_are_recorded_in_batches(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        mocker.patch("anti_cf._cache.ACCESS_FLUSH_SIZE", 3)
+        cache = ResponseCache(tmp_path / "cache.sqlite")
+        self._fill(cache, "a", "b", "c")
+        flush = mocker.spy(cache.responses, "flush_access_times")
+
+        for key in ("a", "b", "a", "b"):
+            cache.responses[key]
+        flush.assert_not_called()
+
+        cache.responses["c"]
+        flush.assert_called_once()
+
+    def test_flush_during_a_read_keeps_its_access_time(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        mocker.patch("anti_cf._cache.time.time", return_value=1_000_000)
+        cache = ResponseCache(tmp_path / "cache.sqlite")
+        self._fill(cache, "a")
+        flusher = threading.Thread(target=cache.responses.flush_access_times)
+
+        class Interrupted(dict):
+            def __setitem__(self, key: str, value: int) -> None:
+                # Another thread flushes while this read is noting its access.
+                flusher.start()
+                flusher.join(0.2)
+                super().__setitem__(key, value)
+
+        cache.responses._accessed = Interrupted()
+        _cache.time.time.return_value += 10
+        cache.responses["a"]
+        flusher.join()
+
+        with sqlite3.connect(tmp_path / "cache.sqlite") as con:
+            assert con.execute("SELECT last_access FROM responses WHERE key = 'a'").fetchone()[0] == 1_000_010
+
+    def test_session_option(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        from anti_cf._persistent_session import PersistentSession
+
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+
+        assert PersistentSession(max_cache_bytes=1 << 20).cache.max_bytes == 1 << 20
+
+
+class TestCompression:
+    _HTML = b"<html><body>" + b"<p>Lorem ipsum dolor sit amet</p>" * 500 + b"</body></html>"
+
+    def _sizes(self, db: Path, key: str) -> tuple[int, int]:
+        with sqlite3.connect(db) as con:
+            return con.execute("SELECT size, raw_size FROM responses WHERE key = ?", (key,)).fetchone()
+
+    def test_text_bodies_are_compressed(self, tmp_path: Path) -> None:
+        cache = ResponseCache(tmp_path / "cache.sqlite")
+        cache.responses["page"] = _response(created_at=datetime.datetime.now(datetime.timezone.utc), content=self._HTML)
+
+        size, raw_size = self._sizes(tmp_path / "cache.sqlite", "page")
+        assert size * 5 < raw_size
+        assert cache.responses["page"].content == self._HTML
+        assert cache.responses.compression_ratio() > 5
+
+    def test_compressed_formats_are_left_alone(self, tmp_path: Path) -> None:
+        cache = ResponseCache(tmp_path / "cache.sqlite")
+        cache.responses["img"] = _response(created_at=datetime.datetime.now(datetime.timezone.utc), content=self._HTML, content_type="image/png")
+
+        size, raw_size = self._sizes(tmp_path / "cache.sqlite", "img")
+        assert size == raw_size > len(self._HTML)
+
+    @pytest.mark.parametrize("codec", ["zlib", _cache.WRITE_CODEC])
+    def test_codecs_round_trip(self, codec: str) -> None:
+        stage = CompressingPickleStage(codec)
+        value = {"_content": self._HTML, "headers": {"content-type": "application/json"}}
+
+        data = stage.dumps(value)
+
+        assert len(data) < len(self._HTML) / 5
+        assert stage.loads(data) == value
+
+    def test_cache_keys_are_unchanged(self) -> None:
+        # The serializer is part of the cache key: a different one would orphan every cached response.
+        assert str(compressing_serializer()) == str(pickle_serializer)
+
+    def test_migration_of_an_existing_cache(self, tmp_path: Path) -> None:
+        db = tmp_path / "cache.sqlite"
+        legacy = SQLiteCache(db)
+        legacy.responses["page"] = _response(created_at=datetime.datetime.now(datetime.timezone.utc), content=self._HTML)
+        legacy.responses["random"] = _response(created_at=datetime.datetime.now(datetime.timezone.utc), size=2000)
+        legacy.responses.close()
+
+        cache = ResponseCache(db)
+        assert cache.responses["page"].content == self._HTML  # Readable before migrating
+        assert cache.responses.compression_ratio() == 1.0
+
+        assert cache.responses.compress_existing(batch_size=1) == 1
+        assert cache.responses.compress_existing() == 0
+
+        assert cache.responses["page"].content == self._HTML
+        assert cache.responses.compression_ratio() > 2
+
+    def test_purge_reports_the_ratio(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        from anti_cf._persistent_session import PersistentSession
+
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+        ps = PersistentSession()
+        ps.cache.responses["page"] = _response(created_at=datetime.datetime.now(datetime.timezone.utc), content=self._HTML)
+
+        assert ps.purge_cache(vacuum=False)["compression_ratio"] > 5
@@ -0,0 +1,143 @@
+import threading
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import pytest_mock
+
+from anti_cf import DO_NOT_CACHE, NEVER_EXPIRE, ExpiryPolicy
+
+_POLICY = ExpiryPolicy(
+    {
+        "static.example.com": NEVER_EXPIRE,
+        "example.com/listing": DO_NOT_CACHE,
+        "https://example.com/item/*/reviews": 60,
+        "*.example.com/api/*/items": timedelta(minutes=5),
+        "example.com": timedelta(hours=1),
+        "*.cdn.net": 86400,
+        "img-??.cdn.net": 1,  # Shadowed by the rule above
+    }
+)
+
+
+@pytest.mark.parametrize(
+    ("url", "expected"),
+    [
+        ("https://static.example.com/a.png", NEVER_EXPIRE),
+        ("https://STATIC.example.com/a.png", NEVER_EXPIRE),
+        ("https://example.com/listing", DO_NOT_CACHE),
+        ("https://example.com/listing?page=2", DO_NOT_CACHE),
+        ("https://example.com/item/42/reviews?sort=new", 60),
+        ("http://example.com/item/42/reviews", 60),
+        ("https://example.com/item/42", 3600),
+        ("https://example.com", 3600),
+        ("https://shop.example.com/api/v1/items", 300),
+        ("https://shop.example.com/api/v1/other", None),
+        ("https://a.cdn.net/x.js", 86400),
+        ("https://img-01.cdn.net/x.js", 86400),
+        ("https://a.cdn.network/x.js", None),
+        ("https://sub.static.example.com/", None),
+        ("https://other.org/", None),
+    ],
+)
+def test_expire_after(url: str, expected: int | None) -> None:
+    assert _POLICY.expire_after(url) == expected
+
+
+def test_first_matching_rule_wins() -> None:
+    policy = ExpiryPolicy({"*.example.com/a": 1, "www.example.com/a/b": 2, "www.example.com": 3})
+
+    assert policy.expire_after("https://www.example.com/a/b") == 1
+    assert policy.expire_after("https://www.example.com/c") == 3
+
+
+def test_many_rules() -> None:
+    rules = {f"host{i}.example.com/section/{i}": i for i in range(1, 500)}
+    rules.update({f"*.tenant{i}.example.org": i for i in range(1, 500)})
+    policy = ExpiryPolicy(rules)
+
+    assert len(policy) == 998
+    assert policy.expire_after("https://host321.example.com/section/321/page") == 321
+    assert policy.expire_after("https://host321.example.com/section/320") is None
+    assert policy.expire_after("https://a.tenant77.example.org/") == 77
+
+
+class TestSessionIntegration:
+    @pytest.fixture
+    def origin(self) -> Iterator[str]:
+        """A local page recording the headers of every request it gets."""
+        self.received: list[dict[str, str]] = []
+        received = self.received
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_args: object) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                received.append(dict(self.headers))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+        server.shutdown()
+        server.server_close()
+
+    @pytest.fixture
+    def session(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> Iterator[object]:
+        pytest.importorskip("requests_cache")
+        from anti_cf._persistent_session import PersistentSession
+
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+        session = PersistentSession(cache_policies={"127.0.0.1/static": NEVER_EXPIRE, "127.0.0.1/listing": DO_NOT_CACHE, "127.0.0.1/short": 60})
+        yield session
+        session.close()
+
+    def _cached(self, session: object, url: str) -> object:
+        from requests import Request
+
+        return session.cache.get_response(session.cache.create_key(session.prepare_request(Request("GET", url))))
+
+    def test_policy_sets_the_expiry(self, session: object, origin: str) -> None:
+        session.request("GET", f"{origin}/static/app.js")
+        session.request("GET", f"{origin}/short")
+        session.request("GET", f"{origin}/other")
+
+        assert self._cached(session, f"{origin}/static/app.js").expires is None
+        remaining = self._cached(session, f"{origin}/short").expires - datetime.now(UTC)
+        assert timedelta(seconds=50) < remaining <= timedelta(seconds=60)
+        remaining = self._cached(session, f"{origin}/other").expires - datetime.now(UTC)
+        assert timedelta(hours=1) < remaining <= timedelta(hours=2)
+
+    def test_do_not_cache_never_writes(self, session: object, origin: str) -> None:
+        session.request("GET", f"{origin}/listing")
+        session.request("GET", f"{origin}/listing")
+
+        assert self._cached(session, f"{origin}/listing") is None
+        assert len(self.received) == 2
+
+    def test_request_headers_untouched(self, session: object, origin: str) -> None:
+        for path in ("/static/app.js", "/listing", "/short", "/other"):
+            session.request("GET", f"{origin}{path}")
+
+        assert len(self.received) == 4
+        for headers in self.received:
+            assert "Cache-Control" not in headers
+            assert not any(name.lower() == "x-actual-no-cache" for name in headers)
+
+    def test_explicit_expire_after_wins(self, session: object, origin: str) -> None:
+        session.request("GET", f"{origin}/static/app.js", expire_after=10)
+
+        remaining = self._cached(session, f"{origin}/static/app.js").expires - datetime.now(UTC)
+        assert remaining <= timedelta(seconds=10)
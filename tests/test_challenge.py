@@ -0,0 +1,100 @@
+import io
+from typing import NamedTuple
+
+import pytest
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from urllib3 import HTTPResponse
+
+from anti_cf._challenge import PREFIX_BYTES, body_prefix, is_cloudflare_challenge
+
+_CF = {"Server": "cloudflare", "CF-RAY": "8c1f2e3d4a5b6c7d-AMS", "Content-Type": "text/html; charset=UTF-8"}
+
+_CHALLENGE_PAGE = (
+    b'<!DOCTYPE html><html lang="en-US"><head><title>Just a moment...</title><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">'
+    b"<script>(function(){window._cf_chl_opt={cvId: '3',cZone: \"example.com\",cType: 'managed'};"
+    b"var a = document.createElement('script');a.src = '/cdn-cgi/challenge-platform/h/g/orchestrate/chl_page/v1?ray=8c1f2e3d4a5b6c7d';"
+    b"</script></head><body><noscript>Enable JavaScript and cookies to continue</noscript></body></html>"
+)
+_LEGACY_CHALLENGE_PAGE = (
+    b'<!DOCTYPE HTML><html lang="en-US"><head><title>Just a moment...</title></head><body>'
+    b'<form id="challenge-form" action="/?__cf_chl_jschl_tk__=abc" method="POST"></form></body></html>'
+)
+_TURNSTILE_PAGE = b'<html><head><title>example.com</title></head><body><script src="/cdn-cgi/challenge-platform/scripts/jsd/main.js"></script></body></html>'
+_BLOCK_PAGE = (
+    b'<!DOCTYPE html><html class="no-js" lang="en-US"><head><title>Access denied | example.com used Cloudflare to restrict access</title></head>'
+    b'<body><div id="cf-wrapper"><h1>Error 1020</h1><p>Ray ID: 8c1f2e3d4a5b6c7d</p></div></body></html>'
+)
+
+
+class Recorded(NamedTuple):
+    status: int
+    headers: dict[str, str]
+    body: bytes
+    challenge: bool
+    reads_body: bool
+
+
+_RECORDED = {
+    "managed challenge": Recorded(403, {**_CF, "cf-mitigated": "challenge"}, _CHALLENGE_PAGE, challenge=True, reads_body=False),
+    "challenge on an odd status": Recorded(500, {**_CF, "cf-mitigated": "challenge"}, _CHALLENGE_PAGE, challenge=True, reads_body=False),
+    "challenge without cf-mitigated": Recorded(403, _CF, _CHALLENGE_PAGE, challenge=True, reads_body=True),
+    "legacy IUAM page": Recorded(503, _CF, _LEGACY_CHALLENGE_PAGE, challenge=True, reads_body=True),
+    "turnstile interstitial": Recorded(429, {"CF-RAY": "8c1f2e3d4a5b6c7d-AMS", "Content-Type": "text/html"}, _TURNSTILE_PAGE, challenge=True, reads_body=True),
+    "firewall block (1020)": Recorded(403, _CF, _BLOCK_PAGE, challenge=False, reads_body=True),
+    "origin 403 behind nginx": Recorded(
+        403, {"Server": "nginx", "Content-Type": "text/html"}, b"<title>Just a moment...</title>", challenge=False, reads_body=False
+    ),
+    "json API error": Recorded(403, {**_CF, "Content-Type": "application/json"}, b'{"error": "just a moment"}', challenge=False, reads_body=False),
+    "not found": Recorded(404, _CF, b"<title>Just a moment...</title>", challenge=False, reads_body=False),
+    "server error": Recorded(502, _CF, b"<title>502 Bad Gateway</title>", challenge=False, reads_body=False),
+    "large image": Recorded(403, {**_CF, "Content-Type": "image/png"}, b"\x89PNG" + b"\0" * 1_000_000, challenge=False, reads_body=False),
+    "large page, marker past the prefix": Recorded(503, _CF, b"<html>" + b" " * 1_000_000 + b"just a moment", challenge=False, reads_body=True),
+}
+
+
+class _Body(io.BytesIO):
+    """Remembers how much was read, even after urllib3 closed it."""
+
+    consumed = 0
+
+    def read(self, size: int | None = -1) -> bytes:
+        data = super().read(size)
+        self.consumed += len(data)
+        return data
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:
+        n = super().readinto(buffer)
+        self.consumed += n
+        return n
+
+
+def _response(recorded: Recorded, *, stream: bool) -> tuple[Response, _Body]:
+    body = _Body(recorded.body)
+    response = Response()
+    response.status_code = recorded.status
+    response.headers = CaseInsensitiveDict(recorded.headers)
+    response.raw = HTTPResponse(body=body, headers=recorded.headers, status=recorded.status, preload_content=False)
+    if not stream:
+        response.content  # What requests does for stream=False
+    return response, body
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["downloaded", "streamed"])
+@pytest.mark.parametrize("name", list(_RECORDED))
+def test_recorded_responses(name: str, stream: bool) -> None:
+    recorded = _RECORDED[name]
+    response, body = _response(recorded, stream=stream)
+
+    assert is_cloudflare_challenge(response) is recorded.challenge
+
+    if stream:
+        assert body.consumed <= PREFIX_BYTES if recorded.reads_body else body.consumed == 0
+    assert response.content == recorded.body
+
+
+def test_prefix_is_put_back_for_streamed_bodies() -> None:
+    response, _ = _response(_RECORDED["legacy IUAM page"], stream=True)
+
+    assert body_prefix(response, 10) == _LEGACY_CHALLENGE_PAGE[:10]
+    assert b"".join(response.iter_content(7)) == _LEGACY_CHALLENGE_PAGE
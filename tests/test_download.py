@@ -0,0 +1,212 @@
+import hashlib
+import threading
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import pytest_mock
+import requests
+
+from anti_cf._persistent_session import PersistentSession
+
+_FILE = hashlib.sha256(b"seed").digest() * 40_000  # 1.28 MB
+
+
+@dataclass
+class Origin:
+    """A file server that can drop connections mid-body and challenge requests, and logs what it got asked."""
+
+    url: str = ""
+    body: bytes = _FILE
+    etag: str = '"v1"'
+    # Cut the connection after this many body bytes, once per entry.
+    drops: list[int] = field(default_factory=list)
+    # Answer this many requests with a challenge page.
+    challenges: int = 0
+    # Challenge the old way: no ``cf-mitigated``, just Cloudflare's headers and page.
+    legacy_challenge: bool = False
+    ranges: list[str | None] = field(default_factory=list)
+    headers: list[dict[str, str]] = field(default_factory=list)
+
+    def handler(self) -> type[BaseHTTPRequestHandler]:
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_args: object) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                origin.ranges.append(self.headers.get("Range"))
+                origin.headers.append(dict(self.headers))
+                if origin.challenges:
+                    origin.challenges -= 1
+                    page = b"<html><title>Just a moment...</title></html>"
+                    self.send_response(403)
+                    if origin.legacy_challenge:
+                        self.send_header("Server", "cloudflare")
+                        self.send_header("CF-RAY", "8c1f2e3d4a5b6c7d-AMS")
+                    else:
+                        self.send_header("cf-mitigated", "challenge")
+                    self.send_header("Content-Type", "text/html")
+                    self.send_header("Content-Length", str(len(page)))
+                    self.end_headers()
+                    self.wfile.write(page)
+                    return
+
+                start = 0
+                range_header = self.headers.get("Range")
+                if range_header and self.headers.get("If-Range", origin.etag) == origin.etag:
+                    start = int(range_header.removeprefix("bytes=").removesuffix("-"))
+                if start >= len(origin.body) and start:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(origin.body)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                body = origin.body[start:]
+                self.send_response(206 if start else 200)
+                if start:
+                    self.send_header("Content-Range", f"bytes {start}-{len(origin.body) - 1}/{len(origin.body)}")
+                self.send_header("ETag", origin.etag)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if origin.drops:
+                    self.wfile.write(body[: origin.drops.pop(0)])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        return Handler
+
+
+@pytest.fixture
+def origin() -> Iterator[Origin]:
+    origin = Origin()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), origin.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin.url = f"http://127.0.0.1:{server.server_address[1]}/file.bin"
+    yield origin
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ps(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> PersistentSession:
+    mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+    mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+    mocker.patch("anti_cf._persistent_session._DOWNLOAD_RETRY_DELAY", 0.0)
+    mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+    # These tests talk to a real local server: undo conftest's stand-in for ``Session.get``.
+    mocker.patch("requests.Session.get", lambda self, url, **kwargs: self.request("GET", url, **kwargs))
+    return PersistentSession()
+
+
+def test_streams_to_disk(ps: PersistentSession, origin: Origin, tmp_path: Path) -> None:
+    dest = ps.download(origin.url, tmp_path / "file.bin", chunk_size=4096)
+
+    assert dest.read_bytes() == _FILE
+    assert sorted(p.name for p in tmp_path.glob("file.bin*")) == ["file.bin"]
+
+
+def test_resumes_after_dropped_connections(ps: PersistentSession, origin: Origin, tmp_path: Path) -> None:
+    origin.drops = [100_000, 300_000]
+
+    dest = ps.download(origin.url, tmp_path / "file.bin", chunk_size=10_000)
+
+    assert dest.read_bytes() == _FILE
+    assert origin.ranges == [None, "bytes=100000-", "bytes=400000-"]
+
+
+def test_resumes_after_a_challenge(ps: PersistentSession, origin: Origin, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+    origin.drops = [500_000]
+    solve = mocker.patch.object(ps, "_solve_challenge")
+
+    def challenge_next(*_args: object) -> None:
+        origin.challenges = 1
+
+    # The connection drops, and by the time the download resumes the clearance expired.
+    mocker.patch("anti_cf._persistent_session.time.sleep", side_effect=challenge_next)
+
+    dest = ps.download(origin.url, tmp_path / "file.bin", chunk_size=10_000)
+
+    assert dest.read_bytes() == _FILE
+    solve.assert_called_once_with(origin.url)
+    assert origin.ranges == [None, "bytes=500000-", "bytes=500000-"]
+
+
+def test_solves_a_legacy_challenge(ps: PersistentSession, origin: Origin, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+    origin.challenges, origin.legacy_challenge = 1, True
+    solve = mocker.patch.object(ps, "_solve_challenge")
+
+    dest = ps.download(origin.url, tmp_path / "file.bin")
+
+    assert dest.read_bytes() == _FILE
+    solve.assert_called_once_with(origin.url)
+
+
+def test_request_headers_untouched(ps: PersistentSession, origin: Origin, tmp_path: Path) -> None:
+    ps.download(origin.url, tmp_path / "file.bin")
+
+    assert "Cache-Control" not in origin.headers[0]
+    assert not any(name.lower() == "x-actual-no-cache" for name in origin.headers[0])
+
+
+def test_resumes_part_file_of_earlier_call(ps: PersistentSession, origin: Origin, tmp_path: Path) -> None:
+    origin.drops = [200_000]
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        ps.download(origin.url, tmp_path / "file.bin", chunk_size=10_000, max_attempts=1)
+    assert (tmp_path / "file.bin.part").stat().st_size == 200_000
+
+    ps.download(origin.url, tmp_path / "file.bin", chunk_size=10_000)
+
+    assert (tmp_path / "file.bin").read_bytes() == _FILE
+    assert origin.ranges[-1] == "bytes=200000-"
+
+
+def test_starts_over_when_the_file_changed(ps: PersistentSession, origin: Origin, tmp_path: Path) -> None:
+    origin.drops = [200_000]
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        ps.download(origin.url, tmp_path / "file.bin", chunk_size=10_000, max_attempts=1)
+    origin.body, origin.etag = _FILE[::-1], '"v2"'
+
+    ps.download(origin.url, tmp_path / "file.bin", chunk_size=10_000)
+
+    assert (tmp_path / "file.bin").read_bytes() == _FILE[::-1]
+
+
+def test_gives_up_after_max_attempts(ps: PersistentSession, origin: Origin, tmp_path: Path) -> None:
+    origin.drops = [1000, 1000, 1000]
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        ps.download(origin.url, tmp_path / "file.bin", chunk_size=10_000, max_attempts=3)
+
+    assert len(origin.ranges) == 3
+
+
+def test_cached_as_file_reference(ps: PersistentSession, origin: Origin, tmp_path: Path) -> None:
+    pytest.importorskip("requests_cache")
+
+    ps.download(origin.url, tmp_path / "file.bin", cache_as_file=True)
+    ps.download(origin.url, tmp_path / "copy.bin", cache_as_file=True)
+
+    assert len(origin.ranges) == 1
+    assert (tmp_path / "copy.bin").read_bytes() == _FILE
+    assert ps.cache.responses.total_size() < 10_000
+    assert len(ps.cache.responses) == 1
+    response = ps.request("GET", origin.url)
+    # Read from the file as it's consumed, not loaded along with the response.
+    assert response._content is False
+    assert b"".join(response.iter_content(100_000)) == _FILE
+    assert ps.request("GET", origin.url).content == _FILE
+
+    (tmp_path / "file.bin").unlink()
+    assert ps.request("GET", origin.url).content == _FILE
+    assert len(origin.ranges) == 2
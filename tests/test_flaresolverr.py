@@ -1,8 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
 from unittest.mock import MagicMock
 
+import pytest
 import pytest_mock
+import requests
 
-from anti_cf._flaresolverr import ensure_flaresolverr_running, get_flaresolverr_settings, start_flaresolverr_docker
+from anti_cf import _flaresolverr
+from anti_cf._flaresolverr import (
+    FlareSolverrContainer,
+    FlareSolverrPool,
+    default_container,
+    ensure_flaresolverr_running,
+    get_flaresolverr_settings,
+    invalidate_flaresolverr_settings,
+    start_flaresolverr_docker,
+)
+from anti_cf._persistent_session import PersistentSession
+
+# conftest replaces ``subprocess.Popen`` so nothing ever starts docker; the
+# container tests put the real one back to run a stand-in docker CLI.
+_Popen = subprocess.Popen
+
+_FAKE_DOCKER = """import json
+import sys
+from pathlib import Path
+
+state_file = Path(__file__).with_suffix(".json")
+state = json.loads(state_file.read_text()) if state_file.exists() else {"containers": {}, "calls": []}
+args = sys.argv[1:]
+state["calls"].append(args)
+containers = state["containers"]
+
+rc = 0
+if args[0] == "inspect":
+    if args[-1] in containers:
+        print(containers[args[-1]])
+    else:
+        print(f"Error: No such object: {args[-1]}", file=sys.stderr)
+        rc = 1
+elif args[0] == "run":
+    name = args[args.index("--name") + 1]
+    if name in containers:
+        print(f"Conflict. The container name {name} is already in use", file=sys.stderr)
+        rc = 125
+    else:
+        containers[name] = "running"
+        print("0123456789ab")
+elif args[0] in ("start", "stop"):
+    if args[1] in containers:
+        containers[args[1]] = "running" if args[0] == "start" else "exited"
+        print(args[1])
+    else:
+        print(f"Error: No such container: {args[1]}", file=sys.stderr)
+        rc = 1
+
+state_file.write_text(json.dumps(state))
+sys.exit(rc)
+"""
 
 
 def test_check_flaresolverr_api_success(mocker: pytest_mock.MockerFixture) -> None:
@@ -20,6 +81,65 @@ def test_check_flaresolverr_api_failure(mocker: pytest_mock.MockerFixture) -> No
     assert get_flaresolverr_settings() is None
 
 
+class TestSettingsCache:
+    @pytest.fixture
+    def probe(self, mocker: pytest_mock.MockerFixture) -> MagicMock:
+        response = mocker.Mock()
+        response.json.return_value = {"msg": "FlareSolverr is ready!", "userAgent": "FlareSolverr/1.0"}
+        return mocker.patch("requests.get", return_value=response)
+
+    def test_answer_is_reused(self, probe: MagicMock) -> None:
+        assert get_flaresolverr_settings()["userAgent"] == "FlareSolverr/1.0"
+        assert get_flaresolverr_settings()["userAgent"] == "FlareSolverr/1.0"
+        probe.assert_called_once()
+
+    def test_answer_is_shared_through_the_cache_file(self, probe: MagicMock, tmp_path: Path) -> None:
+        get_flaresolverr_settings()
+        assert (tmp_path / "flaresolverr.json").exists()
+
+        # What a sibling process starts with: nothing in memory.
+        _flaresolverr._settings_cache.clear()
+        assert get_flaresolverr_settings()["userAgent"] == "FlareSolverr/1.0"
+        probe.assert_called_once()
+
+    def test_max_age(self, probe: MagicMock) -> None:
+        get_flaresolverr_settings()
+        get_flaresolverr_settings(max_age=0)
+        assert probe.call_count == 2
+
+    def test_failures_expire_sooner(self, mocker: pytest_mock.MockerFixture) -> None:
+        probe = mocker.patch("requests.get", side_effect=ConnectionError("refused"))
+        now = mocker.patch("anti_cf._flaresolverr.time.time", return_value=1000.0)
+
+        assert get_flaresolverr_settings() is None
+        now.return_value += _flaresolverr.SETTINGS_FAILURE_TTL - 1
+        assert get_flaresolverr_settings() is None
+        probe.assert_called_once()
+
+        now.return_value += 2
+        get_flaresolverr_settings()
+        assert probe.call_count == 2
+
+    def test_invalidate(self, probe: MagicMock, tmp_path: Path) -> None:
+        get_flaresolverr_settings()
+        invalidate_flaresolverr_settings()
+
+        assert json.loads((tmp_path / "flaresolverr.json").read_text()) == {}
+        get_flaresolverr_settings()
+        assert probe.call_count == 2
+
+    def test_solve_connection_error_invalidates(self, mocker: pytest_mock.MockerFixture) -> None:
+        invalidate = mocker.patch("anti_cf._persistent_session.invalidate_flaresolverr_settings")
+        url = _closed_port_url()
+        session = PersistentSession(flaresolverr_pool=FlareSolverrPool([url]))
+        session._flaresolverr_initialized = True
+
+        with pytest.raises(requests.ConnectionError):
+            session._get_url_via_flaresolverr("https://example.com/")
+
+        invalidate.assert_called_once_with(url)
+
+
 def test_start_flaresolverr_docker_success(mocker: pytest_mock.MockerFixture) -> None:
     mock_process = mocker.Mock()
     mocker.patch("subprocess.Popen", return_value=mock_process)
@@ -57,18 +177,336 @@ def test_start_flaresolverr_docker_failure2(mocker: pytest_mock.MockerFixture) -
 def test_ensure_flaresolverr_running_already_running(mocker: pytest_mock.MockerFixture) -> None:
     mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", return_value={})
     mock_start = mocker.patch("anti_cf._flaresolverr.start_flaresolverr_docker")
+    adopt = mocker.patch.object(FlareSolverrContainer, "adopt")
 
     result = ensure_flaresolverr_running()
 
     assert result is None
     mock_start.assert_not_called()
+    adopt.assert_called_once_with()
 
 
 def test_ensure_flaresolverr_running_needs_start(mocker: pytest_mock.MockerFixture) -> None:
-    mock_process = mocker.Mock()
     mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", return_value=None)
-    mocker.patch("anti_cf._flaresolverr.start_flaresolverr_docker", return_value=mock_process)
+    ensure = mocker.patch.object(FlareSolverrContainer, "ensure_running", return_value=True)
 
     result = ensure_flaresolverr_running()
 
-    assert result == mock_process
+    assert result is default_container()
+    ensure.assert_called_once()
+
+
+def test_ensure_flaresolverr_running_start_fails(mocker: pytest_mock.MockerFixture) -> None:
+    mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", return_value=None)
+    mocker.patch.object(FlareSolverrContainer, "ensure_running", return_value=False)
+
+    assert ensure_flaresolverr_running() is None
+
+
+def _closed_port_url() -> str:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/"
+
+
+def _solve_in_threads(ps: PersistentSession, count: int) -> list[BaseException]:
+    errors: list[BaseException] = []
+
+    def solve(i: int) -> None:
+        try:
+            ps._get_url_via_flaresolverr(f"https://example.com/{i}")
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=solve, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+class TestFlareSolverrPool:
+    def test_spreads_solves_over_backends(self, flaresolverr_stub: Callable) -> None:
+        stubs = [flaresolverr_stub(solve_delay=0.2) for _ in range(2)]
+        pool = FlareSolverrPool([s.url for s in stubs], max_concurrent_per_backend=2)
+        ps = PersistentSession(flaresolverr_pool=pool)
+
+        assert _solve_in_threads(ps, 4) == []
+
+        assert [s.solves for s in stubs] == [2, 2]
+        assert all(s.max_in_flight <= 2 for s in stubs)
+        assert ps._clearance_for("https://example.com/") is not None
+
+    def test_caps_concurrent_solves_per_backend(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub(solve_delay=0.05)
+        pool = FlareSolverrPool([stub.url], max_concurrent_per_backend=1)
+        ps = PersistentSession(flaresolverr_pool=pool)
+
+        assert _solve_in_threads(ps, 4) == []
+
+        assert stub.solves == 4
+        assert stub.max_in_flight == 1
+
+    def test_failing_backend_is_taken_out_of_rotation(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        pool = FlareSolverrPool([_closed_port_url(), stub.url], failure_cooldown=60)
+        dead, live = pool.backends
+        ps = PersistentSession(flaresolverr_pool=pool)
+
+        # Both are idle and healthy, so the first solve goes to the first (dead) one.
+        with pytest.raises(requests.ConnectionError):
+            ps._get_url_via_flaresolverr("https://example.com/")
+        assert not dead.healthy
+
+        for _ in range(3):
+            ps._get_url_via_flaresolverr("https://example.com/")
+        assert stub.solves == 3
+        assert live.healthy
+
+    def test_all_backends_down_still_tries(self) -> None:
+        pool = FlareSolverrPool([_closed_port_url()], failure_cooldown=60)
+        ps = PersistentSession(flaresolverr_pool=pool)
+
+        for _ in range(2):
+            with pytest.raises(requests.ConnectionError):
+                ps._get_url_via_flaresolverr("https://example.com/")
+        assert pool.backends[0].failures == 2
+
+    def test_health_check(self, flaresolverr_stub: Callable, mocker: pytest_mock.MockerFixture) -> None:
+        # The autouse fixture stubs the probe out; this test wants the real one.
+        mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", wraps=get_flaresolverr_settings)
+        stub = flaresolverr_stub()
+        pool = FlareSolverrPool([_closed_port_url(), stub.url])
+
+        assert [b.url for b in pool.health_check()] == [stub.url]
+        assert not pool.backends[0].healthy
+
+    def test_acquire_times_out_when_saturated(self) -> None:
+        pool = FlareSolverrPool(["http://127.0.0.1:1/"], max_concurrent_per_backend=1)
+
+        with pool.acquire(), pytest.raises(TimeoutError), pool.acquire(timeout=0.05):
+            pass
+
+    def test_start_local_uses_one_named_container_per_port(self, mocker: pytest_mock.MockerFixture) -> None:
+        mocker.patch.object(FlareSolverrContainer, "ensure_running", side_effect=[True, False])
+
+        pool = FlareSolverrPool.start_local(2, base_port=9000)
+
+        assert [b.url for b in pool.backends] == ["http://localhost:9000/", "http://localhost:9001/"]
+        assert [b.container.name for b in pool.backends] == ["anti_cf-flaresolverr-9000", "anti_cf-flaresolverr-9001"]
+        assert pool.backends[0].healthy
+        assert not pool.backends[1].healthy
+
+
+class TestFlareSolverrSessions:
+    def _session(self, stub: object, ttl: float = 600) -> PersistentSession:
+        return PersistentSession(flaresolverr_pool=FlareSolverrPool([stub.url]), flaresolverr_session_ttl=ttl)
+
+    def test_solves_reuse_one_browser_session_per_host(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        ps = self._session(stub)
+
+        ps._get_url_via_flaresolverr("https://example.com/a")
+        ps._get_url_via_flaresolverr("https://example.com/b")
+        ps._get_url_via_flaresolverr("https://other.example.org/")
+
+        creates = [c for c in stub.commands if c["cmd"] == "sessions.create"]
+        solves = [c for c in stub.commands if c["cmd"] == "request.get"]
+        assert len(creates) == 2
+        assert solves[0]["session"] == solves[1]["session"] == creates[0]["session"]
+        assert solves[2]["session"] == creates[1]["session"]
+        assert ps._browser_sessions.list_sessions(stub.url) == sorted(c["session"] for c in creates)
+
+    def test_idle_sessions_expire(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        ps = self._session(stub, ttl=0)
+
+        ps._get_url_via_flaresolverr("https://example.com/a")
+        first = next(iter(stub.browser_sessions))
+        ps._get_url_via_flaresolverr("https://example.com/b")
+
+        assert first not in stub.browser_sessions
+        assert len(stub.browser_sessions) == 1
+
+    def test_close_destroys_sessions(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        ps = self._session(stub)
+        ps._get_url_via_flaresolverr("https://example.com/")
+        assert stub.browser_sessions
+
+        ps.close()
+
+        assert not stub.browser_sessions
+
+    def test_lost_session_is_recreated(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        ps = self._session(stub)
+        ps._get_url_via_flaresolverr("https://example.com/")
+
+        stub.browser_sessions.clear()  # FlareSolverr restarted
+        with pytest.raises(requests.HTTPError):
+            ps._get_url_via_flaresolverr("https://example.com/")
+
+        ps._get_url_via_flaresolverr("https://example.com/")
+        assert len(stub.browser_sessions) == 1
+        assert stub.solves == 2
+
+    def test_dead_backend_fails_on_session_create(self) -> None:
+        ps = PersistentSession(flaresolverr_pool=FlareSolverrPool([_closed_port_url()]), flaresolverr_session_ttl=600)
+        ps._flaresolverr_initialized = True
+
+        with pytest.raises(requests.ConnectionError):
+            ps._get_url_via_flaresolverr("https://example.com/")
+
+        assert not ps._flaresolverr_pool.backends[0].healthy
+        assert not ps._flaresolverr_initialized
+        assert ps.stats()["solves"]["error"] == 1
+
+    def test_disabled_by_default(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        ps = PersistentSession(flaresolverr_pool=FlareSolverrPool([stub.url]))
+
+        ps._get_url_via_flaresolverr("https://example.com/")
+
+        assert [c["cmd"] for c in stub.commands] == ["request.get"]
+        assert "session" not in stub.commands[0]
+
+
+class FakeDocker:
+    def __init__(self, directory: Path) -> None:
+        self.script = directory / "docker"
+        self.script.write_text(f"#!{sys.executable}\n{_FAKE_DOCKER}")
+        self.script.chmod(0o755)
+        self.state_file = directory / "docker.json"
+
+    def seed(self, **containers: str) -> None:
+        self.state_file.write_text(json.dumps({"containers": containers, "calls": []}))
+
+    @property
+    def state(self) -> dict:
+        return json.loads(self.state_file.read_text()) if self.state_file.exists() else {"containers": {}, "calls": []}
+
+    @property
+    def commands(self) -> list[str]:
+        return [call[0] for call in self.state["calls"]]
+
+
+@pytest.fixture
+def fake_docker(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> FakeDocker:
+    if os.name == "nt":
+        pytest.skip("the docker stand-in is a shebang script")
+    mocker.patch("subprocess.Popen", _Popen)
+    directory = tmp_path / "fake_docker"
+    directory.mkdir()
+    return FakeDocker(directory)
+
+
+class TestFlareSolverrContainer:
+    def _container(self, fake_docker: FakeDocker, tmp_path: Path, **kwargs: object) -> FlareSolverrContainer:
+        kwargs.setdefault("idle_timeout", None)
+        kwargs.setdefault("docker", str(fake_docker.script))
+        return FlareSolverrContainer(state_dir=tmp_path / "state", **kwargs)
+
+    def test_runs_container_when_missing(self, fake_docker: FakeDocker, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", side_effect=[None, None, None, {}])
+        container = self._container(fake_docker, tmp_path)
+
+        assert container.ensure_running()
+
+        assert fake_docker.commands == ["inspect", "run"]
+        run = fake_docker.state["calls"][1]
+        assert run[run.index("--name") + 1] == "anti_cf-flaresolverr"
+        assert "--rm" not in run
+        assert container.state() == "running"
+        assert container.heartbeat_file.exists()
+
+    def test_restarts_stopped_container(self, fake_docker: FakeDocker, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        fake_docker.seed(**{"anti_cf-flaresolverr": "exited"})
+        mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", side_effect=[None, None, {}])
+        container = self._container(fake_docker, tmp_path)
+
+        assert container.ensure_running()
+
+        assert fake_docker.commands == ["inspect", "start"]
+
+    def test_adopts_running_container_without_docker(self, fake_docker: FakeDocker, tmp_path: Path) -> None:
+        container = self._container(fake_docker, tmp_path)
+
+        assert container.ensure_running()
+
+        assert fake_docker.commands == []
+        assert container.heartbeat_file.exists()
+
+    def test_waits_for_booting_container(self, fake_docker: FakeDocker, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        """Another process already started it: don't start a second one, just wait."""
+        fake_docker.seed(**{"anti_cf-flaresolverr": "running"})
+        mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", side_effect=[None, None, None, None, {}])
+        container = self._container(fake_docker, tmp_path)
+
+        assert container.ensure_running()
+
+        assert fake_docker.commands == ["inspect"]
+
+    def test_start_failure(self, fake_docker: FakeDocker, tmp_path: Path, mocker: pytest_mock.MockerFixture, mock_logger: dict[str, MagicMock]) -> None:
+        mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", return_value=None)
+        container = self._container(fake_docker, tmp_path, docker=str(tmp_path / "no-such-docker"))
+
+        assert not container.ensure_running()
+        assert "Failed to start FlareSolverr docker" in mock_logger["error"].call_args[0][0]
+
+    def test_stops_only_when_idle(self, fake_docker: FakeDocker, tmp_path: Path) -> None:
+        fake_docker.seed(**{"anti_cf-flaresolverr": "running"})
+        container = self._container(fake_docker, tmp_path, idle_timeout=60)
+        container.touch()
+
+        assert not container.stop_if_idle()
+        assert fake_docker.commands == []
+
+        old = time.time() - 120
+        os.utime(container.heartbeat_file, (old, old))
+        assert container.stop_if_idle()
+        assert fake_docker.state["containers"] == {"anti_cf-flaresolverr": "exited"}
+
+    def test_watches_only_its_own_container(self, fake_docker: FakeDocker, tmp_path: Path) -> None:
+        """Something else answers on the port: leave it alone."""
+        container = self._container(fake_docker, tmp_path, idle_timeout=60)
+
+        assert container.ensure_running()
+
+        assert fake_docker.commands == ["inspect"]
+        assert container._watchdog is None
+        assert not container.heartbeat_file.exists()
+
+    def test_watches_a_running_container(self, fake_docker: FakeDocker, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        fake_docker.seed(**{"anti_cf-flaresolverr": "running"})
+        mocker.patch.object(FlareSolverrContainer, "_watch_idle")
+        container = self._container(fake_docker, tmp_path, idle_timeout=60)
+
+        assert container.ensure_running()
+
+        assert container._watchdog is not None
+        assert container.heartbeat_file.exists()
+
+    def test_watchdog_gives_up_when_stop_fails(self, fake_docker: FakeDocker, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        mocker.patch("anti_cf._flaresolverr.time.sleep")
+        container = self._container(fake_docker, tmp_path, idle_timeout=60)
+        container.touch()
+        old = time.time() - 120
+        os.utime(container.heartbeat_file, (old, old))
+
+        container._watch_idle()  # No such container: docker stop fails
+
+        assert fake_docker.commands == ["stop"]
+
+    def test_readiness_backoff(self, mocker: pytest_mock.MockerFixture) -> None:
+        from anti_cf._flaresolverr import _wait_until_ready
+
+        mocker.patch("anti_cf._flaresolverr.get_flaresolverr_settings", side_effect=[None, None, None, {}])
+        sleep = mocker.patch("anti_cf._flaresolverr.time.sleep")
+
+        assert _wait_until_ready("http://localhost:8191/", timeout=10)
+        assert [c.args[0] for c in sleep.call_args_list] == [0.05, 0.1, 0.2]
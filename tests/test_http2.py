@@ -0,0 +1,123 @@
+import gzip
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import pytest_mock
+import requests
+from requests.adapters import HTTPAdapter
+
+from anti_cf import HTTP2Adapter
+from anti_cf._persistent_session import PersistentSession
+
+_PAGE = b"<html>" + b"hello " * 1000 + b"</html>"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        body = _PAGE
+        self.send_response(200)
+        if self.path == "/cookies":
+            self.send_header("Set-Cookie", "cf_clearance=abc; Path=/")
+            self.send_header("Set-Cookie", "other=def; Path=/")
+        elif self.path == "/gzip":
+            body = gzip.compress(_PAGE)
+            self.send_header("Content-Encoding", "gzip")
+        elif self.path == "/slow":
+            time.sleep(1)
+        elif self.path == "/truncated":
+            self.send_header("Content-Length", str(len(body) * 2))
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+            return
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def origin() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session() -> Iterator[requests.Session]:
+    pytest.importorskip("httpx")
+    pytest.importorskip("h2")
+    with requests.Session() as session:
+        session.mount("http://", HTTP2Adapter())
+        yield session
+
+
+def test_response_and_cookies(session: requests.Session, origin: str) -> None:
+    response = session.request("GET", f"{origin}/cookies")
+
+    assert (response.status_code, response.reason) == (200, "OK")
+    assert response.content == _PAGE
+    assert response.headers["Content-Type"] == "text/html"
+    assert session.cookies.get_dict() == {"cf_clearance": "abc", "other": "def"}
+
+
+def test_compressed_and_streamed_bodies(session: requests.Session, origin: str) -> None:
+    assert session.request("GET", f"{origin}/gzip").content == _PAGE
+
+    with session.request("GET", f"{origin}/gzip", stream=True) as response:
+        assert b"".join(response.iter_content(100)) == _PAGE
+
+
+def test_errors_are_requests_exceptions(session: requests.Session, origin: str) -> None:
+    with pytest.raises(requests.ReadTimeout):
+        session.request("GET", f"{origin}/slow", timeout=0.2)
+
+    with pytest.raises(requests.ConnectionError):
+        session.request("GET", "http://127.0.0.1:9/")
+
+
+def test_body_errors_are_requests_exceptions(session: requests.Session, origin: str) -> None:
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        session.request("GET", f"{origin}/truncated")
+
+    with session.request("GET", f"{origin}/truncated", stream=True) as response, pytest.raises(requests.exceptions.ChunkedEncodingError):
+        b"".join(response.iter_content(100))
+
+
+def test_needs_httpx(mocker: pytest_mock.MockerFixture) -> None:
+    mocker.patch.dict("sys.modules", {"httpx": None})
+
+    with pytest.raises(ImportError, match="httpx"):
+        HTTP2Adapter()
+
+
+class TestSessionTransport:
+    @pytest.fixture(autouse=True)
+    def _dont_check_flaresolverr_settings(self, mocker: pytest_mock.MockerFixture) -> None:
+        mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+
+    def test_pool_settings(self) -> None:
+        ps = PersistentSession(pool_connections=4, pool_maxsize=64, pool_block=True)
+
+        for prefix in ("http://", "https://"):
+            adapter = ps.adapters[prefix]
+            assert isinstance(adapter, HTTPAdapter)
+            assert (adapter._pool_connections, adapter._pool_maxsize, adapter._pool_block) == (4, 64, True)
+
+    def test_http2_is_for_https_only(self) -> None:
+        pytest.importorskip("httpx")
+        ps = PersistentSession(http2=True)
+
+        assert isinstance(ps.adapters["https://"], HTTP2Adapter)
+        assert isinstance(ps.adapters["http://"], HTTPAdapter)
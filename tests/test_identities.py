@@ -0,0 +1,123 @@
+import threading
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+import pytest_mock
+
+from anti_cf import IdentityPool
+from anti_cf._persistent_session import PersistentSession
+
+
+@pytest.fixture(autouse=True)
+def _dont_check_flaresolverr_settings(mocker: pytest_mock.MockerFixture) -> None:
+    mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value={"userAgent": "FlareSolverr's UA"})
+    mocker.patch("anti_cf._persistent_session.ensure_flaresolverr_running")
+
+
+def _record_requests(pool: IdentityPool, response: MagicMock) -> list[str]:
+    """Make every identity answer with ``response``, logging which identity sent each request."""
+    used: list[str] = []
+    lock = threading.Lock()
+    for ps in pool.sessions:
+
+        def request(*_args: object, _name: str = ps.identity, **_kwargs: object) -> MagicMock:
+            with lock:
+                used.append(_name)
+            return response
+
+        ps.request = ps.get = request
+    return used
+
+
+def test_identities_persist_separately(tmp_path: Path) -> None:
+    with IdentityPool(["a", "b"]) as pool:
+        pool.sessions[0].cookies.set("cf_clearance", "for-a", domain="example.com")
+        user_agents = [ps.headers["User-Agent"] for ps in pool.sessions]
+
+    assert all(ua != "FlareSolverr's UA" for ua in user_agents)
+    assert (tmp_path / "identities/a/cookies.pkl").exists()
+    assert (tmp_path / "identities/b/user_agent.txt").read_text() == user_agents[1]
+
+    with IdentityPool(["a", "b"]) as pool:
+        assert [ps.headers["User-Agent"] for ps in pool.sessions] == user_agents
+        assert [ps._clearance_for("https://example.com/") for ps in pool.sessions] == ["for-a", None]
+
+
+def test_solve_adopts_the_browsers_user_agent(mocker: pytest_mock.MockerFixture, cloudflare_response: MagicMock) -> None:
+    ps = PersistentSession(identity="a")
+    cloudflare_response.json.return_value["solution"]["userAgent"] = "Solving browser"
+    mocker.patch.object(ps, "post", return_value=cloudflare_response)
+
+    ps._get_url_via_flaresolverr("https://example.com/")
+
+    assert ps.headers["User-Agent"] == "Solving browser"
+    assert ps._USER_AGENT_FILE.read_text() == "Solving browser"
+
+
+def test_lru_rotates_per_host(standard_response: MagicMock) -> None:
+    pool = IdentityPool(3)
+    used = _record_requests(pool, standard_response)
+
+    for i in range(6):
+        pool.get(f"https://example.com/{i}")
+    pool.get("https://other.example.com/")
+
+    assert used == ["0", "1", "2", "0", "1", "2", "0"]
+
+
+def test_session_for_counts_as_use(standard_response: MagicMock) -> None:
+    pool = IdentityPool(2)
+    used = _record_requests(pool, standard_response)
+
+    assert pool.session_for("https://example.com/login").identity == "0"
+    pool.get("https://example.com/")
+
+    assert used == ["1"]
+
+
+def test_budget_waits_for_a_free_identity(standard_response: MagicMock) -> None:
+    pool = IdentityPool(2, strategy="budget", budget=2, budget_window=0.5)
+    used = _record_requests(pool, standard_response)
+
+    start = time.monotonic()
+    for _ in range(4):
+        pool.get("https://example.com/")
+    assert time.monotonic() - start < 0.4
+    assert sorted(used) == ["0", "0", "1", "1"]
+
+    pool.get("https://example.com/")
+    assert time.monotonic() - start >= 0.5
+
+
+def test_budget_is_not_spent_on_cache_hits(standard_response: MagicMock) -> None:
+    standard_response.from_cache = True
+    pool = IdentityPool(1, strategy="budget", budget=1, budget_window=60)
+    used = _record_requests(pool, standard_response)
+
+    start = time.monotonic()
+    for _ in range(3):
+        pool.get("https://example.com/")
+
+    assert len(used) == 3
+    assert time.monotonic() - start < 1
+
+
+def test_lru_keeps_only_the_latest_requests(standard_response: MagicMock) -> None:
+    pool = IdentityPool(2)
+    used = _record_requests(pool, standard_response)
+
+    for _ in range(1000):
+        pool.get("https://example.com/")
+
+    assert len(used) == 1000
+    assert max(len(sent) for sent in pool._sent.values()) <= 2
+
+
+@pytest.mark.parametrize(
+    ("kwargs", "message"), [({"identities": 0}, "at least one identity"), ({"strategy": "budget"}, "budget"), ({"strategy": "random"}, "strategy")]
+)
+def test_invalid_configuration(kwargs: dict, message: str) -> None:
+    with pytest.raises(ValueError, match=message):
+        IdentityPool(**kwargs)
@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest_mock
+
+_SRC = Path(__file__).parent.parent / "src"
+# conftest replaces ``subprocess.Popen`` for every test so docker never starts;
+# this module needs the real thing to get a fresh interpreter.
+_Popen = subprocess.Popen
+
+_PROBE = """
+import json
+import socket
+import sys
+
+connections = []
+_connect = socket.socket.connect
+
+
+def connect(self, address):
+    connections.append(repr(address))
+    return _connect(self, address)
+
+
+socket.socket.connect = connect
+
+import anti_cf
+
+print(json.dumps({"connections": connections, "modules": sorted(sys.modules)}))
+"""
+
+
+def test_import_has_no_side_effects(tmp_path: Path) -> None:
+    """``import anti_cf`` must not touch the network or the cache directory, nor load ``fake_useragent`` or ``httpx``."""
+    env = {**os.environ, "HOME": str(tmp_path), "USERPROFILE": str(tmp_path), "PYTHONPATH": str(_SRC)}
+    with _Popen([sys.executable, "-c", _PROBE], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as proc:
+        stdout, stderr = proc.communicate(timeout=60)
+    assert proc.returncode == 0, stderr
+
+    report = json.loads(stdout.strip().splitlines()[-1])
+    assert report["connections"] == []
+    assert "fake_useragent" not in report["modules"]
+    assert "httpx" not in report["modules"]
+    assert not (tmp_path / ".cache").exists()
+
+
+def test_module_session_is_built_on_first_use(mocker: pytest_mock.MockerFixture) -> None:
+    from anti_cf._persistent_session import PersistentSession, _LazySession
+
+    lazy = _LazySession()
+    init = mocker.spy(PersistentSession, "__init__")
+    assert "not created yet" in repr(lazy)
+    init.assert_not_called()
+
+    assert "User-Agent" in lazy.headers
+    assert isinstance(lazy, PersistentSession)
+    init.assert_called_once()
+
+    lazy.max_redirects = 5
+    assert lazy._get_instance().max_redirects == 5
+    init.assert_called_once()
@@ -0,0 +1,144 @@
+import threading
+from collections.abc import Callable, Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import pytest_mock
+from requests import HTTPError
+
+from anti_cf import FlareSolverrPool, Metrics, PersistentSession
+from anti_cf._metrics import Histogram
+
+_BODY = b"x" * 1000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(_BODY)))
+        self.end_headers()
+        self.wfile.write(_BODY)
+
+
+@pytest.fixture
+def origin_url() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ps(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> PersistentSession:
+    mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+    mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+    mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+    return PersistentSession()
+
+
+class TestHistogram:
+    def test_quantiles_round_up_to_a_bucket_bound(self) -> None:
+        histogram = Histogram((0.1, 1.0, 10.0))
+        for value in (0.05, 0.2, 0.3, 0.4, 5.0):
+            histogram.observe(value)
+
+        assert histogram.counts == [1, 3, 1, 0]
+        assert histogram.quantile(0.5) == 1.0
+        assert histogram.quantile(0.95) == 10.0
+        assert histogram.summary() == {"count": 5, "mean": 1.19, "p50": 1.0, "p95": 10.0, "max": 5.0}
+
+    def test_above_the_last_bucket(self) -> None:
+        histogram = Histogram((0.1,))
+        histogram.observe(42.0)
+
+        assert histogram.quantile(0.5) == 42.0
+
+    def test_empty(self) -> None:
+        assert Histogram().summary() == {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+
+def test_prometheus_text_format() -> None:
+    metrics = Metrics()
+    metrics.record_challenge('we"ird.example.com')
+    metrics.record_solve(3.0, ok=True)
+    metrics.record_solve(7.0, ok=False)
+
+    text = metrics.to_prometheus()
+
+    assert text.endswith("\n")
+    assert "# TYPE anti_cf_challenges_total counter" in text
+    assert 'anti_cf_challenges_total{host="we\\"ird.example.com"} 1' in text
+    assert 'anti_cf_solves_total{result="ok"} 1' in text
+    assert 'anti_cf_solves_total{result="error"} 1' in text
+    assert "# TYPE anti_cf_solve_duration_seconds histogram" in text
+    # Buckets are cumulative and end with +Inf.
+    assert 'anti_cf_solve_duration_seconds_bucket{le="2.5"} 0' in text
+    assert 'anti_cf_solve_duration_seconds_bucket{le="5.0"} 1' in text
+    assert 'anti_cf_solve_duration_seconds_bucket{le="10.0"} 2' in text
+    assert 'anti_cf_solve_duration_seconds_bucket{le="+Inf"} 2' in text
+    assert "anti_cf_solve_duration_seconds_sum 10.0" in text
+    assert "anti_cf_solve_duration_seconds_count 2" in text
+
+
+class TestSessionMetrics:
+    def test_origin_responses(self, ps: PersistentSession, origin_url: str) -> None:
+        ps.request("GET", origin_url)
+
+        stats = ps.stats()
+        assert stats["cache"]["misses"] == 1
+        assert stats["bytes_received"] == len(_BODY)
+        assert stats["origin_latency"]["count"] == 1
+
+    def test_cache_hits(self, ps: PersistentSession, origin_url: str) -> None:
+        pytest.importorskip("requests_cache")
+
+        ps.request("GET", origin_url)
+        ps.request("GET", origin_url)
+        ps._cached_response(origin_url + "missing")
+
+        assert ps.stats()["cache"] == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+    def test_streamed_bodies_count_their_announced_length(self, ps: PersistentSession, origin_url: str) -> None:
+        ps.request("GET", origin_url, stream=True, headers={"Cache-Control": "no-store"})
+
+        assert ps.stats()["bytes_received"] == len(_BODY)
+
+    def test_solves(self, flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        ps = PersistentSession(flaresolverr_pool=FlareSolverrPool([stub.url]))
+
+        ps._get_url_via_flaresolverr("https://example.com/")
+
+        stats = ps.stats()
+        assert stats["solves"] == {"ok": 1, "error": 0}
+        assert stats["solve_latency"]["count"] == 1
+        # Talking to FlareSolverr isn't fetching from the origin.
+        assert stats["cache"]["misses"] == 0
+
+    def test_challenges(self, ps: PersistentSession, cloudflare_error: HTTPError) -> None:
+        assert ps._is_cloudflare_challenge(cloudflare_error, try_with_cloudflare=True)
+
+        assert ps.stats()["challenges"] == {"example.com": 1}
+
+    def test_cookie_saves(self, ps: PersistentSession) -> None:
+        ps.save_cookies()
+
+        assert ps.stats()["cookie_save_time"]["count"] == 1
+
+    def test_sessions_can_share_metrics(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        metrics = Metrics()
+        sessions = [PersistentSession(metrics=metrics, identity=str(i)) for i in range(2)]
+
+        for session in sessions:
+            session.save_cookies()
+
+        assert metrics.stats()["cookie_save_time"]["count"] == 2
@@ -1,4 +1,5 @@
 import pickle
+import sqlite3
 from collections.abc import Mapping
 from pathlib import Path
 from typing import TYPE_CHECKING
@@ -7,6 +8,7 @@ from unittest.mock import MagicMock
 import pytest
 import pytest_mock
 from requests import HTTPError
+from requests.exceptions import InvalidURL
 
 from anti_cf._persistent_session import PersistentSession, session
 
@@ -134,6 +136,152 @@ def test_request_saves_cookies(mocker: pytest_mock.MockerFixture) -> None:
     assert mock_save.called
 
 
+class TestDebouncedCookieSaving:
+    """Cover the ``cookie_save_interval`` persistence mode."""
+
+    def test_request_does_not_write_cookies(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = PersistentSession(cookie_save_interval=3600)
+        mock_save = mocker.patch.object(ps, "save_cookies")
+        mocker.patch("requests.Session.request", return_value=mocker.MagicMock())
+
+        ps.request("GET", "https://example.com")
+
+        mock_save.assert_not_called()
+        ps.close()
+
+    def test_flush_only_writes_when_dirty(self) -> None:
+        ps = PersistentSession(cookie_save_interval=3600)
+        ps.flush_cookies()
+        assert not PersistentSession._COOKIES_FILE.exists()
+
+        ps.cookies.set("test_cookie", "test_value", domain="example.com")
+        assert ps.cookies.dirty
+        ps.flush_cookies()
+
+        assert not ps.cookies.dirty
+        loaded_cookies = pickle.loads(PersistentSession._COOKIES_FILE.read_bytes())
+        assert "test_cookie" in loaded_cookies.get_dict("example.com")
+        ps.close()
+
+    def test_close_flushes_pending_changes(self) -> None:
+        ps = PersistentSession(cookie_save_interval=3600)
+        ps.cookies.set("test_cookie", "test_value", domain="example.com")
+        assert not PersistentSession._COOKIES_FILE.exists()
+
+        ps.close()
+
+        loaded_cookies = pickle.loads(PersistentSession._COOKIES_FILE.read_bytes())
+        assert "test_cookie" in loaded_cookies.get_dict("example.com")
+
+    def test_background_flusher_writes_changes(self) -> None:
+        import time
+
+        ps = PersistentSession(cookie_save_interval=0.01)
+        ps.cookies.set("test_cookie", "test_value", domain="example.com")
+
+        deadline = time.monotonic() + 5
+        while not PersistentSession._COOKIES_FILE.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert PersistentSession._COOKIES_FILE.exists()
+        assert not ps.cookies.dirty
+        ps.close()
+
+    def test_loaded_cookies_are_not_dirty(self) -> None:
+        ps = PersistentSession()
+        ps.cookies.set("test_cookie", "test_value", domain="example.com")
+        ps.save_cookies()
+
+        assert not PersistentSession(cookie_save_interval=3600).cookies.dirty
+
+    def test_merging_from_disk_keeps_pending_changes(self) -> None:
+        PersistentSession().save_cookies()
+        ps = PersistentSession(cookie_save_interval=3600)
+        ps.cookies.set("pending", "value", domain="example.com")
+
+        ps._load_cookies()
+
+        assert ps.cookies.dirty
+        ps.flush_cookies()
+        assert "pending" in pickle.loads(PersistentSession._COOKIES_FILE.read_bytes()).get_dict("example.com")
+        ps.close()
+
+
+class TestSQLiteCookieStore:
+    """Cover ``cookie_store="sqlite"``: cookies shared between sessions (and processes) through one database."""
+
+    def test_cookies_are_shared_without_reloading(self) -> None:
+        writer = PersistentSession(cookie_store="sqlite")
+        reader = PersistentSession(cookie_store="sqlite")
+
+        writer.cookies.set("cf_clearance", "first", domain="example.com")
+        assert reader.cookies.get("cf_clearance", domain="example.com") == "first"
+
+        writer.cookies.set("cf_clearance", "second", domain="example.com")
+        assert reader.cookies.get("cf_clearance", domain="example.com") == "second"
+
+        writer.cookies.clear("example.com")
+        assert "cf_clearance" not in reader.cookies
+
+    def test_a_stale_session_does_not_clobber_other_cookies(self) -> None:
+        first = PersistentSession(cookie_store="sqlite")
+        second = PersistentSession(cookie_store="sqlite")
+
+        first.cookies.set("cf_clearance", "fresh", domain="a.example.com")
+        second.cookies.set("session", "mine", domain="b.example.com")
+        second.save_cookies()
+
+        cookies = PersistentSession(cookie_store="sqlite").cookies
+        assert cookies.get("cf_clearance", domain="a.example.com") == "fresh"
+        assert cookies.get("session", domain="b.example.com") == "mine"
+        assert not PersistentSession._COOKIES_FILE.exists()
+
+    def test_cookie_attributes_survive(self) -> None:
+        import time
+
+        expires = int(time.time()) + 3600
+        PersistentSession(cookie_store="sqlite").cookies.set(
+            "cf_clearance", "abc", domain=".example.com", path="/app", secure=True, expires=expires, rest={"HttpOnly": None}
+        )
+
+        (cookie,) = PersistentSession(cookie_store="sqlite").cookies
+        assert (cookie.domain, cookie.path, cookie.secure, cookie.expires) == (".example.com", "/app", True, expires)
+        assert cookie.has_nonstandard_attr("HttpOnly")
+
+    def test_cookie_file_seeds_an_empty_database(self) -> None:
+        ps = PersistentSession()
+        ps.cookies.set("cf_clearance", "from_file", domain="example.com")
+        ps.save_cookies()
+
+        assert PersistentSession(cookie_store="sqlite").cookies.get("cf_clearance") == "from_file"
+
+        PersistentSession(cookie_store="sqlite").cookies.set("cf_clearance", "from_db", domain="example.com")
+        assert PersistentSession(cookie_store="sqlite").cookies.get("cf_clearance") == "from_db"
+
+    def test_requests_do_not_write_the_whole_jar(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = PersistentSession(cookie_store="sqlite")
+        mocker.patch("requests.Session.request", return_value=mocker.MagicMock())
+        dumps = mocker.spy(pickle, "dumps")
+
+        ps.request("GET", "https://example.com")
+
+        dumps.assert_not_called()
+
+    def test_close_closes_the_database(self) -> None:
+        ps = PersistentSession(cookie_store="sqlite")
+        ps.cookies.set("cf_clearance", "abc", domain="example.com")
+
+        ps.close()
+
+        with pytest.raises(sqlite3.ProgrammingError, match="closed"):
+            ps.cookies._db.execute("SELECT 1")
+        assert PersistentSession(cookie_store="sqlite").cookies.get("cf_clearance") == "abc"
+
+    def test_unknown_cookie_store(self) -> None:
+        with pytest.raises(ValueError, match="Unknown cookie store"):
+            PersistentSession(cookie_store="redis")  # type: ignore[arg-type]
+
+
 def test_get_method_simple(standard_response: MagicMock, mocker: pytest_mock.MockerFixture) -> None:
     """Test simple GET request without cloudflare."""
     # Setup
@@ -264,6 +412,375 @@ def test_get_url_direct(mocker: pytest_mock.MockerFixture, cloudflare_response:
     assert "cf_clearance" not in ps.cookies
 
 
+_FLARESOLVERR_SOLUTION = {
+    "solution": {
+        "url": "https://example.com/page",
+        "status": 200,
+        "headers": {"content-type": "text/html; charset=utf-8", "content-encoding": "br", "content-length": "3"},
+        "response": "<html>héllo</html>",
+        "cookies": [],
+    }
+}
+
+
+class TestSolutionResponse:
+    """Cover answering a solved challenge from FlareSolverr's own result."""
+
+    def test_returns_solution_without_refetch(self, mocker: pytest_mock.MockerFixture, tmp_path: Path) -> None:
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        ps = PersistentSession(refetch_after_solve=False)
+        mocker.patch.object(ps, "_solve_challenge", return_value=_FLARESOLVERR_SOLUTION)
+        refetch = mocker.patch.object(ps, "_get_without_cloudflare")
+
+        resp = ps.get("https://example.com/page", try_with_cloudflare=True)
+
+        refetch.assert_not_called()
+        assert resp.status_code == 200
+        assert resp.text == "<html>héllo</html>"
+        assert resp.url == "https://example.com/page"
+        assert "content-encoding" not in resp.headers
+        assert resp.headers["Content-Length"] == str(len("<html>héllo</html>".encode()))
+
+    def test_solution_is_cached(self, mocker: pytest_mock.MockerFixture, tmp_path: Path) -> None:
+        pytest.importorskip("requests_cache")
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        ps = PersistentSession(refetch_after_solve=False)
+        mocker.patch.object(ps, "_solve_challenge", return_value=_FLARESOLVERR_SOLUTION)
+
+        ps.get("https://example.com/page", try_with_cloudflare=True)
+
+        cached = ps.get("https://example.com/page")
+        assert cached.from_cache
+        assert cached.text == "<html>héllo</html>"
+
+    def test_per_call_refetch_overrides_session(self, mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+        ps = PersistentSession(refetch_after_solve=False)
+        mocker.patch.object(ps, "_solve_challenge", return_value=_FLARESOLVERR_SOLUTION)
+        refetch = mocker.patch.object(ps, "_get_without_cloudflare", return_value=standard_response)
+
+        assert ps.get("https://example.com/page", try_with_cloudflare=True, refetch_after_solve=True) == standard_response
+        refetch.assert_called_once()
+
+    def test_refetches_when_solved_elsewhere(self, mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+        """A caller that reused someone else's clearance has no solution body to return."""
+        ps = PersistentSession(refetch_after_solve=False)
+        mocker.patch.object(ps, "_solve_challenge", return_value=None)
+        mocker.patch.object(ps, "_get_without_cloudflare", return_value=standard_response)
+
+        assert ps.get("https://example.com/page", try_with_cloudflare=True) == standard_response
+
+
+class TestSingleFlightSolve:
+    """Concurrent challenges for one host must trigger a single FlareSolverr solve."""
+
+    def test_threads_share_one_solve(self, mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+        import threading
+        import time
+
+        ps = PersistentSession()
+        solves: list[str] = []
+
+        def solve(url: str) -> dict:
+            solves.append(url)
+            time.sleep(0.1)
+            ps.cookies.set("cf_clearance", f"solved-{len(solves)}", domain="example.com")
+            return {}
+
+        mocker.patch.object(ps, "_get_url_via_flaresolverr", side_effect=solve)
+        mocker.patch.object(ps, "_get_without_cloudflare", return_value=standard_response)
+
+        results: list[object] = []
+        threads = [threading.Thread(target=lambda i=i: results.append(ps.get(f"https://example.com/{i}", try_with_cloudflare=True))) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == [standard_response] * 8
+        assert len(solves) == 1
+
+    def test_different_hosts_solve_independently(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = PersistentSession()
+        solver = mocker.patch.object(ps, "_get_url_via_flaresolverr", return_value={})
+
+        ps._solve_challenge("https://one.example.com/")
+        ps._solve_challenge("https://two.example.com/")
+
+        assert solver.call_count == 2
+
+    def test_reuses_clearance_solved_by_another_process(self, mocker: pytest_mock.MockerFixture) -> None:
+        """A second session (standing in for another process) picks the clearance up from the shared cookie file."""
+        import threading
+        import time
+
+        solver_started = threading.Event()
+        release_solver = threading.Event()
+
+        first = PersistentSession()
+
+        def solve(_url: str) -> dict:
+            solver_started.set()
+            release_solver.wait(5)
+            first.cookies.set("cf_clearance", "from-first", domain="example.com")
+            first.save_cookies()
+            return {"solution": {}}
+
+        mocker.patch.object(first, "_get_url_via_flaresolverr", side_effect=solve)
+
+        second = PersistentSession()
+        second_solver = mocker.patch.object(second, "_get_url_via_flaresolverr", return_value={})
+
+        first_thread = threading.Thread(target=first._solve_challenge, args=("https://example.com/",))
+        first_thread.start()
+        assert solver_started.wait(5)
+
+        result: list[object] = []
+        second_thread = threading.Thread(target=lambda: result.append(second._solve_challenge("https://example.com/")))
+        second_thread.start()
+        time.sleep(0.2)  # let the second session queue up on the lock file
+        release_solver.set()
+        first_thread.join()
+        second_thread.join()
+
+        second_solver.assert_not_called()
+        assert result == [None]
+        assert second._clearance_for("https://example.com/") == "from-first"
+
+
+class TestClearanceRefresh:
+    """Cover re-solving a host's challenge before its ``cf_clearance`` expires."""
+
+    def _session(self, *, expires_in: float, used_ago: float = 0.0) -> PersistentSession:
+        import time
+
+        ps = PersistentSession(clearance_refresh_margin=300, clearance_refresh_window=600)
+        ps._clearance_refresher_stop.set()
+        ps.cookies.set("cf_clearance", "old", domain="example.com", expires=int(time.time() + expires_in))
+        ps._track_clearance("https://example.com/page")
+        ps._last_used["example.com"] = time.time() - used_ago
+        return ps
+
+    def test_tracks_expiry_of_solved_clearance(self) -> None:
+        ps = self._session(expires_in=3600)
+
+        assert ps._clearances["example.com"].url == "https://example.com/page"
+        assert ps._refresh_due_clearances() == pytest.approx(60, abs=1)
+
+    def test_not_tracked_when_disabled_or_without_expiry(self) -> None:
+        ps = PersistentSession()
+        ps.cookies.set("cf_clearance", "old", domain="example.com", expires=2**31 - 1)
+        ps._track_clearance("https://example.com/")
+        assert ps._clearances == {}
+
+        ps = self._session(expires_in=3600)
+        ps.cookies.set("cf_clearance", "session-only", domain="example.com")
+        ps._track_clearance("https://example.com/")
+        assert ps._clearances == {}
+
+    def test_waits_until_margin_before_expiry(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = self._session(expires_in=330)
+        solve = mocker.patch.object(ps, "_solve_challenge")
+
+        assert ps._refresh_due_clearances() == pytest.approx(30, abs=1)
+        solve.assert_not_called()
+
+    def test_refreshes_due_clearance_of_used_host(self, mocker: pytest_mock.MockerFixture) -> None:
+        import time
+
+        ps = self._session(expires_in=120, used_ago=60)
+
+        def solve(url: str) -> None:
+            ps.cookies.set("cf_clearance", "new", domain="example.com", expires=int(time.time() + 3600))
+            ps._track_clearance(url)
+
+        solver = mocker.patch.object(ps, "_solve_challenge", side_effect=solve)
+
+        ps._refresh_due_clearances()
+
+        solver.assert_called_once_with("https://example.com/page")
+        assert ps._clearance_for("https://example.com/") == "new"
+        assert ps._clearances["example.com"].expires > time.time() + 3000
+
+    def test_unused_host_is_left_to_expire(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = self._session(expires_in=120, used_ago=3600)
+        solve = mocker.patch.object(ps, "_solve_challenge")
+
+        ps._refresh_due_clearances()
+
+        solve.assert_not_called()
+        assert ps._clearances == {}
+
+    def test_failed_refresh_is_retried_later(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = self._session(expires_in=120)
+        solve = mocker.patch.object(ps, "_solve_challenge", side_effect=ConnectionError("FlareSolverr is down"))
+
+        assert ps._refresh_due_clearances() == pytest.approx(60, abs=1)
+        ps._refresh_due_clearances()
+
+        solve.assert_called_once()
+
+    def test_refresh_without_a_later_expiry_backs_off(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = self._session(expires_in=120)
+        expires = ps._clearances["example.com"].expires
+
+        def solve(url: str) -> None:
+            ps.cookies.set("cf_clearance", "new", domain="example.com", expires=int(expires))
+            ps._track_clearance(url)
+
+        solver = mocker.patch.object(ps, "_solve_challenge", side_effect=solve)
+
+        assert ps._refresh_due_clearances() == pytest.approx(60, abs=1)
+        ps._refresh_due_clearances()
+
+        solver.assert_called_once()
+        assert "example.com" in ps._clearances
+
+    def test_requests_mark_host_as_used(self, mocker: pytest_mock.MockerFixture, standard_response: MagicMock) -> None:
+        import time
+
+        ps = self._session(expires_in=3600, used_ago=3600)
+        mocker.patch("requests.Session.request", return_value=standard_response)
+
+        ps.request("GET", "https://example.com/other")
+
+        assert ps._last_used["example.com"] == pytest.approx(time.time(), abs=5)
+
+
+class TestGetMany:
+    """Cover bulk fetching with ``get_many``."""
+
+    @staticmethod
+    def _fake_get(mocker: pytest_mock.MockerFixture, ps: PersistentSession, delays: dict[str, float] | None = None) -> dict[str, int]:
+        """Answer every ``get`` with its URL after a delay, and track the peak concurrency per host (``"*"`` overall)."""
+        import threading
+        import time
+        from urllib.parse import urlsplit
+
+        lock = threading.Lock()
+        current: dict[str, int] = {}
+        peak: dict[str, int] = {}
+
+        def get(url: str, **_kwargs: object) -> str:
+            keys = ("*", urlsplit(url).hostname)
+            with lock:
+                for key in keys:
+                    current[key] = current.get(key, 0) + 1
+                    peak[key] = max(peak.get(key, 0), current[key])
+            time.sleep((delays or {}).get(url, 0.01))
+            with lock:
+                for key in keys:
+                    current[key] -= 1
+            if "fail" in url:
+                raise ConnectionError(url)
+            return f"response for {url}"
+
+        mocker.patch.object(ps, "get", side_effect=get)
+        mocker.patch.object(ps, "_cached_response", return_value=None)
+        return peak
+
+    def test_yields_results_as_they_complete(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = PersistentSession()
+        self._fake_get(mocker, ps, {"https://a.com/slow": 0.3})
+
+        results = list(ps.get_many(["https://a.com/slow", "https://b.com/fast", "https://c.com/fail"]))
+
+        assert results[-1] == ("https://a.com/slow", "response for https://a.com/slow")
+        assert dict(results[:2])["https://b.com/fast"] == "response for https://b.com/fast"
+        assert isinstance(dict(results[:2])["https://c.com/fail"], ConnectionError)
+
+    def test_ordered_keeps_input_order(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = PersistentSession()
+        self._fake_get(mocker, ps, {"https://a.com/0": 0.2, "https://a.com/3": 0.1})
+        urls = [f"https://a.com/{i}" for i in range(10)]
+
+        assert [url for url, _ in ps.get_many(urls, ordered=True)] == urls
+
+    def test_bounds_workers_and_hosts(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = PersistentSession()
+        peak = self._fake_get(mocker, ps)
+        urls = [f"https://host{i % 3}.com/{i}" for i in range(60)]
+
+        results = list(ps.get_many(urls, max_workers=6, per_host=1))
+
+        assert sorted(url for url, _ in results) == sorted(urls)
+        assert peak["*"] <= 3
+        assert all(peak[f"host{i}.com"] == 1 for i in range(3))
+
+    def test_reads_urls_lazily(self, mocker: pytest_mock.MockerFixture) -> None:
+        import itertools
+
+        ps = PersistentSession()
+        self._fake_get(mocker, ps)
+        taken = 0
+
+        def urls() -> "Iterator[str]":
+            nonlocal taken
+            for i in itertools.count():
+                taken += 1
+                yield f"https://a.com/{i}"
+
+        results = ps.get_many(urls(), max_workers=4)
+        for _ in range(20):
+            next(results)
+        results.close()
+
+        assert taken <= 20 + 2 * 4
+
+    def test_cache_hits_skip_the_workers(self, mocker: pytest_mock.MockerFixture) -> None:
+        ps = PersistentSession()
+        self._fake_get(mocker, ps)
+        mocker.patch.object(ps, "_cached_response", side_effect=lambda url, **_kwargs: "cached" if url.endswith("/cached") else None)
+
+        results = dict(ps.get_many(["https://a.com/cached", "https://a.com/fresh"]))
+
+        assert results == {"https://a.com/cached": "cached", "https://a.com/fresh": "response for https://a.com/fresh"}
+        ps.get.assert_called_once_with("https://a.com/fresh", try_with_cloudflare=True)
+
+    def test_get_only_arguments_stay_out_of_the_cache_lookup(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        pytest.importorskip("requests_cache")
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        ps = PersistentSession()
+        get = mocker.patch.object(ps, "get", return_value="fetched")
+
+        results = dict(ps.get_many(["https://example.com/page"], refetch_after_solve=False))
+
+        assert results == {"https://example.com/page": "fetched"}
+        get.assert_called_once_with("https://example.com/page", try_with_cloudflare=True, refetch_after_solve=False)
+
+    def test_invalid_url_is_its_own_result(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        pytest.importorskip("requests_cache")
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        ps = PersistentSession()
+        mocker.patch.object(ps, "get", return_value="fetched")
+
+        results = dict(ps.get_many(["not a url", "https://example.com/page"], ordered=True))
+
+        assert isinstance(results["not a url"], InvalidURL)
+        assert results["https://example.com/page"] == "fetched"
+
+    def test_cached_response_only_reads_the_cache(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+        pytest.importorskip("requests_cache")
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        ps = PersistentSession()
+        request = mocker.spy(ps, "request")
+        send = mocker.patch("requests.Session.send")
+
+        assert ps._cached_response("https://example.com/page") is None
+        assert request.call_args.kwargs["only_if_cached"] is True
+
+        ps._response_from_solution("https://example.com/page", _FLARESOLVERR_SOLUTION["solution"])
+        cached = ps._cached_response("https://example.com/page")
+
+        assert cached.from_cache
+        assert cached.text == "<html>héllo</html>"
+        send.assert_not_called()
+
+
 def test_cache_read_succeeds_under_concurrent_exclusive_writer(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
     """
     Regression for ``sqlite3.OperationalError: database is locked``.
@@ -0,0 +1,172 @@
+import io
+import threading
+import time
+from email.utils import formatdate
+from pathlib import Path
+
+import pytest
+import pytest_mock
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3 import HTTPResponse
+
+from anti_cf import RateLimiter
+from anti_cf._rate_limit import RateLimitedAdapter, retry_after
+
+
+def _response(status: int = 200, **headers: str) -> Response:
+    response = Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = b""
+    return response
+
+
+def test_token_bucket_paces_requests() -> None:
+    limiter = RateLimiter(20, burst=1)
+
+    start = time.monotonic()
+    for _ in range(5):
+        with limiter.acquire("example.com"):
+            pass
+
+    assert time.monotonic() - start == pytest.approx(0.2, abs=0.1)
+    assert limiter.stats()["example.com"]["waited"] > 0.1
+
+
+def test_hosts_are_paced_independently() -> None:
+    limiter = RateLimiter(1, burst=1)
+
+    start = time.monotonic()
+    for host in ("a.example.com", "b.example.com", "c.example.com"):
+        with limiter.acquire(host):
+            pass
+
+    assert time.monotonic() - start < 0.5
+
+
+def test_concurrency_is_capped_across_threads() -> None:
+    limiter = RateLimiter(1000, burst=1000, concurrency=2)
+    in_flight, peak = 0, 0
+    lock = threading.Lock()
+
+    def work() -> None:
+        nonlocal in_flight, peak
+        with limiter.acquire("example.com"):
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert peak == 2
+    assert limiter.stats()["example.com"]["requests"] == 8
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        _response(429),
+        _response(503, **{"Retry-After": "0"}),
+        _response(403, **{"cf-mitigated": "challenge"}),
+    ],
+    ids=["429", "503 with Retry-After", "challenge"],
+)
+def test_backs_off_multiplicatively_and_recovers_additively(response: Response) -> None:
+    limiter = RateLimiter(4, concurrency=8, rate_step=1)
+
+    limiter.record("example.com", response)
+    stats = limiter.stats()["example.com"]
+    assert (stats["rate"], stats["concurrency"], stats["throttled"]) == (2, 4, 1)
+
+    limiter.record("example.com", _response(200))
+    assert limiter.stats()["example.com"]["rate"] == 3
+    for _ in range(50):
+        limiter.record("example.com", _response(200))
+    stats = limiter.stats()["example.com"]
+    assert (stats["rate"], stats["concurrency"]) == (4, 8)
+
+
+def test_plain_errors_are_not_throttling() -> None:
+    limiter = RateLimiter(4)
+
+    for status in (404, 500, 503):
+        limiter.record("example.com", _response(status))
+
+    assert limiter.stats()["example.com"]["throttled"] == 0
+
+
+def test_retry_after_pauses_the_host() -> None:
+    limiter = RateLimiter(100, burst=100)
+
+    limiter.record("example.com", _response(429, **{"Retry-After": "1"}))
+    assert limiter.stats()["example.com"]["blocked_for"] == pytest.approx(1, abs=0.1)
+
+    start = time.monotonic()
+    with limiter.acquire("example.com"):
+        pass
+    assert time.monotonic() - start >= 0.9
+
+
+def test_retry_after_formats() -> None:
+    assert retry_after(_response(429, **{"Retry-After": "120"})) == 120
+    assert retry_after(_response(429, **{"Retry-After": formatdate(time.time() + 60, usegmt=True)})) == pytest.approx(60, abs=2)
+    assert retry_after(_response(429, **{"Retry-After": "soon"})) is None
+    assert retry_after(_response(429)) is None
+
+
+class TestSessionIntegration:
+    class _Origin(BaseAdapter):
+        def __init__(self, status: int) -> None:
+            super().__init__()
+            self.status = status
+            self.sent = 0
+
+        def send(self, request: PreparedRequest, *_args: object, **_kwargs: object) -> Response:
+            self.sent += 1
+            response = _response(self.status, **{"Content-Type": "text/plain"})
+            response.raw = HTTPResponse(body=io.BytesIO(b""), headers=response.headers, status=self.status, preload_content=False, request_url=request.url)
+            response.url = request.url
+            response.request = request
+            return response
+
+        def close(self) -> None:
+            pass
+
+    @pytest.fixture
+    def session(self, tmp_path: Path, mocker: pytest_mock.MockerFixture) -> object:
+        from anti_cf._persistent_session import PersistentSession
+
+        mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+        mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+        mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+        return PersistentSession(rate_limiter=RateLimiter(10))
+
+    def test_requests_go_through_the_limiter(self, session: object) -> None:
+        session.mount("https://", self._Origin(429))
+
+        assert session.request("GET", "https://example.com/").status_code == 429
+        assert session.rate_limiter.stats()["example.com"]["throttled"] == 1
+
+    def test_flaresolverr_is_not_limited(self, session: object) -> None:
+        assert isinstance(session.get_adapter("https://example.com/"), RateLimitedAdapter)
+        assert not isinstance(session.get_adapter(session._flaresolverr_pool.backends[0].url + "v1"), RateLimitedAdapter)
+
+    def test_cache_hits_are_not_limited(self, session: object) -> None:
+        pytest.importorskip("requests_cache")
+        origin = self._Origin(200)
+        session.mount("https://", origin)
+
+        session.request("GET", "https://example.com/")
+        session.request("GET", "https://example.com/")
+
+        assert origin.sent == 1
+        assert session.rate_limiter.stats()["example.com"]["requests"] == 1
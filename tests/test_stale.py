@@ -0,0 +1,202 @@
+import threading
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import pytest_mock
+from requests import Request
+
+from anti_cf import NEVER_EXPIRE
+from anti_cf._persistent_session import PersistentSession
+
+pytest.importorskip("requests_cache")
+
+from anti_cf._cache import ResponsesDict
+
+
+@dataclass
+class Origin:
+    """A page whose body and status can be changed, counting the requests it gets."""
+
+    url: str = ""
+    body: bytes = b"v1"
+    status: int = 200
+    delay: float = 0.0
+    hits: int = 0
+    # Set to let a delayed response through.
+    release: threading.Event = field(default_factory=threading.Event)
+    server: ThreadingHTTPServer | None = None
+
+    def handler(self) -> type[BaseHTTPRequestHandler]:
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_args: object) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                origin.hits += 1
+                if origin.delay:
+                    origin.release.wait(origin.delay)
+                self.send_response(origin.status)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(origin.body)))
+                self.end_headers()
+                self.wfile.write(origin.body)
+
+        return Handler
+
+
+@pytest.fixture
+def origin() -> Iterator[Origin]:
+    origin = Origin()
+    origin.server = server = ThreadingHTTPServer(("127.0.0.1", 0), origin.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin.url = f"http://127.0.0.1:{server.server_address[1]}/page"
+    yield origin
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_session(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> Iterator[Callable[..., PersistentSession]]:
+    mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+    mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+    mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+    # These tests talk to a real local server: undo conftest's stand-in for ``Session.get``.
+    mocker.patch("requests.Session.get", lambda self, url, **kwargs: self.request("GET", url, **kwargs))
+    sessions = []
+
+    def make(**kwargs: object) -> PersistentSession:
+        sessions.append(PersistentSession(**kwargs))
+        return sessions[-1]
+
+    yield make
+    for session in sessions:
+        session.close()
+
+
+def _expire(ps: PersistentSession, url: str, *, seconds_ago: float) -> None:
+    """Make the cached response for ``url`` have expired ``seconds_ago``."""
+    key = ps.cache.create_key(ps.prepare_request(Request("GET", url)))
+    ps.cache.save_response(ps.cache.get_response(key), key, datetime.now(UTC) - timedelta(seconds=seconds_ago))
+
+
+def _wait_for_revalidation(ps: PersistentSession) -> None:
+    ps._revalidator.shutdown(wait=True)
+    ps._revalidator = None
+
+
+class TestStaleWhileRevalidate:
+    def test_serves_stale_and_refreshes_in_background(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_while_revalidate={"127.0.0.1": 60})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=10)
+        origin.body = b"v2"
+
+        stale = ps.get(origin.url)
+        _wait_for_revalidation(ps)
+
+        assert stale.content == b"v1"
+        assert stale.is_expired
+        assert origin.hits == 2
+        fresh = ps.get(origin.url)
+        assert fresh.content == b"v2"
+        assert not fresh.is_expired
+        assert origin.hits == 2
+        assert ps.stats()["stale"] == {"while_revalidate": 1, "if_error": 0}
+
+    def test_one_refresh_for_many_callers(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_while_revalidate={"127.0.0.1": 60})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=10)
+        origin.delay = 5.0
+
+        responses = [ps.get(origin.url) for _ in range(5)]
+        origin.release.set()
+        _wait_for_revalidation(ps)
+
+        assert [r.content for r in responses] == [b"v1"] * 5
+        assert origin.hits == 2
+
+    def test_past_the_window_fetches(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_while_revalidate={"127.0.0.1": 60})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=120)
+        origin.body = b"v2"
+
+        assert ps.get(origin.url).content == b"v2"
+        assert ps._revalidator is None
+
+    def test_window_per_url_pattern(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_while_revalidate={"127.0.0.1/other": NEVER_EXPIRE})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=10)
+        origin.body = b"v2"
+
+        assert ps.get(origin.url).content == b"v2"
+
+    def test_fresh_hits_are_loaded_once(self, make_session: Callable[..., PersistentSession], origin: Origin, mocker: pytest_mock.MockerFixture) -> None:
+        ps = make_session(stale_while_revalidate={"127.0.0.1": 60}, stale_if_error={"127.0.0.1": 60})
+        ps.get(origin.url)
+        deserialize = mocker.spy(ResponsesDict, "deserialize")
+
+        assert ps.get(origin.url).from_cache
+
+        assert deserialize.call_count == 1
+
+
+class TestStaleIfError:
+    def test_origin_error(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_if_error={"127.0.0.1": timedelta(hours=1)})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=10)
+        origin.status, origin.body = 503, b"down"
+
+        response = ps.get(origin.url)
+
+        assert response.content == b"v1"
+        assert response.is_expired
+        assert origin.hits == 2
+        assert ps.stats()["stale"] == {"while_revalidate": 0, "if_error": 1}
+
+    def test_connection_error(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_if_error={"127.0.0.1": NEVER_EXPIRE})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=86400)
+        origin.server.shutdown()
+        origin.server.server_close()
+
+        assert ps.get(origin.url).content == b"v1"
+
+    def test_failed_solve(self, make_session: Callable[..., PersistentSession], origin: Origin, mocker: pytest_mock.MockerFixture) -> None:
+        ps = make_session(stale_if_error={"127.0.0.1": 60})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=10)
+        origin.status = 403
+        mocker.patch.object(ps, "_is_cloudflare_challenge", return_value=True)
+        mocker.patch.object(ps, "_solve_challenge", side_effect=RuntimeError("FlareSolverr is down"))
+
+        assert ps.get(origin.url, try_with_cloudflare=True).content == b"v1"
+
+    def test_client_errors_are_not_covered(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_if_error={"127.0.0.1": 60})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=10)
+        origin.status = 404
+
+        assert ps.get(origin.url) is None
+
+    def test_past_the_window_fails(self, make_session: Callable[..., PersistentSession], origin: Origin) -> None:
+        ps = make_session(stale_if_error={"127.0.0.1": 60})
+        ps.get(origin.url)
+        _expire(ps, origin.url, seconds_ago=120)
+        origin.status = 503
+
+        assert ps.get(origin.url) is None
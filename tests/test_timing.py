@@ -0,0 +1,170 @@
+import threading
+from collections.abc import Callable, Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+import pytest_mock
+
+from anti_cf import FlareSolverrPool, PersistentSession, Phase, RateLimiter
+from anti_cf._timing import phase, traced
+
+
+class TestTracing:
+    def test_phases_nest(self) -> None:
+        with traced() as timings, phase("get", "https://example.com/"):
+            with phase("request"), phase("origin", "https://example.com/redirected"):
+                pass
+            with phase("solve"):
+                pass
+
+        assert [(p.name, p.url, p.depth) for p in timings.phases] == [
+            ("origin", "https://example.com/redirected", 2),
+            ("request", "https://example.com/", 1),
+            ("solve", "https://example.com/", 1),
+            ("get", "https://example.com/", 0),
+        ]
+        assert timings.total("get") >= timings.total("request") + timings.total("solve")
+        assert set(timings.as_dict()) == {"get", "request", "origin", "solve"}
+
+    def test_nested_traces_share_the_timings(self) -> None:
+        with traced() as outer, phase("get", "https://example.com/"), traced() as inner, phase("request"):
+            pass
+
+        assert inner is outer
+        assert [p.name for p in outer.phases] == ["request", "get"]
+
+    def test_errors_are_recorded(self) -> None:
+        with pytest.raises(ValueError), traced() as timings, phase("request", "https://example.com/"):
+            raise ValueError
+
+        assert timings.phases[0].error == "ValueError"
+
+    def test_hook_gets_every_phase(self) -> None:
+        seen: list[Phase] = []
+        with traced(seen.append) as timings, phase("get", "https://example.com/"), phase("request"):
+            pass
+
+        assert seen == timings.phases
+
+    def test_failing_hook_is_logged(self, mock_logger: dict[str, MagicMock]) -> None:
+        def hook(_phase: Phase) -> None:
+            raise RuntimeError("exporter down")
+
+        with traced(hook) as timings, phase("get", "https://example.com/"):
+            pass
+
+        assert len(timings.phases) == 1
+        assert "exporter down" in mock_logger["error"].call_args[0][0]
+
+    def test_untraced_phases_are_ignored(self) -> None:
+        with phase("request", "https://example.com/"):
+            pass
+
+        with traced() as timings:
+            pass
+        assert timings.phases == []
+
+
+class _Origin:
+    """Challenges the first ``challenges`` requests, then serves a page."""
+
+    def __init__(self, challenges: int = 0) -> None:
+        self.challenges = challenges
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_args: object) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                challenged = origin.challenges > 0
+                origin.challenges -= 1
+                body = b"<title>Just a moment...</title>" if challenged else b"hello"
+                self.send_response(403 if challenged else 200)
+                if challenged:
+                    self.send_header("cf-mitigated", "challenge")
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+
+@pytest.fixture
+def origin() -> Iterator[Callable[..., _Origin]]:
+    origins: list[_Origin] = []
+
+    def factory(challenges: int = 0) -> _Origin:
+        origins.append(_Origin(challenges))
+        return origins[-1]
+
+    yield factory
+    for o in origins:
+        o.server.shutdown()
+        o.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def _session_setup(tmp_path: Path, mocker: pytest_mock.MockerFixture) -> None:
+    mocker.patch("anti_cf._persistent_session.CACHE_PATH", tmp_path)
+    mocker.patch("anti_cf._persistent_session.get_flaresolverr_settings", return_value=None)
+    mocker.patch.object(PersistentSession, "_auto_purge_if_due", autospec=True)
+    # These tests talk to real local servers: undo conftest's stand-in for ``Session.get``.
+    mocker.patch("requests.Session.get", lambda self, url, **kwargs: self.request("GET", url, **kwargs))
+
+
+class TestSessionTimings:
+    def test_request(self, origin: Callable[..., _Origin]) -> None:
+        seen: list[Phase] = []
+        ps = PersistentSession(timing_hook=seen.append)
+        url = origin().url
+
+        response = ps.request("GET", url)
+
+        names = [p.name for p in response.timings.phases]
+        assert names[-1] == "request"
+        assert {"origin", "cookie_save"} <= set(names)
+        assert seen == response.timings.phases
+        assert all(p.url == url for p in seen if p.name != "cookie_save")
+
+    def test_cache_phases(self, origin: Callable[..., _Origin]) -> None:
+        pytest.importorskip("requests_cache")
+        ps = PersistentSession()
+        url = origin().url
+
+        first = ps.request("GET", url)
+        second = ps.request("GET", url)
+
+        assert {"cache_lookup", "origin", "cache_write"} <= set(first.timings.as_dict())
+        assert "cache_lookup" in second.timings.as_dict()
+        assert "origin" not in second.timings.as_dict()
+
+    def test_get_through_a_challenge(self, origin: Callable[..., _Origin], flaresolverr_stub: Callable) -> None:
+        stub = flaresolverr_stub()
+        ps = PersistentSession(flaresolverr_pool=FlareSolverrPool([stub.url]), cache_policies={"127.0.0.1": 0})
+        url = origin(challenges=1).url
+        ps.cookies.set("cf_clearance", "stale", domain="127.0.0.1")
+
+        response = ps.get(url, try_with_cloudflare=True)
+
+        assert response.text == "hello"
+        timings = response.timings
+        assert {"get", "request", "origin", "challenge_detection", "solve", "flaresolverr", "refetch"} <= set(timings.as_dict())
+        assert timings.phases[-1].name == "get"
+        assert timings.phases[-1].duration >= timings.total("solve") + timings.total("refetch")
+        # The call to FlareSolverr is timed as such, not as a fetch from the origin.
+        assert all(p.url == url for p in timings.phases if p.name == "origin")
+
+    def test_rate_limit_wait(self, origin: Callable[..., _Origin]) -> None:
+        ps = PersistentSession(rate_limiter=RateLimiter(rate=100), cache_policies={"127.0.0.1": 0})
+
+        response = ps.request("GET", origin().url)
+
+        assert "rate_limit_wait" in response.timings.as_dict()